@@ -1,51 +1,21 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import requests
 import os
-from io import StringIO
-from scipy.interpolate import griddata
-
-def interpolate_to_grid(data, lon_min, lon_max, lat_min, lat_max, grid_size):
-    rows, cols = grid_size
-    grid_x = np.linspace(lon_min, lon_max, cols)
-    grid_y = np.linspace(lat_min, lat_max, rows)
-    grid_x, grid_y = np.meshgrid(grid_x, grid_y)
-    grid_z = griddata((data['x'], data['y']), data['value'], (grid_x, grid_y), method='cubic')
-
-    nan_mask = np.isnan(grid_z)
-    if np.any(nan_mask):
-        grid_z[nan_mask] = griddata((data['x'], data['y']), data['value'], (grid_x[nan_mask], grid_y[nan_mask]), method='nearest')
-
-    return grid_x, grid_y, grid_z
-
-def resample_to_target_size(x, y, z, target_shape, lon_min, lon_max, lat_min, lat_max):
-    rows, cols = target_shape
-    resample_x = np.linspace(lon_min, lon_max, cols)
-    resample_y = np.linspace(lat_min, lat_max, rows)
-    resample_x, resample_y = np.meshgrid(resample_x, resample_y)
-    resample_z = griddata((x.flatten(), y.flatten()), z.flatten(), (resample_x, resample_y), method='cubic')
-
-    nan_mask = np.isnan(resample_z)
-    if np.any(nan_mask):
-        resample_z[nan_mask] = griddata((x.flatten(), y.flatten()), z.flatten(), (resample_x[nan_mask], resample_y[nan_mask]), method='nearest')
-
-    return resample_x, resample_y, resample_z
+from grav_triangulation import interpolate_with_triangulation
+from grav_pyramid import read_pyramid_roi
+from tile_cache import dataset_version
+from stage_timing import stage
+from raster_preview import show_grid, grid_extent
+from precision import point_dtypes
+from grid_spec import grid_resolution, grid_shape, output_shape, resample_grid
+from local_kriging import krige_to_grid
+from downloader import read_table
 
 def plot_subplots(grid_x1, grid_y1, grid_z1, title1, grid_x2, grid_y2, grid_z2, title2):
     fig, axs = plt.subplots(1, 2, figsize=(16, 8))
 
-    c1 = axs[0].contourf(grid_x1, grid_y1, grid_z1, cmap='viridis', levels=100)
-    fig.colorbar(c1, ax=axs[0], label='Gravity Value (milligal)')
-    axs[0].set_xlabel('Longitude')
-    axs[0].set_ylabel('Latitude')
-    axs[0].set_title(title1)
-
-    c2 = axs[1].contourf(grid_x2, grid_y2, grid_z2, cmap='viridis', levels=100)
-    fig.colorbar(c2, ax=axs[1], label='Gravity Value (milligal)')
-    axs[1].set_xlabel('Longitude')
-    axs[1].set_ylabel('Latitude')
-    axs[1].set_title(title2)
+    show_grid(axs[0], grid_z1, grid_extent(grid_x1, grid_y1), title1, label='Gravity Value (milligal)')
+    show_grid(axs[1], grid_z2, grid_extent(grid_x2, grid_y2), title2, label='Gravity Value (milligal)')
 
     plt.tight_layout()
     plt.show()
@@ -66,6 +36,13 @@ expanded_lon_min, expanded_lon_max = longitude_min - 0.3, longitude_max + 0.3
 
 survey_name = input("Enter the name of the survey: ")
 
+# Shape (rows, cols) of the saved gravity grids; AIRBORNE_GRID_SHAPE overrides it
+OUTPUT_SHAPE = output_shape((1486, 2116))
+
+# Gridder: "triangulation" (cubic, national triangulation or pyramid) or "kriging"
+# (local_kriging.py, also saves a standard-error grid)
+GRIDDER = os.environ.get("AIRBORNE_GRAVITY_GRIDDER", "triangulation")
+
 # Load Bouguer and Isostatic data
 datasets = {
     "Bouguer": "https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/USbougerGravData.xyz",
@@ -75,12 +52,40 @@ datasets = {
 cropped_results = {}
 
 for key, url in datasets.items():
-    data = pd.read_csv(url, sep='\s+', header=None, names=['x', 'y', 'value'])
-    filtered_data = data[(data['x'] >= expanded_lon_min) & (data['x'] <= expanded_lon_max) &
-                         (data['y'] >= expanded_lat_min) & (data['y'] <= expanded_lat_max)]
-
-    # Interpolate on expanded area
-    grid_x, grid_y, grid_z = interpolate_to_grid(filtered_data, expanded_lon_min, expanded_lon_max, expanded_lat_min, expanded_lat_max, grid_size=(int(1486*1.2), int(2116*1.2)))
+    with stage("load", source=url) as record:
+        data = read_table(url, record=record, sep='\s+', header=None, names=['x', 'y', 'value'], dtype=point_dtypes())
+        record["rows_out"] = 0 if data is None else len(data)
+    if data is None:
+        continue
+
+    # Size the grid from the station spacing in the expanded area (grid_spec.py)
+    expanded = (expanded_lon_min, expanded_lon_max, expanded_lat_min, expanded_lat_max)
+    nearby = data[data['x'].between(expanded_lon_min, expanded_lon_max) & data['y'].between(expanded_lat_min, expanded_lat_max)]
+    resolution = grid_resolution(*expanded, nearby['y'].to_numpy(), nearby['x'].to_numpy())
+
+    if GRIDDER == "kriging":
+        # Stations around the ROI are enough for the local neighbourhoods
+        roi = (longitude_min, longitude_max, latitude_min, latitude_max)
+        grid_x, grid_y, grid_z, grid_var = krige_to_grid(nearby, *roi, grid_size=grid_shape(*roi, resolution))
+        resample_x, resample_y, resample_z = resample_grid(grid_x, grid_y, grid_z, OUTPUT_SHAPE, *roi)
+        stderr = resample_grid(grid_x, grid_y, np.sqrt(grid_var), OUTPUT_SHAPE, *roi)[2]
+        cropped_results[key] = (resample_x, resample_y, resample_z)
+        with stage("save", rows_in=resample_z.size):
+            save_to_txt(resample_x, resample_y, resample_z, f"{survey_name}_{key}_cropped_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
+            save_to_txt(resample_x, resample_y, stderr, f"{survey_name}_{key}_stderr_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
+        continue
+
+    # Serve the ROI straight from the national grid pyramid if one was built for this data
+    served = read_pyramid_roi(key, longitude_min, longitude_max, latitude_min, latitude_max, resolution=resolution, version=dataset_version(data))
+    if served is not None:
+        served = resample_grid(*served, OUTPUT_SHAPE, longitude_min, longitude_max, latitude_min, latitude_max)
+        cropped_results[key] = served
+        with stage("save", rows_in=served[2].size):
+            save_to_txt(*served, f"{survey_name}_{key}_cropped_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
+        continue
+
+    # Interpolate on expanded area from the saved national triangulation (built on first use)
+    grid_x, grid_y, grid_z = interpolate_with_triangulation(data, key, expanded_lon_min, expanded_lon_max, expanded_lat_min, expanded_lat_max, grid_size=grid_shape(*expanded, resolution))
 
     # Crop based on actual user ROI
     crop_mask_x = (grid_x[0, :] >= longitude_min) & (grid_x[0, :] <= longitude_max)
@@ -89,14 +94,16 @@ for key, url in datasets.items():
     cropped_grid_y = grid_y[np.ix_(crop_mask_y, crop_mask_x)]
     cropped_grid_z = grid_z[np.ix_(crop_mask_y, crop_mask_x)]
 
-    # Resample cropped area to exactly (1486, 2116)
-    resample_x, resample_y, resample_z = resample_to_target_size(cropped_grid_x, cropped_grid_y, cropped_grid_z, (1486, 2116), longitude_min, longitude_max, latitude_min, latitude_max)
+    # Resample cropped area to exactly the output shape
+    resample_x, resample_y, resample_z = resample_grid(cropped_grid_x, cropped_grid_y, cropped_grid_z, OUTPUT_SHAPE, longitude_min, longitude_max, latitude_min, latitude_max)
 
     cropped_results[key] = (resample_x, resample_y, resample_z)
-    save_to_txt(resample_x, resample_y, resample_z, f"{survey_name}_{key}_cropped_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
+    with stage("save", rows_in=resample_z.size):
+        save_to_txt(resample_x, resample_y, resample_z, f"{survey_name}_{key}_cropped_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
 
 # Plot both datasets as subplots
-plot_subplots(
-    cropped_results["Bouguer"][0], cropped_results["Bouguer"][1], cropped_results["Bouguer"][2], f"Bouguer Anomaly ({survey_name})",
-    cropped_results["Isostatic"][0], cropped_results["Isostatic"][1], cropped_results["Isostatic"][2], f"Isostatic Anomaly ({survey_name})"
-)
+with stage("plot"):
+    plot_subplots(
+        cropped_results["Bouguer"][0], cropped_results["Bouguer"][1], cropped_results["Bouguer"][2], f"Bouguer Anomaly ({survey_name})",
+        cropped_results["Isostatic"][0], cropped_results["Isostatic"][1], cropped_results["Isostatic"][2], f"Isostatic Anomaly ({survey_name})"
+    )
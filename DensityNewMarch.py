@@ -1,38 +1,18 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import requests
 import os
-from io import StringIO
-from scipy.interpolate import griddata
-
-def interpolate_to_grid(data, lon_min, lon_max, lat_min, lat_max, grid_size=(2116, 1486)):
-    rows, cols = grid_size
-    grid_x = np.linspace(lon_min, lon_max, cols)
-    grid_y = np.linspace(lat_min, lat_max, rows)
-    grid_x, grid_y = np.meshgrid(grid_x, grid_y)
-    grid_z = griddata((data['x'], data['y']), data['value'], (grid_x, grid_y), method='cubic')
-    
-    nan_mask = np.isnan(grid_z)
-    if np.any(nan_mask):
-        grid_z[nan_mask] = griddata((data['x'], data['y']), data['value'], (grid_x[nan_mask], grid_y[nan_mask]), method='nearest')
-    
-    return grid_x, grid_y, grid_z
+from grav_triangulation import interpolate_with_triangulation
+from stage_timing import stage
+from raster_preview import show_grid, grid_extent
+from precision import point_dtypes
+from grid_spec import grid_resolution, grid_shape, output_shape, resample_grid
+from downloader import read_table
 
 def plot_subplots(grid_x1, grid_y1, grid_z1, title1, grid_x2, grid_y2, grid_z2, title2):
     fig, axs = plt.subplots(1, 2, figsize=(16, 8))
     
-    c1 = axs[0].contourf(grid_x1, grid_y1, grid_z1, cmap='viridis', levels=100)
-    fig.colorbar(c1, ax=axs[0], label='Gravity Value (milligal)')
-    axs[0].set_xlabel('Longitude')
-    axs[0].set_ylabel('Latitude')
-    axs[0].set_title(title1)
-    
-    c2 = axs[1].contourf(grid_x2, grid_y2, grid_z2, cmap='viridis', levels=100)
-    fig.colorbar(c2, ax=axs[1], label='Gravity Value (milligal)')
-    axs[1].set_xlabel('Longitude')
-    axs[1].set_ylabel('Latitude')
-    axs[1].set_title(title2)
+    show_grid(axs[0], grid_z1, grid_extent(grid_x1, grid_y1), title1, label='Gravity Value (milligal)')
+    show_grid(axs[1], grid_z2, grid_extent(grid_x2, grid_y2), title2, label='Gravity Value (milligal)')
     
     plt.tight_layout()
     plt.show()
@@ -62,22 +42,35 @@ datasets = {
 cropped_results = {}
 
 for key, url in datasets.items():
-    data = pd.read_csv(url, sep='\s+', header=None, names=['x', 'y', 'value'])
-    filtered_data = data[(data['x'] >= expanded_lon_min) & (data['x'] <= expanded_lon_max) &
-                         (data['y'] >= expanded_lat_min) & (data['y'] <= expanded_lat_max)]
-    
-    grid_x, grid_y, grid_z = interpolate_to_grid(filtered_data, expanded_lon_min, expanded_lon_max, expanded_lat_min, expanded_lat_max)
+    with stage("load", source=url) as record:
+        data = read_table(url, record=record, sep='\s+', header=None, names=['x', 'y', 'value'], dtype=point_dtypes())
+        record["rows_out"] = 0 if data is None else len(data)
+    if data is None:
+        continue
+    # Size the grid from the station spacing in the expanded area (grid_spec.py)
+    expanded = (expanded_lon_min, expanded_lon_max, expanded_lat_min, expanded_lat_max)
+    nearby = data[data['x'].between(expanded_lon_min, expanded_lon_max) & data['y'].between(expanded_lat_min, expanded_lat_max)]
+    resolution = grid_resolution(*expanded, nearby['y'].to_numpy(), nearby['x'].to_numpy())
+
+    # Evaluate the saved national triangulation (built on first use) over the expanded area
+    grid_x, grid_y, grid_z = interpolate_with_triangulation(data, key, *expanded, grid_size=grid_shape(*expanded, resolution))
     
     crop_mask_x = (grid_x[0, :] >= longitude_min) & (grid_x[0, :] <= longitude_max)
     crop_mask_y = (grid_y[:, 0] >= latitude_min) & (grid_y[:, 0] <= latitude_max)
     cropped_grid_x, cropped_grid_y = grid_x[np.ix_(crop_mask_y, crop_mask_x)], grid_y[np.ix_(crop_mask_y, crop_mask_x)]
     cropped_grid_z = grid_z[np.ix_(crop_mask_y, crop_mask_x)]
     
+    # Resample only if AIRBORNE_GRID_SHAPE asks for a fixed output shape
+    cropped_grid_x, cropped_grid_y, cropped_grid_z = resample_grid(cropped_grid_x, cropped_grid_y, cropped_grid_z, output_shape(),
+                                                                   longitude_min, longitude_max, latitude_min, latitude_max)
+    
     cropped_results[key] = (cropped_grid_x, cropped_grid_y, cropped_grid_z)
-    save_to_txt(cropped_grid_x, cropped_grid_y, cropped_grid_z, f"{survey_name}_{key}_cropped_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
+    with stage("save", rows_in=cropped_grid_z.size):
+        save_to_txt(cropped_grid_x, cropped_grid_y, cropped_grid_z, f"{survey_name}_{key}_cropped_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
 
 # Plot both datasets as subplots
-plot_subplots(
-    cropped_results["Bouguer"][0], cropped_results["Bouguer"][1], cropped_results["Bouguer"][2], f"Bouguer Anomaly ({survey_name})",
-    cropped_results["Isostatic"][0], cropped_results["Isostatic"][1], cropped_results["Isostatic"][2], f"Isostatic Anomaly ({survey_name})"
-)
+with stage("plot"):
+    plot_subplots(
+        cropped_results["Bouguer"][0], cropped_results["Bouguer"][1], cropped_results["Bouguer"][2], f"Bouguer Anomaly ({survey_name})",
+        cropped_results["Isostatic"][0], cropped_results["Isostatic"][1], cropped_results["Isostatic"][2], f"Isostatic Anomaly ({survey_name})"
+    )
@@ -1,16 +1,26 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import requests
 import os
 from io import StringIO
-from scipy.interpolate import griddata
+from downloader import fetch, open_text
+from tile_cache import grid_roi_cached, dataset_version
+from grid_spec import grid_resolution, output_shape, resample_grid
+from precision import point_dtypes
+from stage_timing import stage, size_of
+from raster_preview import show_grid, grid_extent
+from idw_preview import preview_tree, choose_roi
 
 # Function to load XYZ file from GitHub repository
 def load_xyz_from_github(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        xyz_data = response.text
+    with stage("download", source=url) as record:
+        path = fetch(url, record=record)
+    if path is None:
+        return None
+
+    with stage("parse") as record:
+        with open_text(path) as handle:
+            xyz_data = handle.read()
         cleaned_data = []
 
         # Track malformed lines
@@ -36,14 +46,13 @@ def load_xyz_from_github(url):
 
         # Load into pandas
         try:
-            df = pd.read_csv(StringIO(cleaned_xyz_data), sep='\s+', header=None, names=['x', 'y', 'value'])
-            return df
+            df = pd.read_csv(StringIO(cleaned_xyz_data), sep='\s+', header=None, names=['x', 'y', 'value'], dtype=point_dtypes())
         except Exception as e:
             print(f"Error reading the cleaned data: {e}")
             return None
-    else:
-        print(f"Failed to load data, status code: {response.status_code}")
-        return None
+        record["rows_in"] = len(cleaned_data) + len(malformed_lines)
+        record["rows_out"] = len(df)
+        return df
 
 # Function to get user input for the range
 def get_range_input(prompt):
@@ -60,30 +69,10 @@ def get_range_input(prompt):
         except ValueError:
             print("Invalid input. Please enter two comma-separated numbers (e.g., -117, -110).")
 
-# Function to interpolate data onto a 1114x1114 grid
-def interpolate_to_grid(data, longitude_min, longitude_max, latitude_min, latitude_max):
-    grid_x, grid_y = np.linspace(longitude_min, longitude_max, 1114), np.linspace(latitude_min, latitude_max, 1114)
-    grid_x, grid_y = np.meshgrid(grid_x, grid_y)
-
-    grid_z = griddata((data['x'], data['y']), data['value'], (grid_x, grid_y), method='cubic')
-
-    # Fill NaNs using nearest interpolation
-    nan_mask = np.isnan(grid_z)
-    if np.any(nan_mask):
-        grid_z[nan_mask] = griddata(
-            (data['x'], data['y']), data['value'], (grid_x[nan_mask], grid_y[nan_mask]), method='nearest'
-        )
-
-    return grid_x, grid_y, grid_z
-
 # Function to plot interpolated data
 def plot_data(grid_x, grid_y, grid_z, title):
-    plt.figure(figsize=(12, 10))
-    plt.contourf(grid_x, grid_y, grid_z, cmap='viridis', levels=100)
-    plt.colorbar(label='Gravity Value (milligal)')
-    plt.xlabel('Longitude')
-    plt.ylabel('Latitude')
-    plt.title(title)
+    fig, ax = plt.subplots(figsize=(12, 10))
+    show_grid(ax, grid_z, grid_extent(grid_x, grid_y), title, label='Gravity Value (milligal)')
     plt.show()
 
 # Function to save data as .txt file
@@ -94,33 +83,75 @@ def save_to_txt(grid_x, grid_y, grid_z, filename):
     np.savetxt(filepath, grid_z, fmt='%.6f', delimiter=' ', header="Interpolated gravity values grid")
     print(f"Saved: {filepath}")
 
+# Shape (rows, cols) of the saved gravity grids; AIRBORNE_GRID_SHAPE overrides it
+OUTPUT_SHAPE = output_shape((1114, 1114))
+
 # GitHub raw URLs
 url1 = "https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/USbougerGravData.xyz"
 url2 = "https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/isograv.xyz"
 
-# Get user-defined latitude and longitude ranges
-latitude_min, latitude_max = get_range_input("Enter the latitude range (min,max) (e.g., 40,42) for both plots: ")
-longitude_min, longitude_max = get_range_input("Enter the longitude range (min,max) (e.g., -114,-112) for both plots: ")
+# Load Bouguer and Isostatic gravity data
+with stage("load", source=url1) as record:
+    data1 = load_xyz_from_github(url1)
+    record["rows_out"] = size_of(data1)
+with stage("load", source=url2) as record:
+    data2 = load_xyz_from_github(url2)
+    record["rows_out"] = size_of(data2)
+
+# Get user-defined latitude and longitude ranges, previewing each one with fast IDW
+# gridding until it is confirmed; the full gridding below only runs on the chosen ROI
+lat_prompt = "Enter the latitude range (min,max) (e.g., 40,42) for both plots: "
+lon_prompt = "Enter the longitude range (min,max) (e.g., -114,-112) for both plots: "
+previews = {title: preview_tree(data, title) for title, data in (("Bouguer", data1), ("Isostatic", data2))
+            if data is not None}
+if previews:
+    latitude_min, latitude_max, longitude_min, longitude_max = choose_roi(previews, lat_prompt, lon_prompt,
+                                                                          label='Gravity Value (milligal)')
+else:
+    latitude_min, latitude_max = get_range_input(lat_prompt)
+    longitude_min, longitude_max = get_range_input(lon_prompt)
 
 # Get survey name
 survey_name1 = input("Enter the name of the survey: ")
 
-# Load, process, and plot Bouguer gravity data
-data1 = load_xyz_from_github(url1)
+# Process and plot Bouguer gravity data
 if data1 is not None:
-    filtered_data1 = data1[(data1['x'] >= longitude_min) & (data1['x'] <= longitude_max) &
-                            (data1['y'] >= latitude_min) & (data1['y'] <= latitude_max)]
+    with stage("clean", rows_in=len(data1)) as record:
+        filtered_data1 = data1[(data1['x'] >= longitude_min) & (data1['x'] <= longitude_max) &
+                                (data1['y'] >= latitude_min) & (data1['y'] <= latitude_max)]
+        record["rows_out"] = len(filtered_data1)
     if not filtered_data1.empty:
-        grid_x, grid_y, grid_z = interpolate_to_grid(filtered_data1, longitude_min, longitude_max, latitude_min, latitude_max)
-        plot_data(grid_x, grid_y, grid_z, f"Bouguer Anomaly Map for {survey_name1}")
-        save_to_txt(grid_x, grid_y, grid_z, f"{survey_name1}_Bouguer_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
-
-# Load, process, and plot Isostatic gravity data
-data2 = load_xyz_from_github(url2)
+        # Node spacing from the station spacing of the whole dataset (grid_spec.py), so every
+        # ROI shares the same cached tiles
+        resolution = grid_resolution(longitude_min, longitude_max, latitude_min, latitude_max,
+                                     data1['y'].to_numpy(), data1['x'].to_numpy())
+        # Tiles are gridded from the full dataset so they can be reused by any later ROI
+        grid_x, grid_y, grid_z = grid_roi_cached(data1, longitude_min, longitude_max, latitude_min, latitude_max,
+                                                 resolution=resolution, version=dataset_version(data1))
+        grid_x, grid_y, grid_z = resample_grid(grid_x, grid_y, grid_z, OUTPUT_SHAPE,
+                                               longitude_min, longitude_max, latitude_min, latitude_max)
+        with stage("plot", rows_in=grid_z.size):
+            plot_data(grid_x, grid_y, grid_z, f"Bouguer Anomaly Map for {survey_name1}")
+        with stage("save", rows_in=grid_z.size):
+            save_to_txt(grid_x, grid_y, grid_z, f"{survey_name1}_Bouguer_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
+
+# Process and plot Isostatic gravity data
 if data2 is not None:
-    filtered_data2 = data2[(data2['x'] >= longitude_min) & (data2['x'] <= longitude_max) &
-                            (data2['y'] >= latitude_min) & (data2['y'] <= latitude_max)]
+    with stage("clean", rows_in=len(data2)) as record:
+        filtered_data2 = data2[(data2['x'] >= longitude_min) & (data2['x'] <= longitude_max) &
+                                (data2['y'] >= latitude_min) & (data2['y'] <= latitude_max)]
+        record["rows_out"] = len(filtered_data2)
     if not filtered_data2.empty:
-        grid_x, grid_y, grid_z = interpolate_to_grid(filtered_data2, longitude_min, longitude_max, latitude_min, latitude_max)
-        plot_data(grid_x, grid_y, grid_z, f"Isostatic Anomaly Map for {survey_name1}")
-        save_to_txt(grid_x, grid_y, grid_z, f"{survey_name1}_Isograv_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
+        # Node spacing from the station spacing of the whole dataset (grid_spec.py), so every
+        # ROI shares the same cached tiles
+        resolution = grid_resolution(longitude_min, longitude_max, latitude_min, latitude_max,
+                                     data2['y'].to_numpy(), data2['x'].to_numpy())
+        # Tiles are gridded from the full dataset so they can be reused by any later ROI
+        grid_x, grid_y, grid_z = grid_roi_cached(data2, longitude_min, longitude_max, latitude_min, latitude_max,
+                                                 resolution=resolution, version=dataset_version(data2))
+        grid_x, grid_y, grid_z = resample_grid(grid_x, grid_y, grid_z, OUTPUT_SHAPE,
+                                               longitude_min, longitude_max, latitude_min, latitude_max)
+        with stage("plot", rows_in=grid_z.size):
+            plot_data(grid_x, grid_y, grid_z, f"Isostatic Anomaly Map for {survey_name1}")
+        with stage("save", rows_in=grid_z.size):
+            save_to_txt(grid_x, grid_y, grid_z, f"{survey_name1}_Isograv_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
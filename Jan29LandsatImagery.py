@@ -8,6 +8,8 @@ import matplotlib.pyplot as plt
 from shapely.geometry import Polygon
 from datetime import datetime
 import os
+from precision import band_ratio
+from landsat_qa import ee_mask_collection
 
 # Initialize Earth Engine
 ee.Authenticate()
@@ -47,6 +49,8 @@ try:
 
     # Filter the image collection by the ROI
     filtered_landsat = landsat.filterBounds(RECTgeometry)
+    # Mask clouds, shadows and saturated pixels server-side before compositing
+    filtered_landsat = ee_mask_collection(filtered_landsat)
 
     # Clip the entire image collection to the ROI
     clipped_landsat = filtered_landsat.map(lambda image: image.clip(RECTgeometry))
@@ -91,9 +95,9 @@ try:
     if len(bands) != 4:
         raise Exception("One or more bands failed to download. Check error messages above.")
 
-    # Compute band ratios
-    ratio_4_5 = np.ma.divide(bands["B4"], bands["B5"])
-    ratio_5_7 = np.ma.divide(bands["B5"], bands["B7"])
+    # Compute band ratios in the working precision (float32 by default)
+    ratio_4_5 = band_ratio(bands["B4"], bands["B5"])
+    ratio_5_7 = band_ratio(bands["B5"], bands["B7"])
 
     # Save the georeferenced bands and ratios to .txt files
     def save_to_txt(data, name):
@@ -8,14 +8,21 @@ import matplotlib.pyplot as plt
 from shapely.geometry import Polygon
 from datetime import datetime
 import os
+from precision import band_ratio
+from landsat_qa import ee_mask_collection
+from landsat_composite import composite_bands
+
+# Folder of Landsat Collection 2 L2 scenes to composite locally instead of using Earth Engine
+LOCAL_SCENE_DIR = os.environ.get("AIRBORNE_LANDSAT_SCENES")
 
 # Set up authentication using your service account JSON file
 SERVICE_ACCOUNT_EMAIL = "service-account-capstone-2025@cap2025-airborneinsight.iam.gserviceaccount.com"
 KEY_FILE = r"C:\Users\19mlf3\Desktop\cap2025-airborneinsight-0312a0d58824.json"  # Path to your uploaded JSON key file
 
-# Authenticate and initialize Earth Engine
-credentials = ee.ServiceAccountCredentials(SERVICE_ACCOUNT_EMAIL, KEY_FILE)
-ee.Initialize(credentials)
+# Authenticate and initialize Earth Engine (not needed when compositing local scenes)
+if not LOCAL_SCENE_DIR:
+    credentials = ee.ServiceAccountCredentials(SERVICE_ACCOUNT_EMAIL, KEY_FILE)
+    ee.Initialize(credentials)
 
 # User input for ROI and survey name
 lat_range = input("Enter the latitude range (min,max) (e.g., 40,42): ").split(',')
@@ -43,61 +50,70 @@ output_folder = os.path.join(os.path.expanduser("~/Desktop"), "SpectralBandData"
 os.makedirs(output_folder, exist_ok=True)
 
 try:
-    # Convert GeoDataFrame to Earth Engine Geometry
-    RECTgeometry = ee.Geometry.Polygon(gdf.geometry[0].exterior.coords[:])
-
-    # Access Landsat 8 data
-    landsat = ee.ImageCollection("LANDSAT/LC08/C02/T1_L2")  # Select Landsat 8 v2
-
-    # Filter the image collection by the ROI
-    filtered_landsat = landsat.filterBounds(RECTgeometry)
-
-    # Clip the entire image collection to the ROI
-    clipped_landsat = filtered_landsat.map(lambda image: image.clip(RECTgeometry))
-
-    # Get the median image from the collection
-    median_image = clipped_landsat.median()
-
-    # Select bands
-    band4 = median_image.select("SR_B4")  # Red band
-    band5 = median_image.select("SR_B5")  # NIR band
-    band6 = median_image.select("SR_B6")  # SWIR 1
-    band7 = median_image.select("SR_B7")  # SWIR 2
-
-    # Download and read the band images into numpy arrays
-    bands = {}
-    for band_name, band in [("B4", band4), ("B5", band5), ("B6", band6), ("B7", band7)]:
-        try:
-            # Define region and visualization parameters
-            region = RECTgeometry.bounds().getInfo()
-            params = {
-                'region': region,  # Specify the ROI for the band
-                'scale': 30,       # Resolution (in meters for Landsat)
-                'format': 'GEO_TIFF',
-                'crs': 'EPSG:4326'
-            }
-
-            # Get URL and fetch the data
-            url = band.getThumbURL(params)
-            response = requests.get(url)
-            response.raise_for_status()  # Raise error for HTTP issues
-
-            # Load data into Rasterio for processing
-            with rasterio.MemoryFile(response.content) as memfile:
-                with memfile.open() as dataset:
-                    bands[band_name] = dataset.read(1)  # Read as numpy array
-            response.close()
-        except Exception as e:
-            print(f"Error fetching band {band_name}: {e}")
-            raise
+    if LOCAL_SCENE_DIR:
+        # Median composite of local scenes, chunked and in parallel (landsat_composite.py);
+        # threads rather than processes, since worker processes would re-run this script
+        bands = composite_bands(LOCAL_SCENE_DIR, (lat_min, lat_max, lon_min, lon_max),
+                                output_dir=os.path.join(output_folder, f"{current_date}_{survey_name}_composites"),
+                                processes=False) or {}
+    else:
+        # Convert GeoDataFrame to Earth Engine Geometry
+        RECTgeometry = ee.Geometry.Polygon(gdf.geometry[0].exterior.coords[:])
+
+        # Access Landsat 8 data
+        landsat = ee.ImageCollection("LANDSAT/LC08/C02/T1_L2")  # Select Landsat 8 v2
+
+        # Filter the image collection by the ROI
+        filtered_landsat = landsat.filterBounds(RECTgeometry)
+        # Mask clouds, shadows and saturated pixels server-side before compositing
+        filtered_landsat = ee_mask_collection(filtered_landsat)
+
+        # Clip the entire image collection to the ROI
+        clipped_landsat = filtered_landsat.map(lambda image: image.clip(RECTgeometry))
+
+        # Get the median image from the collection
+        median_image = clipped_landsat.median()
+
+        # Select bands
+        band4 = median_image.select("SR_B4")  # Red band
+        band5 = median_image.select("SR_B5")  # NIR band
+        band6 = median_image.select("SR_B6")  # SWIR 1
+        band7 = median_image.select("SR_B7")  # SWIR 2
+
+        # Download and read the band images into numpy arrays
+        bands = {}
+        for band_name, band in [("B4", band4), ("B5", band5), ("B6", band6), ("B7", band7)]:
+            try:
+                # Define region and visualization parameters
+                region = RECTgeometry.bounds().getInfo()
+                params = {
+                    'region': region,  # Specify the ROI for the band
+                    'scale': 30,       # Resolution (in meters for Landsat)
+                    'format': 'GEO_TIFF',
+                    'crs': 'EPSG:4326'
+                }
+
+                # Get URL and fetch the data
+                url = band.getThumbURL(params)
+                response = requests.get(url)
+                response.raise_for_status()  # Raise error for HTTP issues
+
+                # Load data into Rasterio for processing
+                with rasterio.MemoryFile(response.content) as memfile:
+                    with memfile.open() as dataset:
+                        bands[band_name] = dataset.read(1)  # Read as numpy array
+                response.close()
+            except Exception as e:
+                print(f"Error fetching band {band_name}: {e}")
+                raise
 
     # Ensure all bands were downloaded correctly before proceeding
     if len(bands) != 4:
         raise Exception("One or more bands failed to download. Check error messages above.")
 
-    # Compute band ratios
-    ratio_4_5 = np.ma.divide(bands["B4"], bands["B5"])
-    ratio_5_7 = np.ma.divide(bands["B5"], bands["B7"])
+    # Compute band ratios in the working precision (float32 by default)
+    ratio_4_5 = band_ratio(bands["B4"], bands["B5"])
+    ratio_5_7 = band_ratio(bands["B5"], bands["B7"])
 
     # Save the georeferenced bands and ratios to .txt files
     def save_to_txt(data, name):
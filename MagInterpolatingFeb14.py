@@ -3,7 +3,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 import requests
 from io import StringIO
-from scipy import interpolate
+from gridding import perform_interpolation_with_extrapolation
+from grid_spec import grid_resolution, grid_shape
+from raster_preview import show_grid, grid_extent
 
 # Input the standardized CSV filename
 file_name = "Richfield, Utah_HighDensity_2025-02-14.csv"
@@ -21,35 +23,13 @@ def load_csv_from_github():
         print(f"Failed to load data, status code: {response.status_code}")
         return None
 
-# Linear Interpolation with Nearest Neighbor Extrapolation
-def perform_interpolation_with_extrapolation(df, grid_size=100):
-    # Create grid for interpolation
-    grid_x, grid_y = np.mgrid[df['long'].min():df['long'].max():grid_size*1j,
-                               df['lat'].min():df['lat'].max():grid_size*1j]
-    
-    # Extract the x, y, and z (magnetic values) from the dataframe
-    points = np.column_stack((df['long'], df['lat']))
-    values = df['corrected_magnetic'].values
-    
-    # Perform linear interpolation using scipy's griddata (linear method)
-    grid_z = interpolate.griddata(points, values, (grid_x, grid_y), method='linear')
-    
-    # Identify NaN values in the interpolated grid
-    nan_mask = np.isnan(grid_z)
-    
-    # Apply nearest neighbor extrapolation to NaN values
-    grid_z[nan_mask] = interpolate.griddata(points, values, (grid_x[nan_mask], grid_y[nan_mask]), method='nearest')
-
-    return grid_x, grid_y, grid_z
-
 # Plot the Interpolation result with Extrapolation
 def plot_interpolation_with_extrapolation(grid_x, grid_y, grid_z):
-    plt.figure(figsize=(10, 8))
-    plt.contourf(grid_x, grid_y, grid_z, levels=100, cmap='viridis')
-    plt.colorbar(label='Interpolated Corrected Magnetic Value')
-    plt.xlabel('Longitude')
-    plt.ylabel('Latitude')
-    plt.title(f"Linear Interpolation with Nearest Neighbor Extrapolation of Corrected Magnetic Values")
+    fig, ax = plt.subplots(figsize=(10, 8))
+    # The mgrid is indexed [long, lat], so transpose to put latitude on the rows
+    show_grid(ax, grid_z.T, grid_extent(grid_x, grid_y),
+              "Linear Interpolation with Nearest Neighbor Extrapolation of Corrected Magnetic Values",
+              label='Interpolated Corrected Magnetic Value')
     plt.show()
 
 # Main Data Processing Workflow
@@ -60,8 +40,11 @@ def process_and_interpolate():
         print("Error loading data")
         return
     
-    # Step 1: Perform Linear Interpolation with Nearest Neighbor Extrapolation
-    grid_x, grid_y, grid_z = perform_interpolation_with_extrapolation(df)
+    # Step 1: Perform Linear Interpolation with Nearest Neighbor Extrapolation at a cell
+    # size from the point spacing (no line labels here, so capped to a plot-sized grid)
+    extent = (df['long'].min(), df['long'].max(), df['lat'].min(), df['lat'].max())
+    resolution = grid_resolution(*extent, df['lat'].to_numpy(), df['long'].to_numpy(), max_cells=250_000)
+    grid_x, grid_y, grid_z = perform_interpolation_with_extrapolation(df, grid_size=grid_shape(*extent, resolution))
     
     # Step 2: Plot the interpolation with extrapolated values for missing data
     plot_interpolation_with_extrapolation(grid_x, grid_y, grid_z)
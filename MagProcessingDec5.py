@@ -5,6 +5,7 @@ from shapely.geometry import Point
 import requests
 from io import StringIO
 import os
+from stage_timing import stage, size_of
 from datetime import datetime
 
 # Inputs by user 
@@ -14,12 +15,16 @@ Survey_name = "Cedar City, Utah"
 # Load CSV data from GitHub
 def load_csv_from_github():
     url = f'https://github.com/maxfollett/AirBorneInsight2/raw/main/CapDatabases/Raw/{file_name}'
-    response = requests.get(url)
+    with stage("download", source=url) as record:
+        response = requests.get(url)
+        record["bytes"] = len(response.content)
     
     if response.status_code == 200:
         csv_data = response.text
         # Skip the first row (header row with irrelevant titles) and grab lat long and corrected mag 
-        df = pd.read_csv(StringIO(csv_data), header=None, sep='\s+', usecols=[5, 6, 12], names=["lat", "long", "corrected_magnetic"])
+        with stage("parse") as record:
+            df = pd.read_csv(StringIO(csv_data), header=None, sep='\s+', usecols=[5, 6, 12], names=["lat", "long", "corrected_magnetic"])
+            record["rows_out"] = len(df)
         return df
     else:
         print(f"Failed to load data, status code: {response.status_code}")
@@ -68,7 +73,7 @@ def filter_high_density_areas(df, gridsize=30, percentile_threshold=75):
     return high_density_coords, x_min, x_max, y_min, y_max, hexbin
 
 # Generate Combined Plot with Hexbin and High-Density Rectangles
-def generate_combined_plot(df, gridsize=30, high_density_threshold=75):
+def generate_combined_plot(df, gridsize=30, high_density_threshold=75, max_points=50000):
     x = df['long']
     y = df['lat']
     
@@ -92,7 +97,9 @@ def generate_combined_plot(df, gridsize=30, high_density_threshold=75):
     plt.colorbar(hexbin_plot, label='Data Density')
 
     # Plot the survey route as points (black, small, solid)
-    plt.scatter(x, y, c='black', s=1, label='Survey Points')  # Smaller points for the survey path
+    # Thin the survey path to at most max_points so large surveys still draw quickly
+    step = max(len(x) // max_points, 1)
+    plt.scatter(x[::step], y[::step], c='black', s=1, label='Survey Points', rasterized=True)  # Smaller points for the survey path
 
     # Plot the red rectangle around the high-density region
     plt.plot([x_min, x_max, x_max, x_min, x_min],
@@ -129,23 +136,30 @@ def save_to_csv(df, Survey_name, x_min, x_max, y_min, y_max):
 
 # Main Data Processing Workflow
 def preprocess_data():
-    df = load_csv_from_github()
+    with stage("load", source=file_name) as record:
+        df = load_csv_from_github()
+        record["rows_out"] = size_of(df)
     
     if df is None:
         print("Error loading data")
         return None
     
     # Step 1: Remove Outliers in Latitude and Longitude
-    df_cleaned = remove_outliers(df)
+    with stage("clean", rows_in=len(df)) as record:
+        df_cleaned = remove_outliers(df)
+        record["rows_out"] = len(df_cleaned)
     
     # Step 2: Filter high-density areas using the 75th percentile
-    high_density_coords, x_min, x_max, y_min, y_max, hexbin = filter_high_density_areas(df_cleaned, gridsize=30, percentile_threshold=75)
+    with stage("density", rows_in=len(df_cleaned)):
+        high_density_coords, x_min, x_max, y_min, y_max, hexbin = filter_high_density_areas(df_cleaned, gridsize=30, percentile_threshold=75)
     
     # Step 3: Generate combined plot with hexbin and survey boundary
-    generate_combined_plot(df_cleaned, gridsize=30, high_density_threshold=75)
+    with stage("plot", rows_in=len(df_cleaned)):
+        generate_combined_plot(df_cleaned, gridsize=30, high_density_threshold=75)
     
     # Step 4: Save the cleaned data to CSV (only points within the high-density rectangle)
-    save_to_csv(df_cleaned, Survey_name, x_min, x_max, y_min, y_max)
+    with stage("save", rows_in=len(df_cleaned)):
+        save_to_csv(df_cleaned, Survey_name, x_min, x_max, y_min, y_max)
     
     return df_cleaned
 
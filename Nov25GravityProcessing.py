@@ -4,11 +4,15 @@ import matplotlib.pyplot as plt
 import requests
 import os
 from io import StringIO
-from scipy.interpolate import griddata
+from gridding import interpolate_to_grid
+from stage_timing import stage, size_of
+from raster_preview import show_grid, grid_extent
 
 # Function to load XYZ file from GitHub repository
 def load_xyz_from_github(url):
-    response = requests.get(url)
+    with stage("download", source=url) as record:
+        response = requests.get(url)
+        record["bytes"] = len(response.content)
     if response.status_code == 200:
         xyz_data = response.text
         cleaned_data = []
@@ -60,30 +64,13 @@ def get_range_input(prompt):
         except ValueError:
             print("Invalid input. Please enter two comma-separated numbers (e.g., -117, -110).")
 
-# Function to interpolate data onto a 1114x1114 grid
-def interpolate_to_grid(data, longitude_min, longitude_max, latitude_min, latitude_max):
-    grid_x, grid_y = np.linspace(longitude_min, longitude_max, 1114), np.linspace(latitude_min, latitude_max, 1114)
-    grid_x, grid_y = np.meshgrid(grid_x, grid_y)
-
-    grid_z = griddata((data['x'], data['y']), data['value'], (grid_x, grid_y), method='cubic')
-
-    # Fill NaNs using nearest interpolation
-    nan_mask = np.isnan(grid_z)
-    if np.any(nan_mask):
-        grid_z[nan_mask] = griddata(
-            (data['x'], data['y']), data['value'], (grid_x[nan_mask], grid_y[nan_mask]), method='nearest'
-        )
-
-    return grid_x, grid_y, grid_z
+# Shape (rows, cols) of the saved gravity grids
+GRID_SIZE = (1114, 1114)
 
 # Function to plot interpolated data
 def plot_data(grid_x, grid_y, grid_z, title):
-    plt.figure(figsize=(12, 10))
-    plt.contourf(grid_x, grid_y, grid_z, cmap='viridis', levels=100)
-    plt.colorbar(label='Gravity Value (milligal)')
-    plt.xlabel('Longitude')
-    plt.ylabel('Latitude')
-    plt.title(title)
+    fig, ax = plt.subplots(figsize=(12, 10))
+    show_grid(ax, grid_z, grid_extent(grid_x, grid_y), title, label='Gravity Value (milligal)')
     plt.show()
 
 # Function to save data as .txt file
@@ -106,21 +93,29 @@ longitude_min, longitude_max = get_range_input("Enter the longitude range (min,m
 survey_name1 = input("Enter the name of the survey: ")
 
 # Load, process, and plot Bouguer gravity data
-data1 = load_xyz_from_github(url1)
+with stage("load", source=url1) as record:
+    data1 = load_xyz_from_github(url1)
+    record["rows_out"] = size_of(data1)
 if data1 is not None:
     filtered_data1 = data1[(data1['x'] >= longitude_min) & (data1['x'] <= longitude_max) &
                             (data1['y'] >= latitude_min) & (data1['y'] <= latitude_max)]
     if not filtered_data1.empty:
-        grid_x, grid_y, grid_z = interpolate_to_grid(filtered_data1, longitude_min, longitude_max, latitude_min, latitude_max)
-        plot_data(grid_x, grid_y, grid_z, f"Bouguer Anomaly Map for {survey_name1}")
-        save_to_txt(grid_x, grid_y, grid_z, f"{survey_name1}_Bouguer_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
+        grid_x, grid_y, grid_z = interpolate_to_grid(filtered_data1, longitude_min, longitude_max, latitude_min, latitude_max, grid_size=GRID_SIZE)
+        with stage("plot"):
+            plot_data(grid_x, grid_y, grid_z, f"Bouguer Anomaly Map for {survey_name1}")
+        with stage("save", rows_in=grid_z.size):
+            save_to_txt(grid_x, grid_y, grid_z, f"{survey_name1}_Bouguer_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
 
 # Load, process, and plot Isostatic gravity data
-data2 = load_xyz_from_github(url2)
+with stage("load", source=url2) as record:
+    data2 = load_xyz_from_github(url2)
+    record["rows_out"] = size_of(data2)
 if data2 is not None:
     filtered_data2 = data2[(data2['x'] >= longitude_min) & (data2['x'] <= longitude_max) &
                             (data2['y'] >= latitude_min) & (data2['y'] <= latitude_max)]
     if not filtered_data2.empty:
-        grid_x, grid_y, grid_z = interpolate_to_grid(filtered_data2, longitude_min, longitude_max, latitude_min, latitude_max)
-        plot_data(grid_x, grid_y, grid_z, f"Isostatic Anomaly Map for {survey_name1}")
-        save_to_txt(grid_x, grid_y, grid_z, f"{survey_name1}_Isograv_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
+        grid_x, grid_y, grid_z = interpolate_to_grid(filtered_data2, longitude_min, longitude_max, latitude_min, latitude_max, grid_size=GRID_SIZE)
+        with stage("plot"):
+            plot_data(grid_x, grid_y, grid_z, f"Isostatic Anomaly Map for {survey_name1}")
+        with stage("save", rows_in=grid_z.size):
+            save_to_txt(grid_x, grid_y, grid_z, f"{survey_name1}_Isograv_{latitude_min}_{latitude_max}_{longitude_min}_{longitude_max}")
@@ -0,0 +1,159 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import scipy
+
+from gridding import perform_interpolation_with_extrapolation, interpolate_to_grid
+from grid_spec import resample_grid
+from local_kriging import krige_to_grid
+from precision import VALUE_DTYPE, broadcast_grid, grid_axes
+from stage_timing import peak_rss_mb
+from synthetic_surveys import CEDAR_CITY_EXTENT, generate_flight_line_survey, generate_gravity_stations
+
+# Scaling benchmark for the gridding paths. Every case runs in its own process so
+# peak RSS belongs to that case alone, and results are appended as JSON lines.
+#
+#   python benchmark_gridding.py --points 10000 100000 --grids 256 512
+#   python benchmark_gridding.py --compare old.jsonl new.jsonl
+
+DEFAULT_POINTS = [10_000, 100_000, 1_000_000, 10_000_000]
+DEFAULT_GRIDS = [256, 512, 1024, 2048, 4096]
+GRIDDING_PATHS = ["perform_interpolation_with_extrapolation", "interpolate_to_grid", "resample_grid",
+                  "krige_to_grid"]
+
+# Function to run one benchmark case; executed inside a child process
+def run_case(path, n_points, grid, seed, queue):
+    lat_min, lat_max, long_min, long_max = CEDAR_CITY_EXTENT
+    if path == "perform_interpolation_with_extrapolation":
+        data = generate_flight_line_survey(n_points, seed=seed)
+        call = lambda: perform_interpolation_with_extrapolation(data, grid_size=(grid, grid))
+    elif path == "interpolate_to_grid":
+        data = generate_gravity_stations(n_points, seed=seed)
+        call = lambda: interpolate_to_grid(data, long_min, long_max, lat_min, lat_max, grid_size=(grid, grid))
+    elif path == "krige_to_grid":
+        data = generate_gravity_stations(n_points, seed=seed)
+        call = lambda: krige_to_grid(data, long_min, long_max, lat_min, lat_max, grid_size=(grid, grid))
+    else:
+        # Resampling starts from a regular grid holding n_points cells
+        side = max(int(np.sqrt(n_points)), 2)
+        x, y = broadcast_grid(*grid_axes(long_min, long_max, lat_min, lat_max, (side, side)))
+        z = (np.sin(x * 7.0) + np.cos(y * 5.0)).astype(VALUE_DTYPE)
+        call = lambda: resample_grid(x, y, z, (grid, grid), long_min, long_max, lat_min, lat_max)
+
+    rss_before = peak_rss_mb()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    call()
+    wall = time.perf_counter() - start_wall
+    queue.put({
+        "wall_s": wall,
+        "cpu_s": time.process_time() - start_cpu,
+        "peak_rss_mb": peak_rss_mb(),
+        "input_rss_mb": rss_before,
+        "points_per_s": n_points / wall if wall > 0 else None,
+    })
+
+# Function to describe the code and environment the numbers belong to
+def environment_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+# Function to run the full benchmark matrix and append results to a JSON lines file
+def run_benchmarks(paths, points, grids, output, repeat=1, timeout=1800, seed=0):
+    env = environment_info()
+    context = multiprocessing.get_context("spawn")
+    with open(output, "a") as handle:
+        for path in paths:
+            for n_points in points:
+                for grid in grids:
+                    for run in range(repeat):
+                        queue = context.Queue()
+                        process = context.Process(target=run_case, args=(path, n_points, grid, seed, queue))
+                        process.start()
+                        process.join(timeout)
+                        record = {
+                            "timestamp": datetime.now().isoformat(timespec="seconds"),
+                            "path": path, "n_points": n_points, "grid": [grid, grid], "run": run,
+                        }
+                        if process.is_alive():
+                            process.terminate()
+                            process.join()
+                            record["status"] = "timeout"
+                        elif process.exitcode != 0 or queue.empty():
+                            record["status"] = f"failed (exit code {process.exitcode})"
+                        else:
+                            record.update(queue.get())
+                            record["status"] = "ok"
+                        record.update(env)
+                        handle.write(json.dumps(record) + "\n")
+                        handle.flush()
+                        print_record(record)
+
+# Function to print one result line
+def print_record(record):
+    if record["status"] != "ok":
+        print(f"{record['path']:<42} {record['n_points']:>10,} {record['grid'][0]:>5}²  {record['status']}")
+        return
+    print(f"{record['path']:<42} {record['n_points']:>10,} {record['grid'][0]:>5}²  "
+          f"{record['wall_s']:9.2f} s  {record['peak_rss_mb']:9.1f} MB  {record['points_per_s']:12,.0f} pts/s")
+
+# Function to load the best (fastest) successful result per case from a results file
+def load_results(path):
+    best = {}
+    with open(path) as handle:
+        for line in handle:
+            record = json.loads(line)
+            if record.get("status") != "ok":
+                continue
+            key = (record["path"], record["n_points"], tuple(record["grid"]))
+            if key not in best or record["wall_s"] < best[key]["wall_s"]:
+                best[key] = record
+    return best
+
+# Function to compare two results files and print wall-time and memory ratios
+def compare_results(baseline_path, candidate_path, threshold=1.1):
+    baseline, candidate = load_results(baseline_path), load_results(candidate_path)
+    regressions = 0
+    for key in sorted(set(baseline) & set(candidate)):
+        old, new = baseline[key], candidate[key]
+        time_ratio = new["wall_s"] / old["wall_s"]
+        rss_ratio = new["peak_rss_mb"] / old["peak_rss_mb"]
+        flag = "REGRESSION" if time_ratio > threshold or rss_ratio > threshold else ""
+        regressions += bool(flag)
+        print(f"{key[0]:<42} {key[1]:>10,} {key[2][0]:>5}²  time x{time_ratio:5.2f}  rss x{rss_ratio:5.2f}  {flag}")
+    print(f"{regressions} regression(s) above x{threshold}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the gridding paths on synthetic surveys.")
+    parser.add_argument("--paths", nargs="+", default=GRIDDING_PATHS, choices=GRIDDING_PATHS)
+    parser.add_argument("--points", nargs="+", type=int, default=DEFAULT_POINTS)
+    parser.add_argument("--grids", nargs="+", type=int, default=DEFAULT_GRIDS)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds allowed per case")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=f"gridding_benchmark_{datetime.now():%Y-%m-%d}.jsonl")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"))
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare_results(*args.compare) else 0)
+    run_benchmarks(args.paths, args.points, args.grids, args.output, args.repeat, args.timeout, args.seed)
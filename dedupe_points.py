@@ -0,0 +1,120 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from stage_timing import stage
+
+# Duplicate and near-duplicate point aggregation before gridding. NURE coordinates
+# are rounded to 4 decimals and station files repeat occupations, so many points
+# share (or nearly share) a location. Coincident points slow Qhull, can make
+# griddata fail and make kriging systems singular, so every gridder merges them
+# first:
+#
+#   1. snap x and y to a tolerance grid:  ix = round(x / tolerance), iy = round(y / tolerance)
+#   2. combine them into one int64 key:   key = ix * (iy range + 1) + iy
+#   3. group by key with a hash factorize (first-occurrence order, so line order is kept)
+#   4. merge each group: mean coordinates, mean or median value, and a count
+#
+# When the tolerance is tiny compared with the extent the combined key would
+# overflow int64 (and distant points would silently share a key), so the (ix, iy)
+# pairs are factorized directly instead. aggregate_frame keeps every other column
+# of a DataFrame by taking the first row of each group.
+#
+# All steps are vectorized (bincount / lexsort), with no Python loop over groups.
+# The tolerance is in coordinate units (degrees): AIRBORNE_SNAP_TOLERANCE, default
+# 1e-4 (the 4-decimal rounding step, about 11 m); 0 disables merging.
+
+SNAP_TOLERANCE = float(os.environ.get("AIRBORNE_SNAP_TOLERANCE", "1e-4"))
+
+# Function to return one int64 key per point for its tolerance cell
+def snap_keys(x, y, tolerance=SNAP_TOLERANCE):
+    cell_x = np.floor(np.asarray(x, dtype=np.float64) / tolerance + 0.5)
+    cell_y = np.floor(np.asarray(y, dtype=np.float64) / tolerance + 0.5)
+    span_x = cell_x.max() - cell_x.min() + 1
+    span_y = cell_y.max() - cell_y.min() + 1
+    if span_x * span_y >= np.iinfo(np.int64).max:
+        # The combined key would overflow; number the distinct (ix, iy) cells instead
+        return pd.MultiIndex.from_arrays((cell_x, cell_y)).factorize()[0].astype(np.int64)
+    ix = (cell_x - cell_x.min()).astype(np.int64)
+    iy = (cell_y - cell_y.min()).astype(np.int64)
+    return ix * int(span_y) + iy
+
+# Function to return group codes (first-occurrence order) for the tolerance cells of points
+def snap_codes(x, y, tolerance=SNAP_TOLERANCE):
+    codes, _ = pd.factorize(snap_keys(x, y, tolerance))
+    return codes
+
+# Function to return the per-group median of values given group codes and counts
+def group_median(codes, values, counts):
+    order = np.lexsort((values, codes))
+    ordered = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return 0.5 * (ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2])
+
+# Function to merge points that snap to the same tolerance cell
+# Returns (x, y, values, counts); the inputs come back unchanged when nothing merges.
+def aggregate_points(x, y, values, tolerance=SNAP_TOLERANCE, how='mean'):
+    x, y, values = (np.asarray(column, dtype=np.float64) for column in (x, y, values))
+    if how not in ('mean', 'median'):
+        raise ValueError(f"Unknown aggregation '{how}'; expected 'mean' or 'median'")
+    if tolerance <= 0 or len(values) < 2:
+        return x, y, values, np.ones(len(values), dtype=np.int64)
+    return merge_groups(snap_codes(x, y, tolerance), x, y, values, how)
+
+# Function to merge points by group code; returns (x, y, values, counts)
+def merge_groups(codes, x, y, values, how='mean'):
+    counts = np.bincount(codes)
+    if counts.max() == 1:
+        return x, y, values, counts
+    merged_x = np.bincount(codes, x) / counts
+    merged_y = np.bincount(codes, y) / counts
+    if how == 'mean':
+        merged_values = np.bincount(codes, values) / counts
+    else:
+        merged_values = group_median(codes, values, counts)
+    return merged_x, merged_y, merged_values, counts
+
+# Function to merge duplicate points of a DataFrame; returns a DataFrame with the same columns
+# Rows with NaN coordinates or values are dropped. x, y and value are merged as in
+# aggregate_points; every other column takes the first row of each group.
+# count_column, if given, holds how many input points were merged into each row.
+def aggregate_frame(df, x='x', y='y', value='value', tolerance=SNAP_TOLERANCE, how='mean', count_column=None):
+    df = df.dropna(subset=[x, y, value])
+    if how not in ('mean', 'median'):
+        raise ValueError(f"Unknown aggregation '{how}'; expected 'mean' or 'median'")
+    with stage("dedupe", rows_in=len(df)) as record:
+        if tolerance <= 0 or len(df) < 2:
+            merged = df.reset_index(drop=True)
+            counts = np.ones(len(df), dtype=np.int64)
+        else:
+            codes = snap_codes(df[x], df[y], tolerance)
+            _, first = np.unique(codes, return_index=True)
+            merged = df.iloc[first].reset_index(drop=True)
+            merged_x, merged_y, merged_values, counts = merge_groups(
+                codes, *(df[column].to_numpy(dtype=np.float64) for column in (x, y, value)), how)
+            merged[x], merged[y] = merged_x, merged_y
+            merged[value] = merged_values.astype(df[value].dtype, copy=False)
+        record["rows_out"] = len(merged)
+    if len(merged) < len(df):
+        print(f"Merged {len(df) - len(merged):,} duplicate points "
+              f"({len(df):,} -> {len(merged):,}, tolerance {tolerance:g})")
+    if count_column:
+        merged[count_column] = counts
+    return merged
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge duplicate and near-duplicate points of a standardized CSV.")
+    parser.add_argument("csv")
+    parser.add_argument("--value", default="corrected_magnetic")
+    parser.add_argument("--tolerance", type=float, default=SNAP_TOLERANCE, help="snap tolerance in degrees")
+    parser.add_argument("--how", choices=["mean", "median"], default="mean")
+    parser.add_argument("--output", help="output CSV (default: report only)")
+    args = parser.parse_args()
+    points = pd.read_csv(args.csv)
+    merged_points = aggregate_frame(points, 'long', 'lat', args.value, args.tolerance, args.how, count_column='count')
+    print(f"{(merged_points['count'] > 1).sum():,} locations had more than one point; "
+          f"largest group {merged_points['count'].max()}")
+    if args.output:
+        merged_points.to_csv(args.output, index=False)
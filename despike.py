@@ -0,0 +1,151 @@
+import argparse
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import median_filter
+
+from flight_lines import build_line_index, scatter_back
+from precision import VALUE_DTYPE
+from stage_timing import stage
+
+# Along-line despiking for flight-line magnetic data. remove_outliers only drops
+# positional outliers, so single-sample spikes (instrument glitches, cultural
+# noise) go straight into the grid. Here every sample is compared with a rolling
+# median of its own line:
+#
+#   median_i = median of value_j over the window around i
+#   mad_i    = median of |value_j - median_i| over the same window   (Hampel MAD)
+#   residual = value - median
+#   scale    = c(window) * max(mad, median of mad over the line)  (robust sigma)
+#   spike    = |residual| > threshold * scale  and  |residual| > min_amplitude
+#
+# All lines are processed in one pass. Samples are put in line order
+# (flight_lines.build_line_index), each line is padded at both ends with a mirror
+# image of its own samples, and the padded lines are concatenated. One 1-D median
+# filter then runs over the whole array, and the MAD takes each sample's window as a
+# strided view of the same array: every window centred on a real sample stays
+# inside its line and never mixes data from neighbouring lines. A MAD over a few
+# samples is noisy, so it is floored at the line's typical MAD, and
+# min_amplitude keeps quiet, flat lines (MAD near zero) from being flagged. The
+# MAD of a short window is biased low, so c(window) is calibrated on Gaussian noise
+# for the window length (it tends to 1.4826 for long windows) and the line's
+# median_sigma then matches the noise level.
+#
+# Spikes are flagged in a boolean column, and optionally replaced by the rolling
+# median; per-line statistics are returned for QC.
+
+DEFAULT_WINDOW = 9
+DEFAULT_THRESHOLD = 6.0
+DEFAULT_MIN_AMPLITUDE = 2.0
+CHUNK_SAMPLES = 1 << 18
+CALIBRATION_WINDOWS = 20000
+
+# Function to return the MAD-to-sigma factor for a window length
+# The factor makes the median window MAD of unit Gaussian noise equal to 1.
+@lru_cache(maxsize=None)
+def mad_to_sigma(window, trials=CALIBRATION_WINDOWS):
+    samples = np.random.default_rng(0).standard_normal((trials, int(window) | 1))
+    mad = np.median(np.abs(samples - np.median(samples, axis=1, keepdims=True)), axis=1)
+    return float(1.0 / np.median(mad))
+
+# Function to build the mirror-padded, concatenated layout of all lines
+# Returns (source, positions): source indexes the line-ordered samples for every
+# padded slot, positions are the padded slots holding the real samples.
+def padded_layout(starts, stops, half):
+    counts = stops - starts
+    padded_counts = counts + 2 * half
+    padded_starts = np.r_[0, np.cumsum(padded_counts)[:-1]]
+    offset = np.arange(padded_counts.sum()) - np.repeat(padded_starts, padded_counts) - half
+    length = np.repeat(counts, padded_counts)
+    # Mirror about the first and last sample (mode='mirror'); very short lines are clipped
+    offset = np.where(offset < 0, -offset, offset)
+    offset = np.where(offset >= length, 2 * (length - 1) - offset, offset)
+    source = np.repeat(starts, padded_counts) + np.clip(offset, 0, length - 1)
+    positions = np.repeat(padded_starts + half, counts) + (np.arange(counts.sum()) - np.repeat(starts, counts))
+    return source, positions
+
+# Function to compute rolling median and rolling MAD of line-ordered values
+# Values must be finite; starts/stops delimit the lines. The MAD of sample i is the
+# median distance of its whole window from median_i, worked out in chunks of
+# CHUNK_SAMPLES windows to bound memory.
+def rolling_median_mad(values, starts, stops, window=DEFAULT_WINDOW, chunk=CHUNK_SAMPLES):
+    window = int(window) | 1
+    half = window // 2
+    source, positions = padded_layout(starts, stops, half)
+    padded = values[source]
+    median = median_filter(padded, size=window, mode='nearest')[positions]
+    windows = sliding_window_view(padded, window)
+    mad = np.empty_like(median)
+    for start in range(0, len(positions), chunk):
+        stop = min(start + chunk, len(positions))
+        deviation = np.abs(windows[positions[start:stop] - half] - median[start:stop, None])
+        mad[start:stop] = np.median(deviation, axis=1)
+    return median, mad
+
+# Function to flag (and optionally replace) spikes along every line of a survey
+# df needs line, fid, lat, long and value_column. Returns a copy with a boolean
+# spike column and, when replace is True, spikes replaced by the rolling median
+# (originals kept in <value_column>_raw), plus a per-line table of spike statistics.
+def despike_survey(df, value_column='corrected_magnetic', window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD,
+                   min_amplitude=DEFAULT_MIN_AMPLITUDE, replace=True):
+    index = build_line_index(df, columns=[value_column])
+    with stage("despike", rows_in=len(df)) as record:
+        starts, stops, codes = index["starts"], index["stops"], index["codes"]
+        value = index["columns"][value_column].astype(np.float64)
+        missing = ~np.isfinite(value)
+        if missing.any():
+            # Gaps take the previous (or, at a line start, the next) sample of the same line
+            # so the filters see finite data
+            filled = pd.Series(value).groupby(codes).ffill()
+            value = filled.groupby(codes).bfill().fillna(0.0).to_numpy()
+        median, mad = rolling_median_mad(value, starts, stops, window)
+        residual = value - median
+        typical_mad = pd.Series(mad).groupby(codes).median().to_numpy()
+        factor = mad_to_sigma(window)
+        scale = factor * np.maximum(mad, typical_mad[codes])
+        spike = (np.abs(residual) > threshold * scale) & (np.abs(residual) > min_amplitude) & ~missing
+
+        despiked = df.copy()
+        despiked["spike"] = scatter_back(index, spike)
+        if replace:
+            despiked[f"{value_column}_raw"] = df[value_column]
+            cleaned = np.where(spike, median, index["columns"][value_column])
+            despiked[value_column] = scatter_back(index, cleaned).astype(VALUE_DTYPE)
+        record["rows_out"] = len(despiked)
+        record["spikes"] = int(spike.sum())
+
+    counts = stops - starts
+    spikes = np.bincount(codes, spike, minlength=len(starts)).astype(np.int64)
+    largest = np.zeros(len(starts))
+    if spike.any():
+        np.maximum.at(largest, codes[spike], np.abs(residual[spike]))
+    stats = pd.DataFrame({"samples": counts, "spikes": spikes, "spike_fraction": spikes / np.maximum(counts, 1),
+                          "largest_spike": largest, "median_sigma": factor * typical_mad},
+                         index=pd.Index(index["labels"], name="line"))
+    print(f"Flagged {int(spike.sum()):,} spikes on {int((spikes > 0).sum())} of {len(starts)} lines "
+          f"({spike.mean():.3%} of samples){'; replaced by the rolling median' if replace else ''}")
+    return despiked, stats
+
+# Function to write per-line spike statistics to CSV for QC
+def save_spike_stats(stats, path):
+    stats.to_csv(path)
+    print(f"Saved spike statistics: {path}")
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Despike a flight-line CSV (line, fid, lat, long, value) along its lines.")
+    parser.add_argument("csv")
+    parser.add_argument("output")
+    parser.add_argument("--value-column", default="corrected_magnetic")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="rolling window in samples (odd)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="spike threshold in robust sigmas")
+    parser.add_argument("--min-amplitude", type=float, default=DEFAULT_MIN_AMPLITUDE)
+    parser.add_argument("--flag-only", action="store_true", help="flag spikes without replacing them")
+    args = parser.parse_args()
+    survey = pd.read_csv(args.csv)
+    despiked_survey, spike_stats = despike_survey(survey, args.value_column, args.window, args.threshold,
+                                                  args.min_amplitude, replace=not args.flag_only)
+    despiked_survey.to_csv(args.output, index=False)
+    save_spike_stats(spike_stats, args.output.replace(".csv", "_spikes.csv"))
@@ -0,0 +1,226 @@
+import argparse
+import gzip
+import json
+import os
+import time
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+from urllib3.exceptions import HTTPError as StreamError
+
+# Streaming downloader with a local mirror for the raw survey files. Every remote
+# file is written to a mirror directory once and re-used on later runs:
+#
+#   path = fetch("https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/isograv.xyz")
+#   df = read_table(url, sep=r'\s+', header=None, names=['x', 'y', 'value'])
+#
+# Mirror layout (AIRBORNE_MIRROR_DIR, default ~/.airborne_mirror):
+#
+#   AirBorneInsight2/<path in repo>        files from this repository
+#   <host>/<path>                          files from anywhere else
+#   <file>.part                            an interrupted download, resumed with Range
+#   <file>.meta.json                       url, ETag, Last-Modified, size, encoding
+#
+# A mirrored file is revalidated with If-None-Match / If-Modified-Since, so an
+# unchanged file costs one 304 instead of a full download. Downloads stream to disk
+# in chunks with timeouts and retries, and resume from the .part file after a
+# dropped connection. Responses sent with Content-Encoding: gzip are stored
+# compressed and, like .gz survey files, decompressed transparently on read.
+#
+# Environment:
+#   AIRBORNE_DATA_BASE_URL   serve repository files from another base: a local
+#                            HTTP stand-in (http://localhost:8000) or a folder such
+#                            as the mirror's AirBorneInsight2 directory
+#   AIRBORNE_OFFLINE=1       never touch the network; use mirrored copies only
+
+MIRROR_DIR = os.environ.get("AIRBORNE_MIRROR_DIR", os.path.expanduser("~/.airborne_mirror"))
+DATA_BASE_URL = os.environ.get("AIRBORNE_DATA_BASE_URL", "")
+OFFLINE = os.environ.get("AIRBORNE_OFFLINE", "0") not in ("", "0")
+REPO_NAME = "AirBorneInsight2"
+REPO_URL_PREFIXES = ("https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/",
+                     "https://github.com/maxfollett/AirBorneInsight2/raw/main/")
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = (10, 60)
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Function to return a repository file's path inside the repo (None for other URLs)
+def repo_relative_path(url):
+    for prefix in REPO_URL_PREFIXES:
+        if url.startswith(prefix):
+            return url[len(prefix):]
+    return None
+
+# Function to return where a URL is fetched from, honouring AIRBORNE_DATA_BASE_URL
+def resolve_source(url, base_url=None):
+    base_url = DATA_BASE_URL if base_url is None else base_url
+    relative = repo_relative_path(url)
+    if not base_url or relative is None:
+        return url
+    if "://" in base_url:
+        return f"{base_url.rstrip('/')}/{relative}"
+    return os.path.join(os.path.expanduser(base_url), *relative.split("/"))
+
+# Function to return the mirror path for a URL (the file as stored, before any .gz suffix)
+def mirror_path(url, mirror_dir=None):
+    mirror_dir = mirror_dir or MIRROR_DIR
+    relative = repo_relative_path(url)
+    if relative is not None:
+        return os.path.join(mirror_dir, REPO_NAME, *relative.split("/"))
+    parsed = urlparse(url)
+    return os.path.join(mirror_dir, parsed.netloc.replace(":", "_"), *parsed.path.lstrip("/").split("/"))
+
+# Function to load the sidecar metadata of a mirrored file
+def load_meta(path):
+    try:
+        with open(path + ".meta.json") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+# Function to save the sidecar metadata of a mirrored file
+def save_meta(path, meta):
+    with open(path + ".meta.json.tmp", "w") as handle:
+        json.dump(meta, handle, indent=2)
+    os.replace(path + ".meta.json.tmp", path + ".meta.json")
+
+# Function to check whether a file starts with the gzip magic number
+def is_gzip(path):
+    with open(path, "rb") as handle:
+        return handle.read(2) == GZIP_MAGIC
+
+# Function to open a local file as text, decompressing gzip transparently
+def open_text(path, encoding="utf-8"):
+    if is_gzip(path):
+        return gzip.open(path, "rt", encoding=encoding, errors="replace")
+    return open(path, "r", encoding=encoding, errors="replace")
+
+# Function to stream one response body to a file, appending when resuming
+# progress["bytes"] counts what was written even if the connection drops midway.
+def stream_to_file(response, part_path, append, progress):
+    with open(part_path, "ab" if append else "wb") as handle:
+        # Read the raw stream so gzip-encoded bodies are stored as sent and byte
+        # offsets stay valid for Range requests
+        for chunk in iter(lambda: response.raw.read(CHUNK_SIZE, decode_content=False), b""):
+            handle.write(chunk)
+            progress["bytes"] += len(chunk)
+
+# Function to fetch a URL into the mirror and return the local path (None on failure)
+# record, if given (a stage_timing record), gets the bytes transferred and whether
+# the mirrored copy was used as-is.
+def fetch(url, mirror_dir=None, revalidate=True, retries=4, timeout=TIMEOUT, record=None, session=None):
+    record = record if record is not None else {}
+    source = resolve_source(url)
+    if "://" not in source or source.startswith("file://"):
+        local = source[len("file://"):] if source.startswith("file://") else source
+        if not os.path.exists(local):
+            print(f"Local data file not found: {local}")
+            return None
+        record.update(bytes=0, cache_hit=True)
+        return local
+
+    path = mirror_path(url, mirror_dir)
+    meta = load_meta(path)
+    stored = meta.get("stored") and os.path.join(os.path.dirname(path), meta["stored"])
+    have_copy = bool(stored) and os.path.exists(stored)
+    if have_copy and (OFFLINE or not revalidate):
+        record.update(bytes=0, cache_hit=True)
+        return stored
+    if OFFLINE:
+        print(f"Offline and no mirrored copy of {url}")
+        return None
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part_path = path + ".part"
+    session = session or requests.Session()
+    progress = {"bytes": 0}
+    for attempt in range(retries + 1):
+        headers = {"Accept-Encoding": "gzip"}
+        resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if resume_from and meta.get("partial_validator"):
+            headers["Range"] = f"bytes={resume_from}-"
+            headers["If-Range"] = meta["partial_validator"]
+        elif have_copy:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            with session.get(source, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304 and have_copy:
+                    meta["checked"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+                    save_meta(path, meta)
+                    record.update(bytes=progress["bytes"], cache_hit=True)
+                    return stored
+                if response.status_code >= 500:
+                    raise requests.HTTPError(f"server error {response.status_code}")
+                if response.status_code == 416 and resume_from:
+                    # The .part already holds the whole file (the previous run stopped
+                    # before renaming it) or no longer matches; download it again
+                    os.remove(part_path)
+                    continue
+                if response.status_code not in (200, 206):
+                    if have_copy:
+                        print(f"Could not revalidate {url} (status code {response.status_code}); using the mirrored copy")
+                        record.update(bytes=progress["bytes"], cache_hit=True)
+                        return stored
+                    print(f"Failed to load data, status code: {response.status_code}")
+                    return None
+
+                append = response.status_code == 206
+                encoding = response.headers.get("Content-Encoding", "")
+                if append and encoding != meta.get("partial_encoding", ""):
+                    # The server switched representations mid-download; the range body
+                    # cannot be appended, so drop the .part and ask again without Range
+                    os.remove(part_path)
+                    continue
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+                # Only strong validators may be used with If-Range
+                validator = etag if etag and not etag.startswith("W/") else last_modified
+                if not append:
+                    meta.update(partial_validator=validator, partial_encoding=encoding)
+                    save_meta(path, meta)
+                stream_to_file(response, part_path, append, progress)
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError,
+                requests.exceptions.ChunkedEncodingError, StreamError) as e:
+            if attempt == retries:
+                print(f"Failed to download {url} after {retries + 1} attempts: {e}")
+                if have_copy:
+                    print(f"Using the mirrored copy of {url}")
+                    record.update(bytes=progress["bytes"], cache_hit=True)
+                    return stored
+                return None
+            wait = min(2 ** attempt, 30)
+            print(f"Download of {url} interrupted ({e}); retrying in {wait} s")
+            time.sleep(wait)
+            continue
+
+        # Store gzip-encoded bodies compressed; open_text and read_table decompress them
+        stored_name = os.path.basename(path) + (".gz" if encoding == "gzip" and not path.endswith(".gz") else "")
+        stored = os.path.join(os.path.dirname(path), stored_name)
+        os.replace(part_path, stored)
+        meta = {"url": url, "source": source, "stored": stored_name, "etag": etag, "last_modified": last_modified,
+                "encoding": encoding, "size": os.path.getsize(stored),
+                "fetched": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        save_meta(path, meta)
+        record.update(bytes=progress["bytes"], cache_hit=False)
+        print(f"Downloaded {url} ({progress['bytes'] / 1e6:.1f} MB transferred)")
+        return stored
+    return None
+
+# Function to fetch a delimited text file through the mirror and read it with pandas (None on failure)
+def read_table(url, record=None, **read_csv_kwargs):
+    path = fetch(url, record=record)
+    if path is None:
+        return None
+    return pd.read_csv(path, compression="gzip" if is_gzip(path) else None, **read_csv_kwargs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mirror raw data files locally (resumable, revalidated).")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--mirror-dir", default=MIRROR_DIR)
+    parser.add_argument("--no-revalidate", action="store_true", help="use mirrored copies without asking the server")
+    args = parser.parse_args()
+    for requested in args.urls:
+        print(fetch(requested, args.mirror_dir, revalidate=not args.no_revalidate))
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from potential_filters import apply_filters, grid_spacing_m
+from precision import VALUE_DTYPE
+from stage_timing import stage
+
+# Edge-detection layers derived from a gridded magnetic (or gravity) layer:
+#
+#   thg              total horizontal gradient  sqrt(dx^2 + dy^2)
+#   analytic_signal  amplitude                   sqrt(dx^2 + dy^2 + dz^2)
+#   tilt             tilt derivative             arctan(dz / thg)        (radians)
+#   theta            theta map                   arccos(thg / analytic)  (radians)
+#
+# All four come from the same three derivatives, which potential_filters.py
+# computes from one forward FFT and one batched inverse. Large grids are processed
+# in overlapping tiles read from a memory-mapped .npy, and every layer is written
+# as its own .npy next to the source grid (same shape and extent) plus a
+# <stem>_layers.json describing them, so the layers stay co-registered with the
+# corrected_magnetic grid they came from.
+
+EDGE_LAYERS = ("thg", "analytic_signal", "tilt", "theta")
+
+# Function to compute edge layers from the x, y and z derivatives of a grid
+def edge_layers_from_derivatives(grad_x, grad_y, grad_z, layers=EDGE_LAYERS):
+    thg = np.hypot(grad_x, grad_y)
+    analytic = np.sqrt(thg ** 2 + grad_z ** 2)
+    computed = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if "thg" in layers:
+            computed["thg"] = thg
+        if "analytic_signal" in layers:
+            computed["analytic_signal"] = analytic
+        if "tilt" in layers:
+            computed["tilt"] = np.arctan2(grad_z, thg)
+        if "theta" in layers:
+            computed["theta"] = np.arccos(np.clip(thg / analytic, 0, 1))
+    return {name: computed[name].astype(VALUE_DTYPE, copy=False) for name in layers}
+
+# Function to compute edge layers for an in-memory grid with one spectral transform
+# rtp=(inclination, declination) reduces magnetic data to the pole first.
+def compute_edge_layers(grid_z, dx_m, dy_m, layers=EDGE_LAYERS, rtp=None, pad_fraction=0.25):
+    prefix = [("rtp", {"inclination": rtp[0], "declination": rtp[1]})] if rtp else []
+    derivatives = apply_filters(grid_z, {axis: prefix + [(axis, {})] for axis in ("dx", "dy", "dz")},
+                                dx_m, dy_m, pad_fraction)
+    return edge_layers_from_derivatives(derivatives["dx"], derivatives["dy"], derivatives["dz"], layers)
+
+# Function to return (start, stop, core_start, core_stop) windows covering n cells in overlapping tiles
+def tile_windows(n, tile_size, overlap):
+    windows = []
+    for core_start in range(0, n, tile_size):
+        core_stop = min(core_start + tile_size, n)
+        windows.append((max(core_start - overlap, 0), min(core_stop + overlap, n), core_start, core_stop))
+    return windows
+
+# Function to derive edge layers for a saved grid and write them next to it
+# Grids larger than tile_size are processed tile by tile with `overlap` cells of
+# context on each side, so only one tile (plus its FFT padding) is in memory at once.
+# dz is not a local operator, so the overlap should span the longest anomaly
+# wavelength of interest; grids up to tile_size are done in one exact pass.
+# MAG_*.txt grids from magsavingnew.py are indexed [long, lat]; pass long_first=True
+# for those and the layers are written in the same orientation as the source.
+def derive_edge_layers(grid_path, extent, layers=EDGE_LAYERS, rtp=None, tile_size=2048, overlap=256,
+                       save_txt=False, long_first=False):
+    if grid_path.endswith(".npy"):
+        source = np.load(grid_path, mmap_mode='r')
+    else:
+        source = np.loadtxt(grid_path)
+    stem = os.path.splitext(grid_path)[0]
+    files = {name: np.lib.format.open_memmap(f"{stem}_{name}.npy", mode='w+', dtype=VALUE_DTYPE, shape=source.shape)
+             for name in layers}
+    # Work with rows following latitude; transposes of memmaps are views, not copies
+    grid = source.T if long_first else source
+    outputs = {name: output.T if long_first else output for name, output in files.items()}
+    dx_m, dy_m = grid_spacing_m(extent, grid.shape)
+    rows, cols = grid.shape
+
+    start = time.perf_counter()
+    windows = [(row_window, col_window) for row_window in tile_windows(rows, tile_size, overlap)
+               for col_window in tile_windows(cols, tile_size, overlap)]
+    for (row_start, row_stop, row_core, row_core_stop), (col_start, col_stop, col_core, col_core_stop) in windows:
+        with stage("edge_tile", rows_in=(row_stop - row_start) * (col_stop - col_start)):
+            window = np.asarray(grid[row_start:row_stop, col_start:col_stop], dtype=np.float64)
+            tile_layers = compute_edge_layers(window, dx_m, dy_m, layers, rtp)
+            core = (slice(row_core - row_start, row_core_stop - row_start),
+                    slice(col_core - col_start, col_core_stop - col_start))
+            for name in layers:
+                outputs[name][row_core:row_core_stop, col_core:col_core_stop] = tile_layers[name][core]
+
+    for name, output in files.items():
+        output.flush()
+        if save_txt:
+            np.savetxt(f"{stem}_{name}.txt", output, fmt='%.6f')
+    description = {
+        "source": os.path.abspath(grid_path),
+        "extent": list(extent),
+        "shape": list(source.shape),
+        "long_first": long_first,
+        "spacing_m": [dx_m, dy_m],
+        "rtp": list(rtp) if rtp else None,
+        "layers": {name: os.path.basename(f"{stem}_{name}.npy") for name in layers},
+        "units": {"thg": "per metre", "analytic_signal": "per metre", "tilt": "radians", "theta": "radians"},
+        "tiles": len(windows),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(f"{stem}_layers.json", "w") as handle:
+        json.dump(description, handle, indent=2)
+    print(f"Saved {len(layers)} edge layers for {os.path.basename(grid_path)} in {time.perf_counter() - start:.1f} s")
+    return description
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive THG, analytic signal, tilt and theta layers from a grid.")
+    parser.add_argument("grid", help=".txt or .npy grid with rows following latitude")
+    parser.add_argument("--extent", nargs=4, type=float, required=True, metavar=("LON_MIN", "LON_MAX", "LAT_MIN", "LAT_MAX"))
+    parser.add_argument("--layers", nargs="+", choices=EDGE_LAYERS, default=list(EDGE_LAYERS))
+    parser.add_argument("--rtp", nargs=2, type=float, metavar=("INCLINATION", "DECLINATION"),
+                        help="reduce to the pole before taking derivatives")
+    parser.add_argument("--tile-size", type=int, default=2048)
+    parser.add_argument("--overlap", type=int, default=256)
+    parser.add_argument("--txt", action="store_true", help="also write each layer as .txt")
+    parser.add_argument("--long-first", action="store_true", help="grid is indexed [long, lat] (magsavingnew.py MAG files)")
+    args = parser.parse_args()
+    derive_edge_layers(args.grid, args.extent, args.layers, args.rtp, args.tile_size, args.overlap, args.txt,
+                       args.long_first)
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import re
+import time
+
+from downloader import mirror_path
+
+# Earth Engine export-task manager. Instead of starting a batch of
+# Export.image.toDrive tasks and exiting, exports are described as jobs, submitted
+# under a concurrency cap and tracked until they finish:
+#
+#   jobs = []
+#   add_export(jobs, "0412_Marysvale_B4", band4, region=region, scale=30, crs="EPSG:4326")
+#   add_export(jobs, "0412_Marysvale_B5", band5, region=region, scale=30, crs="EPSG:4326")
+#   results = run_exports(jobs, ee)
+#
+# Each job is started when one of max_concurrent slots is free, then polled with
+# exponential backoff. Failed tasks, and starts refused because the task queue is
+# full, are retried up to max_attempts. Every state change goes to a JSON ledger
+# (AIRBORNE_EE_LEDGER, default ~/.airborne_ee_exports.json):
+#
+#   {"jobs": {"0412_Marysvale_B4": {"state": "COMPLETED", "task_id": "...", "attempts": 1,
+#                                   "destination": "gcs", "bucket": "...", "local_path": "...", ...}}}
+#
+# so a re-run with the same jobs resumes: finished jobs are skipped, running tasks
+# are polled again by task id and only the rest are submitted. Jobs that gave up
+# get a fresh max_attempts on the next run (retry_gave_up=False keeps them given
+# up), so a full queue does not fail a job for good. Exports to a Cloud
+# Storage bucket are downloaded into the local mirror (downloader.mirror_path) when
+# they complete; Drive exports are tracked but stay in Drive. Export buckets are
+# usually private and large images are written as several shards
+# (<prefix>-0000000000-0000000000.tif, ...), so objects are listed under the prefix
+# with an authenticated google-cloud-storage client and every shard is downloaded.
+#
+# The ee module and the storage client are passed in rather than imported, so the
+# manager runs the same against the real clients or stand-ins with the same
+# interface (tests/fake_ee.py).
+
+LEDGER_PATH = os.environ.get("AIRBORNE_EE_LEDGER", os.path.expanduser("~/.airborne_ee_exports.json"))
+FINISHED_STATES = ("COMPLETED", "DOWNLOADED")
+ACTIVE_STATES = ("READY", "RUNNING", "SUBMITTED")
+FAILED_STATES = ("FAILED", "CANCELLED", "CANCEL_REQUESTED")
+
+# Function to add an export job to a job list
+# destination is "drive" (folder) or "gcs" (bucket); params go to the export call.
+def add_export(jobs, name, image, destination="drive", folder="LandsatExports", bucket=None, prefix=None, **params):
+    if destination not in ("drive", "gcs"):
+        raise ValueError(f"Unknown export destination '{destination}'; expected 'drive' or 'gcs'")
+    if destination == "gcs" and not bucket:
+        raise ValueError(f"Export '{name}' goes to Cloud Storage but no bucket was given")
+    jobs.append({"name": name[:100], "image": image, "destination": destination, "folder": folder,
+                 "bucket": bucket, "prefix": prefix or name, "params": params})
+    return jobs
+
+# Function to read the export ledger (an empty ledger if there is none yet)
+def load_ledger(path=LEDGER_PATH):
+    if not os.path.exists(path):
+        return {"jobs": {}}
+    with open(path) as handle:
+        return json.load(handle)
+
+# Function to write the export ledger atomically
+def save_ledger(ledger, path=LEDGER_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", "w") as handle:
+        json.dump(ledger, handle, indent=2)
+    os.replace(path + ".tmp", path)
+
+# Function to create (not start) the Earth Engine export task for a job
+def create_task(ee, job):
+    if job["destination"] == "gcs":
+        return ee.batch.Export.image.toCloudStorage(image=job["image"], description=job["name"], bucket=job["bucket"],
+                                                    fileNamePrefix=job["prefix"], **job["params"])
+    return ee.batch.Export.image.toDrive(image=job["image"], description=job["name"], folder=job["folder"],
+                                         fileNamePrefix=job["prefix"], **job["params"])
+
+# Function to return a task's status dict from its id
+def task_status(ee, task_id):
+    statuses = ee.data.getTaskStatus([task_id])
+    return statuses[0] if statuses else {"state": "UNKNOWN"}
+
+# Function to create an authenticated Cloud Storage client (application default credentials)
+# google-cloud-storage is only needed when Cloud Storage exports are downloaded.
+def default_storage_client():
+    from google.cloud import storage
+    return storage.Client()
+
+# Function to list the objects of a finished Cloud Storage export: <prefix>.tif or its shards
+def list_artifacts(client, entry):
+    pattern = re.compile(re.escape(entry["prefix"]) + r"(-\d+-\d+)?\.tif")
+    blobs = [blob for blob in client.list_blobs(entry["bucket"], prefix=entry["prefix"]) if pattern.fullmatch(blob.name)]
+    return sorted(blobs, key=lambda blob: blob.name)
+
+# Function to download every object of a finished export into the local mirror; returns the paths
+# Objects already mirrored with the same size are not downloaded again.
+def download_artifacts(client, entry, mirror_dir=None):
+    paths = []
+    for blob in list_artifacts(client, entry):
+        path = mirror_path(f"gs://{entry['bucket']}/{blob.name}", mirror_dir)
+        if not (os.path.exists(path) and os.path.getsize(path) == blob.size):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            blob.download_to_filename(path + ".part")
+            os.replace(path + ".part", path)
+        paths.append(path)
+    return paths
+
+# Function to run one job to completion: submit, poll with backoff, retry, download
+# download is a storage client, or None to leave finished exports where they are.
+async def run_job(ee, job, ledger, ledger_path, slots, lock, max_attempts, poll_interval, max_poll_interval, download):
+    name = job["name"]
+    entry = ledger["jobs"].setdefault(name, {"state": "PENDING", "attempts": 0, "task_id": None})
+    entry.update(destination=job["destination"], bucket=job["bucket"], folder=job["folder"], prefix=job["prefix"])
+
+    async def record(**changes):
+        async with lock:
+            entry.update(changes, updated=time.strftime("%Y-%m-%dT%H:%M:%S"))
+            save_ledger(ledger, ledger_path)
+
+    if entry["state"] in FINISHED_STATES and not (download and entry["state"] == "COMPLETED"
+                                                  and job["destination"] == "gcs"):
+        return entry
+
+    async with slots:
+        while entry["state"] not in FINISHED_STATES:
+            if entry["state"] not in ACTIVE_STATES or not entry["task_id"]:
+                if entry["attempts"] >= max_attempts:
+                    await record(state="GAVE_UP")
+                    print(f"Export {name} gave up after {entry['attempts']} attempts: {entry.get('error')}")
+                    return entry
+                try:
+                    task = create_task(ee, job)
+                    await asyncio.to_thread(task.start)
+                    await record(state="SUBMITTED", task_id=task.id, attempts=entry["attempts"] + 1, error=None)
+                    print(f"Export {name} submitted (attempt {entry['attempts']}, task {task.id})")
+                except Exception as e:
+                    # Usually "too many tasks" from the queue quota; wait and try again
+                    await record(state="FAILED", attempts=entry["attempts"] + 1, error=str(e))
+                    await asyncio.sleep(min(poll_interval * 2 ** entry["attempts"], max_poll_interval))
+                    continue
+
+            # Poll with exponential backoff until the task leaves the active states
+            wait = poll_interval
+            while True:
+                await asyncio.sleep(wait)
+                try:
+                    status = await asyncio.to_thread(task_status, ee, entry["task_id"])
+                except Exception as e:
+                    print(f"Could not poll export {name}: {e}")
+                    status = {"state": entry["state"]}
+                state = status.get("state", "UNKNOWN")
+                if state != entry["state"]:
+                    await record(state=state, error=status.get("error_message"))
+                if state not in ACTIVE_STATES:
+                    break
+                wait = min(wait * 2, max_poll_interval)
+            if state in FAILED_STATES or state == "UNKNOWN":
+                print(f"Export {name} {state.lower()}: {status.get('error_message', 'no message')}")
+                await record(state="FAILED")
+
+    if download and job["destination"] == "gcs" and entry["state"] == "COMPLETED":
+        try:
+            local_paths = await asyncio.to_thread(download_artifacts, download, entry)
+        except Exception as e:
+            print(f"Could not download export {name}: {e}")
+            await record(error=str(e))
+            return entry
+        if local_paths:
+            await record(state="DOWNLOADED", local_paths=local_paths, error=None)
+        else:
+            print(f"Export {name} completed but no objects were found under gs://{entry['bucket']}/{entry['prefix']}")
+    return entry
+
+# Function to run export jobs concurrently and return their ledger entries
+# storage_client downloads Cloud Storage exports (default: an authenticated client
+# when any job exports to a bucket); download=False leaves them in the bucket.
+# retry_gave_up resets the attempts of jobs a previous run gave up on.
+async def run_exports_async(jobs, ee, max_concurrent=4, max_attempts=3, poll_interval=10.0, max_poll_interval=120.0,
+                            ledger_path=LEDGER_PATH, download=True, storage_client=None, retry_gave_up=True):
+    ledger = load_ledger(ledger_path)
+    if retry_gave_up:
+        for job in jobs:
+            entry = ledger["jobs"].get(job["name"])
+            if entry is not None and entry["state"] == "GAVE_UP":
+                entry.update(state="PENDING", attempts=0, task_id=None)
+    if download and storage_client is None and any(job["destination"] == "gcs" for job in jobs):
+        storage_client = default_storage_client()
+    download = storage_client if download else None
+    slots = asyncio.Semaphore(max_concurrent)
+    lock = asyncio.Lock()
+    entries = await asyncio.gather(*(run_job(ee, job, ledger, ledger_path, slots, lock, max_attempts, poll_interval,
+                                             max_poll_interval, download) for job in jobs))
+    return {job["name"]: entry for job, entry in zip(jobs, entries)}
+
+# Function to run export jobs from synchronous code and print a summary
+def run_exports(jobs, ee, **options):
+    start = time.perf_counter()
+    results = asyncio.run(run_exports_async(jobs, ee, **options))
+    counts = {}
+    for entry in results.values():
+        counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+    summary = ", ".join(f"{count} {state.lower()}" for state, count in sorted(counts.items()))
+    print(f"{len(results)} exports finished in {time.perf_counter() - start:.0f} s: {summary}")
+    return results
@@ -0,0 +1,153 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from potential_filters import METERS_PER_DEGREE
+from stage_timing import stage
+
+# Flight-line index over raw aeromagnetic samples. NURE files carry line and fid
+# columns and are mostly stored in acquisition order, so instead of treating the
+# samples as an unordered point cloud they are sorted once by (line, fid) and every
+# line becomes a contiguous run of rows:
+#
+#   index = build_line_index(df, columns=("lat", "long", "corrected_magnetic"))
+#   for label, line in iter_lines(index):
+#       line["corrected_magnetic"]          # a view, no copy and no boolean mask
+#
+# The index is a plain dict:
+#
+#   labels     line label per line, in sorted order
+#   starts     first row of each line in the sorted arrays
+#   stops      one past the last row of each line
+#   order      sorted row -> original row (None if the input was already sorted)
+#   codes      line number (position in labels) of every sorted row
+#   columns    {name: contiguous array in line order}
+#   heading    line heading in degrees from north (0-180), first to last sample
+#   length_m   straight-line length of each line in metres
+#
+# scatter_back() puts per-sample results computed in line order back into the
+# original row order of the DataFrame.
+
+# Function to project lat/long to local east/north metres around the survey centre
+def local_metres(lat, long):
+    lat0 = np.radians(0.5 * (np.nanmin(lat) + np.nanmax(lat)))
+    east = (np.asarray(long, dtype=np.float64) - np.nanmean(long)) * METERS_PER_DEGREE * np.cos(lat0)
+    north = (np.asarray(lat, dtype=np.float64) - np.nanmean(lat)) * METERS_PER_DEGREE
+    return east, north
+
+# Function to build a flight-line index from a DataFrame with line and fid columns
+# Only the requested columns are copied into line order; lat and long are always kept.
+def build_line_index(df, columns=None, line_column='line', fid_column='fid'):
+    with stage("line_index", rows_in=len(df)) as record:
+        codes, labels = pd.factorize(df[line_column], sort=True)
+        fid = df[fid_column].to_numpy()
+        # Files in acquisition order need no reordering; check before paying for a sort
+        in_order = bool(np.all((np.diff(codes) > 0) | ((np.diff(codes) == 0) & (np.diff(fid) >= 0))))
+        order = None if in_order else np.lexsort((fid, codes))
+        sorted_codes = codes if order is None else codes[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(sorted_codes)) + 1]
+        stops = np.r_[starts[1:], len(sorted_codes)]
+
+        names = list(dict.fromkeys(["lat", "long"] + list(columns or [])))
+        sorted_columns = {}
+        for name in names:
+            values = df[name].to_numpy()
+            sorted_columns[name] = np.ascontiguousarray(values if order is None else values[order])
+        sorted_columns[fid_column] = np.ascontiguousarray(fid if order is None else fid[order])
+
+        east, north = local_metres(sorted_columns["lat"], sorted_columns["long"])
+        last = stops - 1
+        heading = np.degrees(np.arctan2(east[last] - east[starts], north[last] - north[starts])) % 180
+        length_m = np.hypot(east[last] - east[starts], north[last] - north[starts])
+        record["lines"] = len(starts)
+        record["sorted"] = order is not None
+
+    return {"labels": np.asarray(labels), "starts": starts, "stops": stops, "order": order,
+            "codes": sorted_codes, "columns": sorted_columns, "heading": heading, "length_m": length_m,
+            "line_column": line_column, "fid_column": fid_column}
+
+# Function to return the position of a line label in the index
+def line_number(index, label):
+    position = np.searchsorted(index["labels"], label)
+    if position >= len(index["labels"]) or index["labels"][position] != label:
+        raise KeyError(f"Line {label} is not in the index")
+    return int(position)
+
+# Function to return the sorted-row slice covering one line
+def line_slice(index, label):
+    position = line_number(index, label)
+    return slice(int(index["starts"][position]), int(index["stops"][position]))
+
+# Function to return zero-copy views of one line's columns
+def line_view(index, label, columns=None):
+    rows = line_slice(index, label)
+    return {name: index["columns"][name][rows] for name in (columns or index["columns"])}
+
+# Function to iterate over (label, {column: view}) for every line in order
+def iter_lines(index, columns=None):
+    names = list(columns or index["columns"])
+    for label, start, stop in zip(index["labels"], index["starts"], index["stops"]):
+        yield label, {name: index["columns"][name][start:stop] for name in names}
+
+# Function to table per-line metadata (points, heading, length) indexed by line label
+def line_summary(index):
+    return pd.DataFrame({"points": index["stops"] - index["starts"], "heading": index["heading"],
+                         "length_m": index["length_m"]},
+                        index=pd.Index(index["labels"], name=index["line_column"]))
+
+# Function to return each sample's normalized along-line position (-1 at the first fid, +1 at the last)
+def along_line_position(index):
+    counts = index["stops"] - index["starts"]
+    position_in_line = np.arange(index["stops"][-1]) - np.repeat(index["starts"], counts)
+    return 2 * position_in_line / np.maximum(np.repeat(counts, counts) - 1, 1) - 1
+
+# Function to return sorted-row indices keeping every step-th sample of each line
+# Each line keeps its first and last sample so line ends are not lost.
+def decimate_lines(index, step):
+    counts = index["stops"] - index["starts"]
+    position_in_line = np.arange(index["stops"][-1]) - np.repeat(index["starts"], counts)
+    keep = (position_in_line % step == 0) | (position_in_line == np.repeat(counts, counts) - 1)
+    return np.flatnonzero(keep)
+
+# Function to apply func(values) to each line of a column and return the results in line order
+def apply_along_lines(index, column, func):
+    result = np.empty(len(index["columns"][column]), dtype=np.float64)
+    for start, stop in zip(index["starts"], index["stops"]):
+        result[start:stop] = func(index["columns"][column][start:stop])
+    return result
+
+# Function to put per-sample values in line order back into the DataFrame's original row order
+def scatter_back(index, values):
+    if index["order"] is None:
+        return np.asarray(values)
+    original = np.empty_like(np.asarray(values))
+    original[index["order"]] = values
+    return original
+
+# Function to plot one column along a line against fid
+def plot_profile(index, label, column, ax=None):
+    import matplotlib.pyplot as plt
+    line = line_view(index, label, [index["fid_column"], column])
+    if ax is None:
+        _, ax = plt.subplots(figsize=(10, 3))
+    ax.plot(line[index["fid_column"]], line[column], linewidth=0.8)
+    ax.set_xlabel("fid")
+    ax.set_ylabel(column)
+    ax.set_title(f"Line {label}")
+    return ax
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the flight lines of a CSV with line and fid columns.")
+    parser.add_argument("csv")
+    parser.add_argument("--profile", help="line label to plot")
+    parser.add_argument("--column", default="corrected_magnetic")
+    args = parser.parse_args()
+    survey = pd.read_csv(args.csv)
+    line_index = build_line_index(survey, columns=[args.column])
+    print(line_summary(line_index).to_string())
+    if args.profile is not None:
+        import matplotlib.pyplot as plt
+        label = type(line_index["labels"][0])(args.profile)
+        plot_profile(line_index, label, args.column)
+        plt.show()
@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from scipy import interpolate
+
+from downloader import read_table
+from grav_triangulation import load_triangulation
+from raster_preview import downsample_grid
+from precision import VALUE_DTYPE, broadcast_grid, grid_axes, point_dtypes
+from stage_timing import stage
+from tile_cache import dataset_version, tile_range
+
+# Multi-resolution national gravity grids. The national station file is gridded
+# once at the finest resolution from the precomputed triangulation
+# (grav_triangulation.py), then averaged 2x per level into coarser grids:
+#
+#   ~/.airborne_gravity_pyramid/
+#       Bouguer/
+#           pyramid.json            (dataset version, extent, levels, tile size, dtype, complete)
+#           0/<row>_<col>.npy       (finest level, e.g. 0.001 deg ~ 100 m)
+#           1/<row>_<col>.npy       (0.002 deg)
+#           ...
+#
+# Grid values are cell centred: cell i covers [i * resolution, (i + 1) * resolution)
+# on a global lattice, so a 2x2 block mean of one level lands exactly on a cell of
+# the next. ROI products are served by slicing the tiles of the closest level and a
+# linear resample onto the requested grid, with no scattered-point interpolation.
+#
+# pyramid.json is written with "complete": false before the first tile, so an
+# interrupted build is resumed by re-running it: tiles already on disk belong to
+# the same data and settings and are kept. A pyramid is only served once
+# "complete" is true; other data or settings clear the old tiles first.
+
+PYRAMID_DIR = os.environ.get("AIRBORNE_PYRAMID_DIR", os.path.expanduser("~/.airborne_gravity_pyramid"))
+DEFAULT_BASE_RESOLUTION = 0.001
+DEFAULT_LEVELS = 4
+DEFAULT_TILE_SIZE = 512
+
+# Function to return the inclusive range of cells whose centres cover [low, high]
+def cell_range(low, high, resolution):
+    return int(np.floor(low / resolution - 0.5)), int(np.ceil(high / resolution - 0.5))
+
+# Function to return the cell-centre coordinates for a range of cells
+def cell_centres(first, last, resolution):
+    return (np.arange(first, last + 1) + 0.5) * resolution
+
+# Function to read a pyramid's description (None if it has not been built)
+def read_pyramid_meta(name, pyramid_dir=PYRAMID_DIR):
+    path = os.path.join(pyramid_dir, name, "pyramid.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return json.load(handle)
+
+# Function to return the path of one tile
+def tile_path(name, level, tile_row, tile_col, pyramid_dir=PYRAMID_DIR):
+    return os.path.join(pyramid_dir, name, str(level), f"{tile_row}_{tile_col}.npy")
+
+# Function to write a pyramid's description
+def write_pyramid_meta(meta, pyramid_dir=PYRAMID_DIR):
+    folder = os.path.join(pyramid_dir, meta["name"])
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, "pyramid.json")
+    with open(path + ".tmp", "w") as handle:
+        json.dump(meta, handle, indent=2)
+    os.replace(path + ".tmp", path)
+
+# Function to save a tile through a temporary name so an interrupted build never leaves a partial tile
+def save_tile(path, tile):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.save(path + ".tmp.npy", tile)
+    os.replace(path + ".tmp.npy", path)
+
+# Function to build a national pyramid for one x/y/value gravity dataset
+# Already-built tiles are kept, so an interrupted build can simply be re-run.
+def build_pyramid(data, name, base_resolution=DEFAULT_BASE_RESOLUTION, levels=DEFAULT_LEVELS,
+                  tile_size=DEFAULT_TILE_SIZE, extent=None, pyramid_dir=PYRAMID_DIR):
+    version = dataset_version(data)
+    entry = load_triangulation(data, name, version)
+    lon_min, lon_max, lat_min, lat_max = extent or (data['x'].min(), data['x'].max(), data['y'].min(), data['y'].max())
+
+    extent = [float(lon_min), float(lon_max), float(lat_min), float(lat_max)]
+    level_info = []
+    for level in range(levels):
+        resolution = base_resolution * 2 ** level
+        level_info.append({"level": level, "resolution": resolution,
+                           "tile_rows": list(tile_range(*cell_range(lat_min, lat_max, resolution), tile_size)),
+                           "tile_cols": list(tile_range(*cell_range(lon_min, lon_max, resolution), tile_size))})
+
+    # Levels shared with an existing pyramid must match exactly for its tiles to be kept
+    meta = read_pyramid_meta(name, pyramid_dir)
+    shared = min(levels, len(meta["levels"])) if meta is not None else 0
+    if meta is not None and (meta["dataset_version"] != version or meta["tile_size"] != tile_size or
+                             meta.get("value_dtype", "float32") != VALUE_DTYPE.name or meta["extent"] != extent or meta["levels"][:shared] != level_info[:shared]):
+        print(f"Existing {name} pyramid was built from other data or settings; its tiles will be replaced")
+        shutil.rmtree(os.path.join(pyramid_dir, name))
+        meta = None
+    elif meta is not None and not meta.get("complete", True):
+        print(f"Resuming the interrupted {name} pyramid build")
+
+    meta = {"name": name, "dataset_version": version, "extent": extent, "tile_size": tile_size,
+            "value_dtype": VALUE_DTYPE.name, "levels": level_info, "complete": False, "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    write_pyramid_meta(meta, pyramid_dir)
+
+    start = time.perf_counter()
+    for info in level_info:
+        level, resolution = info["level"], info["resolution"]
+        (row_first, row_last), (col_first, col_last) = info["tile_rows"], info["tile_cols"]
+        built = 0
+        for tile_row in range(row_first, row_last + 1):
+            for tile_col in range(col_first, col_last + 1):
+                path = tile_path(name, level, tile_row, tile_col, pyramid_dir)
+                if os.path.exists(path):
+                    continue
+                with stage("pyramid_tile", level=level, rows_out=tile_size * tile_size):
+                    if level == 0:
+                        tile = grid_base_tile(entry, tile_row, tile_col, resolution, tile_size)
+                    else:
+                        tile = average_child_tiles(name, level - 1, tile_row, tile_col, tile_size, pyramid_dir)
+                save_tile(path, tile)
+                built += 1
+        print(f"{name} level {level} ({resolution:g} deg): {built} tiles built")
+
+    meta["complete"] = True
+    write_pyramid_meta(meta, pyramid_dir)
+    print(f"Built {name} pyramid in {time.perf_counter() - start:.1f} s")
+    return meta
+
+# Function to evaluate the national triangulation at the cell centres of one base tile
+def grid_base_tile(entry, tile_row, tile_col, resolution, tile_size):
+    lat = cell_centres(tile_row * tile_size, (tile_row + 1) * tile_size - 1, resolution)
+    long = cell_centres(tile_col * tile_size, (tile_col + 1) * tile_size - 1, resolution)
+    grid_x, grid_y = broadcast_grid(long, lat)
+    tile = entry["interpolator"]((grid_x, grid_y))
+    nan_mask = np.isnan(tile)
+    if np.any(nan_mask):
+        _, nearest = entry["tree"].query(np.column_stack((grid_x[nan_mask], grid_y[nan_mask])))
+        tile[nan_mask] = entry["interpolator"].values[nearest, 0]
+    return tile.astype(VALUE_DTYPE)
+
+# Function to build a coarser tile by 2x2 block-averaging the four finer tiles beneath it
+def average_child_tiles(name, child_level, tile_row, tile_col, tile_size, pyramid_dir=PYRAMID_DIR):
+    block = np.full((2 * tile_size, 2 * tile_size), np.nan, dtype=VALUE_DTYPE)
+    for row_offset in range(2):
+        for col_offset in range(2):
+            path = tile_path(name, child_level, 2 * tile_row + row_offset, 2 * tile_col + col_offset, pyramid_dir)
+            if os.path.exists(path):
+                block[row_offset * tile_size:(row_offset + 1) * tile_size,
+                      col_offset * tile_size:(col_offset + 1) * tile_size] = np.load(path)
+    return downsample_grid(block, tile_size)
+
+# Function to choose the coarsest level that is at least as fine as the requested resolution
+def choose_level(meta, resolution):
+    chosen = meta["levels"][0]
+    for level in meta["levels"]:
+        if level["resolution"] <= resolution * (1 + 1e-9):
+            chosen = level
+    return chosen
+
+# Function to serve an ROI from a pyramid by slicing tiles and resampling
+# Returns grid_x, grid_y, grid_z like interpolate_to_grid (rows follow latitude), or
+# None if the pyramid is missing or was built from a different version of the data.
+def read_pyramid_roi(name, lon_min, lon_max, lat_min, lat_max, grid_size=None, resolution=None,
+                     version=None, pyramid_dir=PYRAMID_DIR):
+    meta = read_pyramid_meta(name, pyramid_dir)
+    if meta is None:
+        return None
+    if not meta.get("complete", True):
+        print(f"The {name} pyramid build was interrupted; re-run grav_pyramid.py to finish it")
+        return None
+    if version is not None and meta["dataset_version"] != version:
+        print(f"The {name} pyramid was built from a different version of the data; rebuild it with grav_pyramid.py")
+        return None
+    if np.isscalar(grid_size):
+        grid_size = (grid_size, grid_size)
+    if resolution is None and grid_size is not None:
+        rows, cols = grid_size
+        resolution = min((lat_max - lat_min) / max(rows - 1, 1), (lon_max - lon_min) / max(cols - 1, 1))
+    level = choose_level(meta, resolution or meta["levels"][0]["resolution"])
+    level_resolution, tile_size = level["resolution"], meta["tile_size"]
+
+    with stage("slice", level=level["level"]) as record:
+        row_first, row_last = cell_range(lat_min, lat_max, level_resolution)
+        col_first, col_last = cell_range(lon_min, lon_max, level_resolution)
+        roi = np.full((row_last - row_first + 1, col_last - col_first + 1), np.nan, dtype=VALUE_DTYPE)
+        tile_row_first, tile_row_last = tile_range(row_first, row_last, tile_size)
+        tile_col_first, tile_col_last = tile_range(col_first, col_last, tile_size)
+        for tile_row in range(tile_row_first, tile_row_last + 1):
+            for tile_col in range(tile_col_first, tile_col_last + 1):
+                path = tile_path(name, level["level"], tile_row, tile_col, pyramid_dir)
+                if not os.path.exists(path):
+                    continue
+                tile = np.load(path, mmap_mode='r')
+                # Overlap of this tile with the ROI, in global cell indices
+                top, bottom = max(row_first, tile_row * tile_size), min(row_last, (tile_row + 1) * tile_size - 1)
+                left, right = max(col_first, tile_col * tile_size), min(col_last, (tile_col + 1) * tile_size - 1)
+                roi[top - row_first:bottom - row_first + 1, left - col_first:right - col_first + 1] = \
+                    tile[top - tile_row * tile_size:bottom - tile_row * tile_size + 1,
+                         left - tile_col * tile_size:right - tile_col * tile_size + 1]
+        record["rows_out"] = roi.size
+
+    lat = cell_centres(row_first, row_last, level_resolution)
+    long = cell_centres(col_first, col_last, level_resolution)
+    if grid_size is None:
+        grid_x, grid_y = broadcast_grid(long, lat)
+        return grid_x, grid_y, roi.astype(VALUE_DTYPE, copy=False)
+
+    grid_x, grid_y = broadcast_grid(*grid_axes(lon_min, lon_max, lat_min, lat_max, grid_size))
+    with stage("resample", method='linear', rows_in=roi.size, rows_out=grid_x.size):
+        sampler = interpolate.RegularGridInterpolator((lat, long), roi, method='linear', bounds_error=False, fill_value=None)
+        grid_z = sampler((grid_y, grid_x)).astype(VALUE_DTYPE, copy=False)
+    return grid_x, grid_y, grid_z
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build national Bouguer/isostatic grid pyramids.")
+    parser.add_argument("--datasets", nargs="+", default=["Bouguer", "Isostatic"])
+    parser.add_argument("--base-resolution", type=float, default=DEFAULT_BASE_RESOLUTION, help="finest cell size (degrees)")
+    parser.add_argument("--levels", type=int, default=DEFAULT_LEVELS)
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE)
+    args = parser.parse_args()
+    urls = {
+        "Bouguer": "https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/USbougerGravData.xyz",
+        "Isostatic": "https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/isograv.xyz"
+    }
+    for key in args.datasets:
+        national = read_table(urls[key], sep=r'\s+', header=None, names=['x', 'y', 'value'], dtype=point_dtypes())
+        if national is None:
+            continue
+        build_pyramid(national, key, args.base_resolution, args.levels, args.tile_size)
@@ -0,0 +1,128 @@
+import os
+import pickle
+import time
+
+import numpy as np
+import scipy
+from scipy.interpolate import CloughTocher2DInterpolator
+from scipy.spatial import cKDTree
+
+from dedupe_points import SNAP_TOLERANCE, aggregate_frame
+from precision import VALUE_DTYPE, broadcast_grid, grid_axes
+from stage_timing import stage
+from tile_cache import dataset_version
+
+# Precomputed national triangulations for the Bouguer and isostatic station files.
+# griddata(method='cubic') re-runs Qhull and re-estimates the Clough-Tocher
+# gradients on every call. Here the Delaunay triangulation and gradients are built
+# once for the whole national dataset and pickled:
+#
+#   ~/.airborne_triangulations/
+#       Bouguer_<dataset_version>.pkl    (interpolator, station KD-tree, versions)
+#
+# ROI requests load the pickle and evaluate only the grid nodes they need. Each node
+# is located by walking the stored triangulation from the previous node's simplex,
+# so no Qhull call happens per query. Pickles are stamped with the scipy version and
+# the duplicate-merging snap tolerance (dedupe_points.py), and rebuilt automatically
+# if either changes underneath them.
+
+TRIANGULATION_DIR = os.environ.get("AIRBORNE_TRIANGULATION_DIR", os.path.expanduser("~/.airborne_triangulations"))
+
+# Function to return the pickle path for a dataset name and version
+def triangulation_path(name, version, cache_dir=TRIANGULATION_DIR):
+    return os.path.join(cache_dir, f"{name}_{version}.pkl")
+
+# Function to build the national triangulation and Clough-Tocher gradients for x/y/value data
+def build_triangulation(data, name, version=None, cache_dir=TRIANGULATION_DIR):
+    data = data.dropna(subset=['x', 'y', 'value'])
+    version = version or dataset_version(data)
+    # Coincident stations would become degenerate triangles; merge them first
+    data = aggregate_frame(data)
+    points = np.column_stack((data['x'].to_numpy(dtype=np.float64), data['y'].to_numpy(dtype=np.float64)))
+    values = data['value'].to_numpy(dtype=np.float64)
+
+    start = time.perf_counter()
+    with stage("triangulate", rows_in=len(values)):
+        interpolator = CloughTocher2DInterpolator(points, values)
+        # Barycentric transforms are computed lazily for every simplex on first use;
+        # compute them now so they are stored in the pickle instead of per process
+        interpolator.tri.transform
+        tree = cKDTree(points)
+    entry = {
+        "name": name,
+        "dataset_version": version,
+        "scipy_version": scipy.__version__,
+        "numpy_version": np.__version__,
+        "snap_tolerance": SNAP_TOLERANCE,
+        "points": len(values),
+        "interpolator": interpolator,
+        "tree": tree,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = triangulation_path(name, version, cache_dir)
+    with open(path + ".tmp", "wb") as handle:
+        pickle.dump(entry, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+    print(f"Built {name} triangulation of {len(values):,} stations in {time.perf_counter() - start:.1f} s: {path}")
+    return entry
+
+# Function to load a saved triangulation, rebuilding it if missing or built with another scipy
+def load_triangulation(data, name, version=None, cache_dir=TRIANGULATION_DIR):
+    version = version or dataset_version(data)
+    path = triangulation_path(name, version, cache_dir)
+    if os.path.exists(path):
+        with stage("load", source=path):
+            try:
+                with open(path, "rb") as handle:
+                    entry = pickle.load(handle)
+            except Exception as e:
+                print(f"Could not read {path} ({e}); rebuilding")
+                entry = None
+        if entry is not None and entry["scipy_version"] == scipy.__version__ \
+                and entry.get("snap_tolerance") == SNAP_TOLERANCE:
+            return entry
+        if entry is not None and entry["scipy_version"] != scipy.__version__:
+            print(f"{path} was built with scipy {entry['scipy_version']}, running {scipy.__version__}; rebuilding")
+        elif entry is not None:
+            print(f"{path} was built with snap tolerance {entry.get('snap_tolerance')}, using {SNAP_TOLERANCE}; rebuilding")
+    return build_triangulation(data, name, version, cache_dir)
+
+# Function to evaluate a saved triangulation on a regular grid
+# Nodes outside the convex hull of the stations are filled from the nearest
+# station, matching interpolate_to_grid's nearest fill.
+def evaluate_triangulation(entry, lon_min, lon_max, lat_min, lat_max, grid_size=(2116, 1486)):
+    grid_x, grid_y = broadcast_grid(*grid_axes(lon_min, lon_max, lat_min, lat_max, grid_size))
+
+    with stage("interpolate", method='cubic', rows_in=entry["points"], rows_out=grid_x.size):
+        grid_z = entry["interpolator"]((grid_x, grid_y)).astype(VALUE_DTYPE, copy=False)
+
+    nan_mask = np.isnan(grid_z)
+    if np.any(nan_mask):
+        with stage("fill", method='nearest', rows_in=entry["points"], rows_out=int(nan_mask.sum())):
+            _, nearest = entry["tree"].query(np.column_stack((grid_x[nan_mask], grid_y[nan_mask])))
+            grid_z[nan_mask] = entry["interpolator"].values[nearest, 0]
+
+    return grid_x, grid_y, grid_z
+
+# Function to grid an ROI from the national triangulation of a dataset
+# Drop-in replacement for interpolate_to_grid(data, ..., method='cubic') where data
+# is the full national station file rather than an ROI subset.
+def interpolate_with_triangulation(data, name, lon_min, lon_max, lat_min, lat_max, grid_size=(2116, 1486),
+                                   cache_dir=TRIANGULATION_DIR):
+    entry = load_triangulation(data, name, cache_dir=cache_dir)
+    return evaluate_triangulation(entry, lon_min, lon_max, lat_min, lat_max, grid_size)
+
+if __name__ == "__main__":
+    from downloader import read_table
+    from precision import point_dtypes
+    # One-time build for both national gravity datasets
+    datasets = {
+        "Bouguer": "https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/USbougerGravData.xyz",
+        "Isostatic": "https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/isograv.xyz"
+    }
+    for key, url in datasets.items():
+        data = read_table(url, sep=r'\s+', header=None, names=['x', 'y', 'value'], dtype=point_dtypes())
+        if data is not None:
+            load_triangulation(data, key)
@@ -0,0 +1,199 @@
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import interpolate
+from scipy.spatial import cKDTree
+
+from flight_lines import local_metres
+from potential_filters import METERS_PER_DEGREE
+from precision import VALUE_DTYPE, broadcast_grid, grid_axes
+from stage_timing import stage
+
+# Resolution-aware grid sizing. Grids are specified by cell size rather than by a
+# fixed shape, and the cell size can be chosen from the data itself:
+#
+#   AIRBORNE_GRID_CELL   auto (default), a size in metres ("250m"), arc-seconds
+#                        ("7.5s") or plain degrees ("0.002")
+#   AIRBORNE_GRID_SHAPE  native (no resampling) or ROWSxCOLS to override the output
+#                        shape a script asks for
+#
+# In auto mode the cell is a fraction of the measured data spacing: a quarter of
+# the flight-line spacing for line surveys, half the median distance between
+# neighbouring stations for scattered stations. It is rounded down to 1, 2, 2.5
+# or 5 x 10^n metres so nearby ROIs share tile cache keys; a spacing coarsened for
+# the cell cap, or derived from a fallback shape, is rounded up to the same steps.
+# Nodes are spaced
+# equally in degrees (cell metres / 111 km), as tile_cache.py and the pyramids expect.
+#
+# Interpolation runs at that resolution; a fixed output shape, where downstream
+# files need one, is a separate cheap resample at the end (resample_grid).
+
+GRID_CELL = os.environ.get("AIRBORNE_GRID_CELL", "auto")
+GRID_SHAPE = os.environ.get("AIRBORNE_GRID_SHAPE")
+LINE_FRACTION = 0.25
+STATION_FRACTION = 0.5
+SPACING_SAMPLE = 20000
+MAX_CELLS = 8_000_000
+NICE_STEPS = (1.0, 2.0, 2.5, 5.0)
+
+# Function to parse a cell-size spec; returns ("auto", None), ("m", metres), ("s", arc-seconds) or ("deg", degrees)
+def parse_cell_size(spec):
+    if spec is None or str(spec).strip().lower() == "auto":
+        return "auto", None
+    if isinstance(spec, (int, float)):
+        return "deg", float(spec)
+    match = re.fullmatch(r"\s*([0-9.]+(?:e-?[0-9]+)?)\s*(m|km|s|arcsec|deg)?\s*", str(spec).lower())
+    if match is None:
+        raise ValueError(f"Cannot parse grid cell size '{spec}'; expected auto, e.g. 250m, 7.5s or 0.002")
+    value, unit = float(match.group(1)), match.group(2) or "deg"
+    if unit == "km":
+        return "m", value * 1000.0
+    return ("s" if unit == "arcsec" else unit), value
+
+# Function to round a cell size down to 1, 2, 2.5 or 5 x 10^n
+def nice_cell_size(value):
+    exponent = np.floor(np.log10(value))
+    mantissa = value / 10 ** exponent
+    step = max(step for step in NICE_STEPS if step <= mantissa + 1e-9)
+    return float(step * 10 ** exponent)
+
+# Function to round a cell size up to 1, 2, 2.5 or 5 x 10^n
+def nice_cell_size_up(value):
+    exponent = np.floor(np.log10(value))
+    mantissa = value / 10 ** exponent
+    larger = [step for step in NICE_STEPS + (10.0,) if step >= mantissa - 1e-9]
+    return float(min(larger) * 10 ** exponent)
+
+# Function to round a node spacing in degrees up to a nice cell size in metres
+def nice_resolution_up(resolution):
+    return nice_cell_size_up(resolution * METERS_PER_DEGREE) / METERS_PER_DEGREE
+
+# Function to measure data spacing in metres; returns (spacing, kind)
+# With line labels the spacing is the median distance to the nearest sample on a
+# different line (the line spacing); without, the median nearest-neighbour distance.
+def data_spacing(lat, long, line=None, sample=SPACING_SAMPLE, seed=0):
+    east, north = local_metres(lat, long)
+    points = np.column_stack((east, north))
+    finite = np.isfinite(points).all(axis=1)
+    points = points[finite]
+    rng = np.random.default_rng(seed)
+    if line is None:
+        if len(points) < 2:
+            return None, "station"
+        chosen = rng.choice(len(points), min(sample, len(points)), replace=False)
+        distances, _ = cKDTree(points).query(points[chosen], k=2)
+        positive = distances[:, 1][distances[:, 1] > 0]
+        return (float(np.median(positive)) if len(positive) else None), "station"
+
+    codes = pd.factorize(np.asarray(line)[finite])[0]
+    # Along-line samples are much denser than the lines, so thin the lines until the
+    # nearest neighbours of most points include a sample from another line
+    step = 1
+    while len(points) // step >= 2:
+        keep = np.arange(0, len(points), step)
+        tree = cKDTree(points[keep])
+        chosen = keep[rng.choice(len(keep), min(sample, len(keep)), replace=False)]
+        k = min(32, len(keep))
+        distances, neighbours = tree.query(points[chosen], k=k)
+        other = codes[keep][neighbours] != codes[chosen][:, None]
+        found = other.any(axis=1)
+        if found.mean() >= 0.5:
+            first = np.argmax(other, axis=1)
+            return float(np.median(distances[found, first[found]])), "line"
+        step *= 8
+    return None, "line"
+
+# Function to choose the auto cell size in metres from the data spacing
+def auto_cell_size(lat, long, line=None, line_fraction=LINE_FRACTION, station_fraction=STATION_FRACTION):
+    with stage("grid_spacing", rows_in=len(lat)) as record:
+        spacing, kind = data_spacing(lat, long, line)
+        record["kind"] = kind
+    if spacing is None or spacing <= 0:
+        return None
+    cell = nice_cell_size(spacing * (line_fraction if kind == "line" else station_fraction))
+    print(f"Measured {kind} spacing {spacing:.0f} m; using {cell:g} m grid cells")
+    return cell
+
+# Function to return the (rows, cols) of an ROI grid at a resolution in degrees
+def grid_shape(lon_min, lon_max, lat_min, lat_max, resolution):
+    rows = int(round((lat_max - lat_min) / resolution)) + 1
+    cols = int(round((lon_max - lon_min) / resolution)) + 1
+    return max(rows, 2), max(cols, 2)
+
+# Function to resolve a cell-size spec to a node spacing in degrees for an ROI
+# lat/long (and line labels, for flight-line data) are only used in auto mode.
+# The spacing is coarsened if the ROI would need more than max_cells nodes.
+def grid_resolution(lon_min, lon_max, lat_min, lat_max, lat=None, long=None, line=None, spec=None,
+                    fallback_shape=(1000, 1000), max_cells=MAX_CELLS):
+    unit, value = parse_cell_size(GRID_CELL if spec is None else spec)
+    if unit == "auto":
+        cell = auto_cell_size(lat, long, line) if lat is not None and len(lat) else None
+        if cell is None:
+            rows, cols = (fallback_shape, fallback_shape) if np.isscalar(fallback_shape) else fallback_shape
+            resolution = max((lat_max - lat_min) / max(rows - 1, 1), (lon_max - lon_min) / max(cols - 1, 1))
+            resolution = nice_resolution_up(resolution)
+            print(f"Too few points to measure spacing; gridding at most {rows}x{cols} "
+                  f"({resolution * METERS_PER_DEGREE:g} m cells)")
+            return resolution
+        resolution = cell / METERS_PER_DEGREE
+    elif unit == "m":
+        resolution = value / METERS_PER_DEGREE
+    elif unit == "s":
+        resolution = value / 3600.0
+    else:
+        resolution = value
+    rows, cols = grid_shape(lon_min, lon_max, lat_min, lat_max, resolution)
+    if rows * cols > max_cells:
+        resolution = nice_resolution_up(resolution * np.sqrt(rows * cols / max_cells))
+        print(f"Grid capped at {max_cells} cells; node spacing coarsened to {resolution * METERS_PER_DEGREE:g} m")
+    return resolution
+
+# Function to return the output shape for a script: AIRBORNE_GRID_SHAPE if set, else the default
+# Returns None for native (no resampling).
+def output_shape(default=None):
+    spec = (GRID_SHAPE or "").strip().lower()
+    if spec == "native":
+        return None
+    if spec:
+        rows, cols = re.split(r"[x,]", spec)
+        return int(rows), int(cols)
+    if default is None or not np.isscalar(default):
+        return default
+    return default, default
+
+# Function to resample a regular grid to an exact shape over an extent (bilinear)
+# Grids have rows following latitude like np.meshgrid; pass long_first=True for the
+# [long, lat] np.mgrid layout. Returns the inputs unchanged when target_shape is None.
+def resample_grid(grid_x, grid_y, grid_z, target_shape, lon_min=None, lon_max=None, lat_min=None, lat_max=None,
+                  long_first=False):
+    if target_shape is None:
+        return grid_x, grid_y, grid_z
+    if long_first:
+        resampled = resample_grid(grid_x.T, grid_y.T, grid_z.T, target_shape, lon_min, lon_max, lat_min, lat_max)
+        return tuple(grid.T for grid in resampled)
+    long_nodes, lat_nodes = np.asarray(grid_x[0, :], dtype=np.float64), np.asarray(grid_y[:, 0], dtype=np.float64)
+    lon_min = long_nodes[0] if lon_min is None else lon_min
+    lon_max = long_nodes[-1] if lon_max is None else lon_max
+    lat_min = lat_nodes[0] if lat_min is None else lat_min
+    lat_max = lat_nodes[-1] if lat_max is None else lat_max
+    resample_x, resample_y = broadcast_grid(*grid_axes(lon_min, lon_max, lat_min, lat_max, target_shape))
+    with stage("resample", method='linear', rows_in=grid_z.size, rows_out=resample_x.size):
+        sampler = interpolate.RegularGridInterpolator((lat_nodes, long_nodes), grid_z, method='linear',
+                                                      bounds_error=False, fill_value=None)
+        resample_z = sampler((resample_y, resample_x)).astype(VALUE_DTYPE, copy=False)
+    return resample_x, resample_y, resample_z
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the auto grid cell size for a point file.")
+    parser.add_argument("path", help="CSV with lat and long columns (and optionally line)")
+    parser.add_argument("--cell", default="auto", help="cell size spec: auto, 250m, 7.5s or degrees")
+    args = parser.parse_args()
+    points = pd.read_csv(args.path)
+    labels = points['line'] if 'line' in points else None
+    node_spacing = grid_resolution(points['long'].min(), points['long'].max(), points['lat'].min(), points['lat'].max(),
+                                   points['lat'].to_numpy(), points['long'].to_numpy(), labels, spec=args.cell)
+    shape = grid_shape(points['long'].min(), points['long'].max(), points['lat'].min(), points['lat'].max(), node_spacing)
+    print(f"Node spacing {node_spacing:.6g} deg ({node_spacing * METERS_PER_DEGREE:.0f} m): {shape[0]}x{shape[1]} grid")
@@ -0,0 +1,54 @@
+import numpy as np
+from scipy import interpolate
+
+from dedupe_points import aggregate_frame
+from precision import VALUE_DTYPE, as_values, broadcast_grid, grid_axes
+from stage_timing import stage
+
+# Shared gridding functions used by the magnetic and gravity pipelines.
+# These are the same routines that used to be copied into each script, kept in
+# one place so the benchmark suite measures exactly what the pipelines run.
+# Resampling to a fixed output shape lives in grid_spec.resample_grid.
+# Coordinate grids are broadcast views of 1-D axes and grid values are returned in
+# the precision.py working precision (float32 unless AIRBORNE_PRECISION=float64).
+# Duplicate and near-duplicate points are merged first (dedupe_points.py).
+
+# Function to interpolate and extrapolate missing magnetic data
+# grid_size is (rows, cols) or a single int for a square grid. The grid is
+# indexed [long, lat] like np.mgrid, which is what the saved MAG files expect.
+def perform_interpolation_with_extrapolation(df, grid_size=(2116, 1486)):
+    df = aggregate_frame(df, 'long', 'lat', 'corrected_magnetic')
+    axis_x, axis_y = grid_axes(df['long'].min(), df['long'].max(), df['lat'].min(), df['lat'].max(), grid_size)
+    grid_x, grid_y = broadcast_grid(axis_x, axis_y, long_first=True)
+    points = np.column_stack((df['long'], df['lat']))
+    values = as_values(df['corrected_magnetic'])
+
+    with stage("interpolate", method='linear', rows_in=len(values), rows_out=grid_x.size):
+        grid_z = interpolate.griddata(points, values, (grid_x, grid_y), method='linear').astype(VALUE_DTYPE, copy=False)
+
+    # Fill NaNs outside the convex hull using nearest interpolation
+    nan_mask = np.isnan(grid_z)
+    if np.any(nan_mask):
+        with stage("fill", method='nearest', rows_in=len(values), rows_out=int(nan_mask.sum())):
+            grid_z[nan_mask] = interpolate.griddata(points, values, (grid_x[nan_mask], grid_y[nan_mask]), method='nearest')
+
+    return grid_x, grid_y, grid_z
+
+# Function to interpolate x/y/value data onto a regular grid
+# grid_size is (rows, cols); rows follow latitude like np.meshgrid.
+def interpolate_to_grid(data, lon_min, lon_max, lat_min, lat_max, grid_size=(2116, 1486), method='cubic'):
+    data = aggregate_frame(data)
+    grid_x, grid_y = broadcast_grid(*grid_axes(lon_min, lon_max, lat_min, lat_max, grid_size))
+    values = as_values(data['value'])
+    with stage("interpolate", method=method, rows_in=len(data), rows_out=grid_x.size):
+        grid_z = interpolate.griddata((data['x'], data['y']), values, (grid_x, grid_y), method=method).astype(VALUE_DTYPE, copy=False)
+
+    # Fill NaNs using nearest interpolation
+    nan_mask = np.isnan(grid_z)
+    if np.any(nan_mask):
+        with stage("fill", method='nearest', rows_in=len(data), rows_out=int(nan_mask.sum())):
+            grid_z[nan_mask] = interpolate.griddata(
+                (data['x'], data['y']), values, (grid_x[nan_mask], grid_y[nan_mask]), method='nearest'
+            )
+
+    return grid_x, grid_y, grid_z
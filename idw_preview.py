@@ -0,0 +1,125 @@
+import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.spatial import cKDTree
+
+from precision import VALUE_DTYPE, broadcast_grid, grid_axes
+from raster_preview import show_grid, grid_extent
+from stage_timing import stage
+
+# Sub-second preview gridding for picking an ROI. Instead of running the full
+# cubic/linear gridder for every trial ROI, a preview grid of at most max_cells
+# nodes is filled by inverse-distance weighting of the k nearest points:
+#
+#   value(node) = sum(z_i / d_i^p) / sum(1 / d_i^p)     over the k nearest points
+#
+# The KD-tree is built once per dataset and kept in memory (longitude scaled by
+# cos(latitude) so distances are roughly isotropic), so each new ROI is one
+# chunked, multi-threaded tree query plus a weighted sum. choose_roi() wraps this
+# in the prompt loop the scripts use: enter a range, look at the preview, confirm,
+# and only then run the full-quality gridder on the chosen ROI.
+
+DEFAULT_PREVIEW_CELLS = 250_000
+DEFAULT_NEIGHBOURS = 8
+DEFAULT_POWER = 2.0
+CHUNK_NODES = 65536
+
+_tree_cache = {}
+
+# Function to build (and cache) the preview KD-tree for a point dataset
+# key names the dataset in the cache; pass a new key when the data changes.
+def preview_tree(data, key, x='x', y='y', value='value'):
+    if key not in _tree_cache:
+        with stage("preview_tree", source=key, rows_in=len(data)):
+            lon = np.asarray(data[x], dtype=np.float64)
+            lat = np.asarray(data[y], dtype=np.float64)
+            values = np.asarray(data[value], dtype=np.float64)
+            finite = np.isfinite(lon) & np.isfinite(lat) & np.isfinite(values)
+            scale = np.cos(np.radians(np.median(lat[finite])))
+            _tree_cache[key] = {"tree": cKDTree(np.column_stack((lon[finite] * scale, lat[finite]))),
+                                "values": values[finite], "scale": scale}
+    return _tree_cache[key]
+
+# Function to choose a preview (rows, cols) with at most max_cells nodes and square cells in degrees
+def preview_shape(lon_min, lon_max, lat_min, lat_max, max_cells=DEFAULT_PREVIEW_CELLS):
+    width, height = max(lon_max - lon_min, 1e-9), max(lat_max - lat_min, 1e-9)
+    cols = max(int(np.sqrt(max_cells * width / height)), 2)
+    rows = max(int(max_cells / cols), 2)
+    return rows, cols
+
+# Function to IDW-grid an ROI from a cached tree; rows follow latitude like interpolate_to_grid
+# Nodes farther than max_distance (degrees) from every point are left NaN.
+def idw_grid(entry, lon_min, lon_max, lat_min, lat_max, grid_size=None, neighbours=DEFAULT_NEIGHBOURS,
+             power=DEFAULT_POWER, max_distance=None, chunk=CHUNK_NODES):
+    grid_size = grid_size or preview_shape(lon_min, lon_max, lat_min, lat_max)
+    axis_x, axis_y = grid_axes(lon_min, lon_max, lat_min, lat_max, grid_size)
+    grid_x, grid_y = broadcast_grid(axis_x, axis_y)
+    k = min(neighbours, len(entry["values"]))
+    flat_x, flat_y = grid_x.ravel() * entry["scale"], grid_y.ravel()
+    grid_z = np.empty(flat_x.size, dtype=VALUE_DTYPE)
+
+    with stage("idw", neighbours=k, rows_in=len(entry["values"]), rows_out=grid_z.size):
+        for start in range(0, flat_x.size, chunk):
+            stop = min(start + chunk, flat_x.size)
+            distances, idx = entry["tree"].query(np.column_stack((flat_x[start:stop], flat_y[start:stop])), k=k,
+                                                 distance_upper_bound=max_distance or np.inf, workers=-1)
+            distances, idx = distances.reshape(stop - start, k), idx.reshape(stop - start, k)
+            found = np.isfinite(distances)
+            # A node on top of a point takes that point's value
+            weights = np.where(found, 1.0 / np.maximum(distances, 1e-12) ** power, 0.0)
+            neighbour_values = entry["values"][np.where(found, idx, 0)]
+            with np.errstate(invalid='ignore'):
+                grid_z[start:stop] = (weights * neighbour_values).sum(axis=1) / weights.sum(axis=1)
+
+    return grid_x, grid_y, grid_z.reshape(grid_x.shape)
+
+# Function to ask for a range until it parses; returns (min, max)
+def ask_range(prompt):
+    while True:
+        try:
+            low, high = map(float, input(prompt).split(','))
+        except ValueError:
+            print("Invalid input. Please enter two comma-separated numbers (e.g., 38.1, 38.6).")
+            continue
+        if low >= high:
+            print("Minimum value must be smaller than maximum value. Please try again.")
+            continue
+        return low, high
+
+# Function to pick an ROI interactively from IDW previews of one or more datasets
+# entries maps titles to preview_tree() entries. Returns (lat_min, lat_max, lon_min, lon_max).
+def choose_roi(entries, lat_prompt="Enter latitude range (min, max): ", lon_prompt="Enter longitude range (min, max): ",
+               label=None, max_cells=DEFAULT_PREVIEW_CELLS):
+    while True:
+        lat_min, lat_max = ask_range(lat_prompt)
+        lon_min, lon_max = ask_range(lon_prompt)
+
+        start = time.perf_counter()
+        previews = {title: idw_grid(entry, lon_min, lon_max, lat_min, lat_max,
+                                    preview_shape(lon_min, lon_max, lat_min, lat_max, max_cells))
+                    for title, entry in entries.items()}
+        print(f"Preview gridded in {time.perf_counter() - start:.2f} s")
+
+        fig, axs = plt.subplots(1, len(previews), figsize=(8 * len(previews), 7), squeeze=False)
+        for ax, (title, (grid_x, grid_y, grid_z)) in zip(axs[0], previews.items()):
+            show_grid(ax, grid_z, grid_extent(grid_x, grid_y), f"{title} (IDW preview)", label=label)
+        plt.tight_layout()
+        plt.show(block=False)
+        plt.pause(0.1)
+        answer = input("Grid this ROI at full quality? [y/n]: ").strip().lower()
+        plt.close(fig)
+        if answer.startswith("y"):
+            return lat_min, lat_max, lon_min, lon_max
+
+if __name__ == "__main__":
+    # Timing check on a national-size synthetic station set
+    from synthetic_surveys import generate_gravity_stations
+    stations = generate_gravity_stations(1_000_000, extent=(25.0, 49.0, -125.0, -67.0), seed=1)
+    start = time.perf_counter()
+    national = preview_tree(stations, "synthetic")
+    print(f"Tree for {len(stations):,} stations built in {time.perf_counter() - start:.2f} s")
+    for roi in [(37.0, 38.0, -114.0, -112.0), (30.0, 45.0, -120.0, -80.0), (38.2, 38.3, -112.3, -112.1)]:
+        start = time.perf_counter()
+        grid_x, grid_y, grid_z = idw_grid(national, roi[2], roi[3], roi[0], roi[1])
+        print(f"ROI {roi}: {grid_z.shape[0]}x{grid_z.shape[1]} preview in {time.perf_counter() - start:.3f} s")
@@ -3,6 +3,13 @@ import geopandas as gpd
 from shapely.geometry import Polygon
 from datetime import datetime
 import os
+from landsat_qa import ee_mask_collection
+from ee_export_manager import add_export, run_exports
+
+# Cloud Storage bucket to export to instead of Drive; finished exports are then
+# downloaded into the local mirror (downloader.py)
+EXPORT_BUCKET = os.environ.get("AIRBORNE_EE_BUCKET")
+MAX_CONCURRENT_EXPORTS = int(os.environ.get("AIRBORNE_EE_MAX_EXPORTS", "4"))
 
 # Personal account authentication (interactive)
 ee.Authenticate()  # This will open a browser window to authenticate
@@ -31,6 +38,8 @@ export_region = RECTgeometry.getInfo()['coordinates']
 # Access Landsat 8 data
 landsat = ee.ImageCollection("LANDSAT/LC08/C02/T1_L2")
 filtered_landsat = landsat.filterBounds(RECTgeometry)
+# Mask clouds, shadows and saturated pixels server-side before compositing
+filtered_landsat = ee_mask_collection(filtered_landsat)
 clipped_landsat = filtered_landsat.map(lambda image: image.clip(RECTgeometry))
 median_image = clipped_landsat.median()
 
@@ -52,25 +61,32 @@ export_params = {
     'maxPixels': 1e13
 }
 
-# Export task function
-def create_export_task(image, name):
-    description = f"Export_{name}_{current_date}_{survey_name}"[:100]
-    task = ee.batch.Export.image.toDrive(
-        image=image,
-        description=description,
-        folder='LandsatExports',  # Will save to your personal Drive now
-        fileNamePrefix=f"{current_date}_{survey_name}_{name}",
-        **export_params
-    )
-    task.start()
-    print(f"Export task started for {name} with description: {description}")
+# Export job function
+def create_export_task(jobs, image, name):
+    description = f"Export_{name}_{current_date}_{survey_name}"
+    add_export(jobs, description, image,
+               destination="gcs" if EXPORT_BUCKET else "drive",
+               folder='LandsatExports',  # Used for Drive exports
+               bucket=EXPORT_BUCKET,
+               prefix=f"{current_date}_{survey_name}_{name}",
+               **export_params)
+
+# Create export jobs
+export_jobs = []
+create_export_task(export_jobs, band4, "B4")
+create_export_task(export_jobs, band5, "B5")
+create_export_task(export_jobs, band6, "B6")
+create_export_task(export_jobs, band7, "B7")
+create_export_task(export_jobs, ratio_4_5, "Ratio_4_5")
+create_export_task(export_jobs, ratio_5_7, "Ratio_5_7")
 
-# Create export tasks
-create_export_task(band4, "B4")
-create_export_task(band5, "B5")
-create_export_task(band6, "B6")
-create_export_task(band7, "B7")
-create_export_task(ratio_4_5, "Ratio_4_5")
-create_export_task(ratio_5_7, "Ratio_5_7")
+# Submit under the concurrency cap and wait for every task; failed tasks are
+# resubmitted, and re-running after an interruption resumes from the ledger
+results = run_exports(export_jobs, ee, max_concurrent=MAX_CONCURRENT_EXPORTS)
 
-print("All export tasks have been started. Check your personal Google Drive under 'LandsatExports'.")
+if EXPORT_BUCKET:
+    for description, entry in results.items():
+        for local_path in entry.get("local_paths", []):
+            print(f"{description}: {local_path}")
+else:
+    print("Finished exports are in your personal Google Drive under 'LandsatExports'.")
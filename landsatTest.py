@@ -5,6 +5,8 @@ import requests
 import rasterio
 import matplotlib.pyplot as plt
 from shapely.geometry import Polygon
+from landsat_qa import apply_mask, ee_mask_collection
+from precision import band_ratio
 
 # Initialize Earth Engine
 ee.Initialize(project='cap2025-airborneinsight')
@@ -37,6 +39,7 @@ try:
     # Access Landsat 4 data
     landsat = ee.ImageCollection("LANDSAT/LT04/C02/T1_L2")  # Select Landsat 4 v2
     filtered_landsat = landsat.filterBounds(RECTgeometry)  # Filter by ROI
+    filtered_landsat = ee_mask_collection(filtered_landsat, bands=["SR_B5", "SR_B7"])  # Mask clouds server-side
 
     # Trim the dataset to only include the area within the polygon
     trimmed_landsat = filtered_landsat.map(lambda image: image.clip(RECTgeometry))
@@ -75,12 +78,12 @@ try:
     mask_b5 = np.logical_and(band5 > 0, band5 < 255)
     mask_b7 = np.logical_and(band7 > 0, band7 < 255)
 
-    # Keep the full image and just mask invalid values during plotting
-    masked_band5 = np.ma.masked_where(~mask_b5, band5)
-    masked_band7 = np.ma.masked_where(~mask_b7, band7)
+    # Keep the full image and set invalid values to NaN (left blank when plotting)
+    masked_band5 = apply_mask(band5, mask_b5)
+    masked_band7 = apply_mask(band7, mask_b7)
 
     # Compute the ratio of Band 5 / Band 7
-    ratio_band5_7 = np.ma.divide(masked_band5, masked_band7)
+    ratio_band5_7 = band_ratio(band5, band7, clear=mask_b5 & mask_b7)
 
     # Plot the images if 'plot' is True
     if plot:
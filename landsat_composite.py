@@ -0,0 +1,261 @@
+import argparse
+import os
+import re
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from landsat_qa import DEFAULT_REJECT, clear_mask
+from potential_filters import METERS_PER_DEGREE
+from stage_timing import stage
+
+# Local median/percentile compositing of Landsat Collection 2 Level-2 scenes, so the
+# spectral layers can be built offline instead of with Earth Engine's .median():
+#
+#   scenes/
+#       LC08_L2SP_038033_20200704_20200913_02_T1_SR_B4.TIF
+#       LC08_L2SP_038033_20200704_20200913_02_T1_SR_B5.TIF
+#       LC08_L2SP_038033_20200704_20200913_02_T1_QA_PIXEL.TIF   (optional, with QA_RADSAT)
+#       LC08_L2SP_038034_20200720_20200911_02_T1_SR_B4.TIF ...
+#
+#   outputs = composite_scenes("scenes", (lat_min, lat_max, lon_min, lon_max), output_dir="composites")
+#
+# Every scene is resampled onto one north-up EPSG:4326 grid over the ROI through a
+# WarpedVRT, so scenes from different WRS paths/rows and UTM zones line up. The grid
+# is processed in row chunks: each chunk reads a window from every scene that
+# overlaps it, stacks them as float32 reflectance with NaN for nodata and for pixels
+# that the scene's QA_PIXEL/QA_RADSAT bands flag as cloud, shadow or saturated
+# (landsat_qa.py; the mask is decoded per window and never stored), and reduces
+# the stack with nanmedian/nanpercentile. Memory is bounded by chunk rows x width x
+# scene count, and chunks run in parallel on a process pool, each worker opening the
+# scenes itself. Outputs are float32 GeoTIFFs, one per band and statistic:
+#
+#   composites/<prefix>_SR_B4_median.tif  <prefix>_SR_B4_p25.tif  <prefix>_SR_B4_count.tif ...
+#
+# rasterio is only imported by the functions that read or write rasters.
+
+LANDSAT_BANDS = ("SR_B4", "SR_B5", "SR_B6", "SR_B7")
+DEFAULT_STATISTICS = ("median",)
+# Collection 2 Level-2 surface reflectance scaling; 0 is the fill value
+SR_SCALE = 0.0000275
+SR_OFFSET = -0.2
+SR_NODATA = 0
+TARGET_CRS = "EPSG:4326"
+SCENE_PATTERN = re.compile(r"^(L[CEOT]0\d_L2S[PR]_\d{6}_\d{8}_\d{8}_\d{2}_T[12RT])_(\w+)\.TIF$", re.IGNORECASE)
+
+QA_BANDS = ("QA_PIXEL", "QA_RADSAT")
+
+# Function to group Collection 2 L2 GeoTIFFs in a folder as {scene id: {band: path}}
+# QA_PIXEL and QA_RADSAT files are always picked up alongside the requested bands.
+def find_scenes(scene_dir, bands=LANDSAT_BANDS):
+    scenes = {}
+    wanted = set(bands) | set(QA_BANDS)
+    for name in sorted(os.listdir(scene_dir)):
+        match = SCENE_PATTERN.match(name)
+        if match and match.group(2).upper() in wanted:
+            scenes.setdefault(match.group(1), {})[match.group(2).upper()] = os.path.join(scene_dir, name)
+    return scenes
+
+# Function to describe the north-up output grid over an ROI at about resolution_m metres per cell
+def roi_grid(roi, resolution_m=30.0):
+    lat_min, lat_max, lon_min, lon_max = roi
+    res_lat = resolution_m / METERS_PER_DEGREE
+    res_lon = resolution_m / (METERS_PER_DEGREE * np.cos(np.radians(0.5 * (lat_min + lat_max))))
+    return {"crs": TARGET_CRS, "bounds": (lon_min, lat_min, lon_max, lat_max),
+            "width": int(np.ceil((lon_max - lon_min) / res_lon)), "height": int(np.ceil((lat_max - lat_min) / res_lat))}
+
+# Function to return the affine transform of an output grid
+def grid_transform(grid):
+    from rasterio.transform import from_bounds
+    return from_bounds(*grid["bounds"], grid["width"], grid["height"])
+
+# Function to choose chunk rows so one chunk's stack stays under max_chunk_mb
+def chunk_rows_for_budget(width, n_scenes, max_chunk_mb=256):
+    # float32 stack plus roughly the same again for nanpercentile's working copy
+    bytes_per_row = width * max(n_scenes, 1) * 4 * 2
+    return int(max(1, min(max_chunk_mb * 1024 * 1024 // bytes_per_row, 4096)))
+
+# Function to name the output layers for a set of statistics ("median", "count" or percentiles)
+def statistic_names(statistics):
+    return [statistic if isinstance(statistic, str) else f"p{statistic:g}" for statistic in statistics]
+
+# Function to reduce a (scenes, rows, cols) float stack with NaN gaps to composite layers
+def composite_stack(stack, statistics=DEFAULT_STATISTICS):
+    layers = {}
+    percentiles = [50.0 if statistic == "median" else float(statistic) for statistic in statistics if statistic != "count"]
+    if percentiles:
+        with warnings.catch_warnings():
+            # Pixels with no valid observation in any scene stay NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            reduced = np.nanpercentile(stack, percentiles, axis=0).astype(np.float32)
+    position = 0
+    for statistic, name in zip(statistics, statistic_names(statistics)):
+        if statistic == "count":
+            layers[name] = np.isfinite(stack).sum(axis=0).astype(np.float32)
+        else:
+            layers[name] = reduced[position]
+            position += 1
+    return layers
+
+# Function to return scene footprints in the output CRS as {path: (left, bottom, right, top)}
+def scene_bounds(paths):
+    import rasterio
+    from rasterio.warp import transform_bounds
+    footprints = {}
+    for path in paths:
+        with rasterio.open(path) as dataset:
+            footprints[path] = transform_bounds(dataset.crs, TARGET_CRS, *dataset.bounds)
+    return footprints
+
+# Function to return the lat/long bounds covered by a block of output rows
+def chunk_bounds(grid, row_start, row_stop):
+    lon_min, lat_min, lon_max, lat_max = grid["bounds"]
+    cell = (lat_max - lat_min) / grid["height"]
+    return lon_min, lat_max - row_stop * cell, lon_max, lat_max - row_start * cell
+
+# Function to read a block of output rows from one raster resampled onto the output grid
+def read_window(path, grid, row_start, row_stop, nodata):
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.vrt import WarpedVRT
+    from rasterio.windows import Window
+    window = Window(0, row_start, grid["width"], row_stop - row_start)
+    with rasterio.open(path) as source, WarpedVRT(source, crs=grid["crs"], transform=grid_transform(grid),
+                                                  width=grid["width"], height=grid["height"],
+                                                  resampling=Resampling.nearest, nodata=nodata) as vrt:
+        return vrt.read(1, window=window)
+
+# Function to read a block of output rows from several scenes as a float32 reflectance stack
+# sources are (band path, QA_PIXEL path or None, QA_RADSAT path or None) per scene.
+def read_chunk_stack(sources, grid, row_start, row_stop, band=None, reject=DEFAULT_REJECT):
+    stack = np.full((len(sources), row_stop - row_start, grid["width"]), np.nan, dtype=np.float32)
+    for index, (path, qa_pixel_path, qa_radsat_path) in enumerate(sources):
+        data = read_window(path, grid, row_start, row_stop, SR_NODATA)
+        valid = data != SR_NODATA
+        if qa_pixel_path:
+            # Outside the scene the QA window reads as fill (bit 0), so it is rejected too
+            qa_radsat = read_window(qa_radsat_path, grid, row_start, row_stop, 0) if qa_radsat_path else None
+            valid &= clear_mask(read_window(qa_pixel_path, grid, row_start, row_stop, 1), qa_radsat, reject,
+                                [band] if band else None)
+        stack[index][valid] = data[valid] * SR_SCALE + SR_OFFSET
+    return stack
+
+# Function to composite one block of output rows (run in a worker process)
+def composite_chunk(sources, grid, row_start, row_stop, statistics=DEFAULT_STATISTICS, band=None, reject=DEFAULT_REJECT):
+    if not sources:
+        empty = np.full((row_stop - row_start, grid["width"]), np.nan, dtype=np.float32)
+        return row_start, row_stop, {name: (np.zeros_like(empty) if name == "count" else empty)
+                                     for name in statistic_names(statistics)}
+    stack = read_chunk_stack(sources, grid, row_start, row_stop, band, reject)
+    return row_start, row_stop, composite_stack(stack, statistics)
+
+# Function to open one float32 GeoTIFF per statistic for a band
+def open_outputs(grid, output_dir, prefix, band, statistics):
+    import rasterio
+    os.makedirs(output_dir, exist_ok=True)
+    profile = {"driver": "GTiff", "dtype": "float32", "count": 1, "crs": grid["crs"], "transform": grid_transform(grid),
+               "width": grid["width"], "height": grid["height"], "nodata": np.nan, "tiled": True,
+               "blockxsize": 256, "blockysize": 256, "compress": "deflate", "predictor": 3, "BIGTIFF": "IF_SAFER"}
+    paths = {name: os.path.join(output_dir, f"{prefix}_{band}_{name}.tif") for name in statistic_names(statistics)}
+    return paths, {name: rasterio.open(path, "w", **profile) for name, path in paths.items()}
+
+# Function to composite one band across scenes in parallel row chunks and write the outputs
+# processes=False runs the chunks on threads instead, for callers such as LandsatNew.py
+# that have no __main__ guard and would be re-run by spawned worker processes.
+# qa_paths maps a band path to its scene's (QA_PIXEL, QA_RADSAT) paths; scenes without
+# QA files are composited unmasked. reject=() turns QA masking off.
+def composite_band(band_paths, grid, band, output_dir, prefix, statistics=DEFAULT_STATISTICS, max_workers=None,
+                   max_chunk_mb=256, processes=True, qa_paths=None, reject=DEFAULT_REJECT):
+    from rasterio.windows import Window
+    footprints = scene_bounds(band_paths)
+    chunk_rows = chunk_rows_for_budget(grid["width"], len(band_paths), max_chunk_mb)
+    chunks = []
+    for row_start in range(0, grid["height"], chunk_rows):
+        row_stop = min(row_start + chunk_rows, grid["height"])
+        left, bottom, right, top = chunk_bounds(grid, row_start, row_stop)
+        # Only scenes whose footprint overlaps this block of rows are read
+        overlapping = [(path,) + tuple((qa_paths or {}).get(path, (None, None))) if reject else (path, None, None)
+                       for path, (s_left, s_bottom, s_right, s_top) in footprints.items()
+                       if s_left < right and s_right > left and s_bottom < top and s_top > bottom]
+        chunks.append((overlapping, row_start, row_stop))
+
+    paths, outputs = open_outputs(grid, output_dir, prefix, band, statistics)
+    with stage("landsat_composite", band=band, scenes=len(band_paths), chunks=len(chunks)) as record:
+        try:
+            with (ProcessPoolExecutor if processes else ThreadPoolExecutor)(max_workers=max_workers) as pool:
+                futures = [pool.submit(composite_chunk, overlapping, grid, row_start, row_stop, tuple(statistics), band,
+                                       tuple(reject))
+                           for overlapping, row_start, row_stop in chunks]
+                for future in as_completed(futures):
+                    row_start, row_stop, layers = future.result()
+                    window = Window(0, row_start, grid["width"], row_stop - row_start)
+                    for name, layer in layers.items():
+                        outputs[name].write(layer, 1, window=window)
+        finally:
+            for output in outputs.values():
+                output.close()
+        record["rows_out"] = grid["width"] * grid["height"]
+    return paths
+
+# Function to composite every band of a scene folder over an ROI
+# Returns {band: {statistic: GeoTIFF path}}.
+def composite_scenes(scene_dir, roi, bands=LANDSAT_BANDS, statistics=DEFAULT_STATISTICS, output_dir=None,
+                     prefix="composite", resolution_m=30.0, max_workers=None, max_chunk_mb=256, processes=True,
+                     reject=DEFAULT_REJECT):
+    scenes = {scene: files for scene, files in find_scenes(scene_dir, bands).items() if set(files) - set(QA_BANDS)}
+    if not scenes:
+        print(f"No Collection 2 L2 scenes with bands {', '.join(bands)} found in {scene_dir}")
+        return None
+    output_dir = output_dir or os.path.join(scene_dir, "composites")
+    grid = roi_grid(roi, resolution_m)
+    start = time.perf_counter()
+    outputs = {}
+    for band in bands:
+        band_paths = [files[band] for files in scenes.values() if band in files]
+        qa_paths = {files[band]: (files.get("QA_PIXEL"), files.get("QA_RADSAT")) for files in scenes.values() if band in files}
+        outputs[band] = composite_band(band_paths, grid, band, output_dir, prefix, statistics, max_workers, max_chunk_mb,
+                                       processes, qa_paths, reject)
+    print(f"Composited {len(scenes)} scenes x {len(bands)} bands onto a {grid['height']} x {grid['width']} grid "
+          f"in {time.perf_counter() - start:.1f} s")
+    return outputs
+
+# Function to read one composite layer as a float32 array
+def read_composite(path):
+    import rasterio
+    with rasterio.open(path) as dataset:
+        return dataset.read(1)
+
+# Function to return median composites of the LandsatNew.py bands ({"B4": array, ...}) for an ROI
+def composite_bands(scene_dir, roi, output_dir=None, resolution_m=30.0, max_workers=None, processes=True):
+    outputs = composite_scenes(scene_dir, roi, LANDSAT_BANDS, ("median",), output_dir, resolution_m=resolution_m,
+                               max_workers=max_workers, processes=processes)
+    if outputs is None:
+        return None
+    return {band.replace("SR_", ""): read_composite(paths["median"]) for band, paths in outputs.items()}
+
+# Function to parse statistics such as "median", "count" or "25"
+def parse_statistic(text):
+    return text if text in ("median", "count") else float(text)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Median/percentile composites of local Landsat C2 L2 scenes over an ROI.")
+    parser.add_argument("scene_dir")
+    parser.add_argument("--lat", required=True, help="latitude range min,max")
+    parser.add_argument("--lon", required=True, help="longitude range min,max")
+    parser.add_argument("--bands", nargs="+", default=list(LANDSAT_BANDS))
+    parser.add_argument("--statistics", nargs="+", type=parse_statistic, default=list(DEFAULT_STATISTICS),
+                        help="median, count and/or percentiles such as 25 75")
+    parser.add_argument("--output-dir")
+    parser.add_argument("--prefix", default="composite")
+    parser.add_argument("--resolution", type=float, default=30.0, help="output cell size in metres")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-chunk-mb", type=int, default=256)
+    parser.add_argument("--no-qa", action="store_true", help="do not mask clouds/shadows with QA_PIXEL and QA_RADSAT")
+    args = parser.parse_args()
+    lat_min, lat_max = map(float, args.lat.split(','))
+    lon_min, lon_max = map(float, args.lon.split(','))
+    composite_scenes(args.scene_dir, (lat_min, lat_max, lon_min, lon_max), [band.upper() for band in args.bands],
+                     args.statistics, args.output_dir, args.prefix, args.resolution, args.workers, args.max_chunk_mb,
+                     reject=() if args.no_qa else DEFAULT_REJECT)
@@ -0,0 +1,113 @@
+import argparse
+import os
+
+import numpy as np
+
+# Cloud, shadow and saturation masking from Landsat Collection 2 QA bands.
+#
+# QA_PIXEL (16-bit) flags, one bit each:
+#   0 fill   1 dilated cloud   2 cirrus   3 cloud   4 cloud shadow   5 snow   6 clear   7 water
+# QA_RADSAT (16-bit): bits 0-6 flag saturation in bands 1-7, bit 11 terrain occlusion.
+#
+# The flags to reject are OR-ed into one integer, so decoding a whole scene is a
+# single bitwise AND and compare:
+#
+#   clear = clear_mask(qa_pixel, qa_radsat, bands=("SR_B4", "SR_B5"))
+#   packed = pack_mask(clear)                 # 1 bit per pixel, 8x smaller than bool
+#   ratio = band_ratio(b4, b5, clear=unpack_mask(packed))   # precision.py; NaN where not clear
+#
+# Masks are applied by writing NaN into float32 arrays (or into a composite stack),
+# never as float masked arrays. ee_clear_mask() builds the same test server-side
+# when Earth Engine is the backend, so masked pixels never leave Google's servers.
+
+QA_PIXEL_BITS = {"fill": 0, "dilated_cloud": 1, "cirrus": 2, "cloud": 3, "cloud_shadow": 4, "snow": 5,
+                 "clear": 6, "water": 7}
+RADSAT_BAND_BITS = {f"SR_B{band}": band - 1 for band in range(1, 8)}
+TERRAIN_OCCLUSION_BIT = 11
+DEFAULT_REJECT = ("fill", "dilated_cloud", "cirrus", "cloud", "cloud_shadow")
+
+# Function to combine flag names into one QA_PIXEL bit mask
+def qa_bits(flags=DEFAULT_REJECT):
+    bits = 0
+    for flag in flags:
+        if flag not in QA_PIXEL_BITS:
+            raise ValueError(f"Unknown QA_PIXEL flag '{flag}'; expected one of {sorted(QA_PIXEL_BITS)}")
+        bits |= 1 << QA_PIXEL_BITS[flag]
+    return bits
+
+# Function to combine band names into one QA_RADSAT bit mask (plus terrain occlusion)
+def radsat_bits(bands=None, terrain_occlusion=True):
+    bits = 1 << TERRAIN_OCCLUSION_BIT if terrain_occlusion else 0
+    for band in (bands or RADSAT_BAND_BITS):
+        if band in RADSAT_BAND_BITS:
+            bits |= 1 << RADSAT_BAND_BITS[band]
+    return bits
+
+# Function to decode QA bands to a boolean array that is True where a pixel is usable
+# Saturation is only checked for the bands that will be used (all bands by default).
+def clear_mask(qa_pixel, qa_radsat=None, flags=DEFAULT_REJECT, bands=None):
+    clear = (np.asarray(qa_pixel) & qa_bits(flags)) == 0
+    if qa_radsat is not None:
+        clear &= (np.asarray(qa_radsat) & radsat_bits(bands)) == 0
+    return clear
+
+# Function to pack a boolean mask to 1 bit per pixel; returns {"bits", "shape"}
+def pack_mask(mask):
+    mask = np.asarray(mask, dtype=bool)
+    return {"bits": np.packbits(mask, axis=-1), "shape": mask.shape}
+
+# Function to unpack a mask from pack_mask (plain boolean masks pass through)
+def unpack_mask(mask):
+    if isinstance(mask, dict):
+        return np.unpackbits(mask["bits"], axis=-1, count=mask["shape"][-1]).astype(bool).reshape(mask["shape"])
+    return np.asarray(mask, dtype=bool)
+
+# Function to set pixels that are not clear to NaN in a float array, in place when possible
+def apply_mask(values, mask):
+    clear = unpack_mask(mask)
+    if not (isinstance(values, np.ndarray) and values.dtype.kind == "f" and values.flags.writeable):
+        values = np.asarray(values, dtype=np.float32).copy()
+    np.copyto(values, np.nan, where=~clear)
+    return values
+
+# Function to save a packed mask as .npz
+def save_mask(path, mask):
+    packed = mask if isinstance(mask, dict) else pack_mask(mask)
+    np.savez_compressed(path, bits=packed["bits"], shape=np.asarray(packed["shape"]))
+    return path
+
+# Function to load a packed mask saved with save_mask
+def load_mask(path):
+    with np.load(path) as saved:
+        return {"bits": saved["bits"], "shape": tuple(saved["shape"])}
+
+# Function to return an Earth Engine image masked by its own QA bands (server-side)
+# Use with ImageCollection.map before .median() so clouds never enter the composite.
+def ee_clear_mask(image, flags=DEFAULT_REJECT, bands=None):
+    clear = image.select("QA_PIXEL").bitwiseAnd(qa_bits(flags)).eq(0)
+    clear = clear.And(image.select("QA_RADSAT").bitwiseAnd(radsat_bits(bands)).eq(0))
+    return image.updateMask(clear)
+
+# Function to mask every image of an Earth Engine collection server-side
+def ee_mask_collection(collection, flags=DEFAULT_REJECT, bands=None):
+    return collection.map(lambda image: ee_clear_mask(image, flags, bands))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode a Landsat C2 QA_PIXEL (and QA_RADSAT) band to a packed clear mask.")
+    parser.add_argument("qa_pixel", help="QA_PIXEL GeoTIFF")
+    parser.add_argument("--qa-radsat", help="QA_RADSAT GeoTIFF")
+    parser.add_argument("--reject", nargs="+", default=list(DEFAULT_REJECT), choices=sorted(QA_PIXEL_BITS))
+    parser.add_argument("--output", help="output .npz (default next to the QA_PIXEL file)")
+    args = parser.parse_args()
+
+    import rasterio
+    with rasterio.open(args.qa_pixel) as dataset:
+        pixel = dataset.read(1)
+    radsat = None
+    if args.qa_radsat:
+        with rasterio.open(args.qa_radsat) as dataset:
+            radsat = dataset.read(1)
+    scene_mask = clear_mask(pixel, radsat, args.reject)
+    output = args.output or os.path.splitext(args.qa_pixel)[0] + "_clear.npz"
+    save_mask(output, scene_mask)
+    print(f"{scene_mask.mean():.1%} of pixels clear; mask saved to {output}")
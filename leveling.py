@@ -0,0 +1,234 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import lsqr
+
+from flight_lines import along_line_position, build_line_index, local_metres, scatter_back
+from potential_filters import apply_filters
+from precision import VALUE_DTYPE
+from stage_timing import stage
+
+# Tie-line leveling for flight-line magnetic data. NURE lines carry level offsets
+# that show up as corrugations in the gridded product. Leveling works on the
+# raw samples (line, fid, lat, long, value):
+#
+#   1. Samples are put in line order with flight_lines.build_line_index and every
+#      pair of consecutive samples on a line is a segment. Segments are
+#      hashed into a uniform grid of cells and only segments sharing a cell are
+#      tested, with a vectorized segment-intersection test, to find crossovers.
+#   2. Each line gets an offset and a linear trend along the line. All crossover
+#      misfits go into one sparse least-squares system solved with lsqr, with the
+#      mean offset pinned to zero and a small damping on the trends. Crossovers
+#      with outlying residuals are dropped and the system re-solved.
+#   3. Optionally, the gridded result is micro-leveled (microlevel_grid, used by
+#      magsavingnew.py): striping parallel to the lines is isolated with a
+#      high-pass and directional filter, clipped to a small amplitude and subtracted.
+#
+# Traverse and tie lines are told apart by heading, so no line-numbering
+# convention is assumed; crossings between two lines of the same kind are ignored.
+# Samples with a missing value or position take no part in crossovers and are
+# left as they are; one NaN reading must not turn every correction into NaN.
+
+# Function to classify lines as traverse (False) or tie (True) by heading
+# The dominant heading (the traverse direction) is the length-weighted circular mean
+# of doubled angles; lines more than 45 degrees away from it are tie lines.
+def classify_tie_lines(headings, lengths):
+    # Lines without a finite heading carry no weight and count as traverse lines
+    lengths = np.where(np.isfinite(headings) & np.isfinite(lengths), lengths, 0.0)
+    headings = np.nan_to_num(headings)
+    doubled = np.radians(2 * headings)
+    dominant = np.degrees(np.arctan2((lengths * np.sin(doubled)).sum(), (lengths * np.cos(doubled)).sum())) / 2 % 180
+    difference = np.abs((headings - dominant + 90) % 180 - 90)
+    return difference > 45, dominant
+
+# Function to find crossovers between segments of different lines using a grid hash
+# Returns segment index pairs (a, b) and the fractional positions t, u along each.
+def find_crossovers(east, north, codes, segment_start, tie_line=None, cell_size=None):
+    x0, y0 = east[segment_start], north[segment_start]
+    x1, y1 = east[segment_start + 1], north[segment_start + 1]
+    seg_line = codes[segment_start]
+    if cell_size is None:
+        # A few median segment lengths per cell keeps cell occupancy small
+        cell_size = 4 * max(np.median(np.hypot(x1 - x0, y1 - y0)), 1.0)
+
+    # Hash each segment's bounding box into every cell it touches
+    cx0 = np.floor(np.minimum(x0, x1) / cell_size).astype(np.int64)
+    cx1 = np.floor(np.maximum(x0, x1) / cell_size).astype(np.int64)
+    cy0 = np.floor(np.minimum(y0, y1) / cell_size).astype(np.int64)
+    cy1 = np.floor(np.maximum(y0, y1) / cell_size).astype(np.int64)
+    span_x, span_y = cx1 - cx0 + 1, cy1 - cy0 + 1
+    counts = span_x * span_y
+    segment = np.repeat(np.arange(len(x0)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cell_x = cx0[segment] + local % span_x[segment]
+    cell_y = cy0[segment] + local // span_x[segment]
+    cell = (cell_x - cell_x.min()) * (cell_y.max() - cell_y.min() + 1) + (cell_y - cell_y.min())
+
+    order = np.argsort(cell, kind='stable')
+    cell, segment = cell[order], segment[order]
+    group_start = np.r_[0, np.flatnonzero(np.diff(cell)) + 1]
+    group_size = np.diff(np.r_[group_start, len(cell)])
+    position = np.arange(len(cell)) - np.repeat(group_start, group_size)
+    remaining = np.repeat(group_size, group_size) - position - 1
+
+    # Pair every entry with the entries after it in the same cell, one offset at a time
+    pairs_a, pairs_b = [], []
+    for offset in range(1, int(group_size.max()) if len(group_size) else 1):
+        has_partner = remaining >= offset
+        a = segment[has_partner]
+        b = segment[np.flatnonzero(has_partner) + offset]
+        keep = seg_line[a] != seg_line[b]
+        if tie_line is not None:
+            keep &= tie_line[seg_line[a]] != tie_line[seg_line[b]]
+        pairs_a.append(a[keep])
+        pairs_b.append(b[keep])
+    if not pairs_a:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0), np.empty(0)
+    a, b = np.concatenate(pairs_a), np.concatenate(pairs_b)
+    # The same pair can share several cells
+    pair_keys = np.unique(np.minimum(a, b) * len(x0) + np.maximum(a, b))
+    a, b = pair_keys // len(x0), pair_keys % len(x0)
+
+    # Vectorized segment intersection: p + t r = q + u s
+    rx, ry = x1[a] - x0[a], y1[a] - y0[a]
+    sx, sy = x1[b] - x0[b], y1[b] - y0[b]
+    qpx, qpy = x0[b] - x0[a], y0[b] - y0[a]
+    denominator = rx * sy - ry * sx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (qpx * sy - qpy * sx) / denominator
+        u = (qpx * ry - qpy * rx) / denominator
+    hit = (denominator != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    return a[hit], b[hit], t[hit], u[hit]
+
+# Function to compute per-line offset and trend corrections from crossovers
+# Returns a DataFrame indexed by line label with offset, trend (nT per unit of the
+# normalized along-line position, -1 at the line start to +1 at its end) and the
+# number of crossovers used.
+def solve_level_corrections(value, codes, along, segment_start, crossings, n_lines, trend=True,
+                            trend_damping=0.1, reject_sigma=3.0, iterations=2):
+    a, b, t, u = crossings
+    value_a = value[segment_start[a]] + t * (value[segment_start[a] + 1] - value[segment_start[a]])
+    value_b = value[segment_start[b]] + u * (value[segment_start[b] + 1] - value[segment_start[b]])
+    along_a = along[segment_start[a]] + t * (along[segment_start[a] + 1] - along[segment_start[a]])
+    along_b = along[segment_start[b]] + u * (along[segment_start[b] + 1] - along[segment_start[b]])
+    line_a, line_b = codes[segment_start[a]], codes[segment_start[b]]
+    misfit = value_a - value_b
+
+    n_unknowns = 2 * n_lines if trend else n_lines
+    use = np.ones(len(misfit), dtype=bool)
+    solution = np.zeros(n_unknowns)
+    for _ in range(max(iterations, 1)):
+        rows = np.flatnonzero(use)
+        n = len(rows)
+        # offset_a + trend_a * along_a - offset_b - trend_b * along_b = -(value_a - value_b)
+        row_index = [np.arange(n), np.arange(n)]
+        col_index = [line_a[rows], line_b[rows]]
+        entries = [np.ones(n), -np.ones(n)]
+        if trend:
+            row_index += [np.arange(n), np.arange(n)]
+            col_index += [n_lines + line_a[rows], n_lines + line_b[rows]]
+            entries += [along_a[rows], -along_b[rows]]
+        # Pin the mean offset to zero so the datum does not drift
+        row_index.append(np.full(n_lines, n))
+        col_index.append(np.arange(n_lines))
+        entries.append(np.ones(n_lines))
+        rhs = np.r_[-misfit[rows], 0.0]
+        if trend:
+            # Damp trends so lines with one or two crossovers do not tilt freely
+            row_index.append(n + 1 + np.arange(n_lines))
+            col_index.append(n_lines + np.arange(n_lines))
+            entries.append(np.full(n_lines, trend_damping))
+            rhs = np.r_[rhs, np.zeros(n_lines)]
+        matrix = sparse.csr_matrix((np.concatenate(entries), (np.concatenate(row_index), np.concatenate(col_index))),
+                                   shape=(len(rhs), n_unknowns))
+        solution = lsqr(matrix, rhs, atol=1e-10, btol=1e-10)[0]
+
+        # Drop crossovers whose residual is an outlier and solve again
+        residual = misfit + solution[line_a] - solution[line_b]
+        if trend:
+            residual += solution[n_lines + line_a] * along_a - solution[n_lines + line_b] * along_b
+        spread = 1.4826 * np.median(np.abs(residual[use] - np.median(residual[use]))) or 1.0
+        new_use = np.abs(residual) <= reject_sigma * spread
+        if np.array_equal(new_use, use):
+            break
+        use = new_use
+
+    used = np.bincount(line_a[use], minlength=n_lines) + np.bincount(line_b[use], minlength=n_lines)
+    return solution[:n_lines], (solution[n_lines:] if trend else np.zeros(n_lines)), used, residual[use]
+
+# Function to level a flight-line survey with tie-line crossovers
+# df needs line, fid, lat, long and value_column. Returns a copy with the leveled
+# values in value_column (originals kept in <value_column>_unleveled) and a
+# per-line table of corrections.
+def level_survey(df, value_column='corrected_magnetic', trend=True, tie_lines=None, reject_sigma=3.0):
+    index = build_line_index(df, columns=[value_column])
+    with stage("level", rows_in=len(df)) as record:
+        codes, starts, labels = index["codes"], index["starts"], index["labels"]
+        value = index["columns"][value_column].astype(np.float64)
+        east, north = local_metres(index["columns"]["lat"], index["columns"]["long"])
+        along = along_line_position(index)
+        n_lines = len(starts)
+        headings, lengths = index["heading"], index["length_m"]
+        if tie_lines is None:
+            is_tie, dominant = classify_tie_lines(headings, lengths)
+        else:
+            is_tie, dominant = np.isin(labels, list(tie_lines)), None
+
+        # Segments join consecutive samples of the same line; segments touching a
+        # sample with no value or position are left out of the crossover search
+        valid = np.isfinite(value) & np.isfinite(east) & np.isfinite(north)
+        segment_start = np.flatnonzero((codes[:-1] == codes[1:]) & valid[:-1] & valid[1:])
+        crossings = find_crossovers(east, north, codes, segment_start, is_tie)
+        if len(crossings[0]) == 0:
+            print("No tie-line crossovers found; data left unleveled")
+            return df.copy(), None
+        offsets, trends, used, residual = solve_level_corrections(value, codes, along, segment_start, crossings,
+                                                                  n_lines, trend, reject_sigma=reject_sigma)
+
+        correction = offsets[codes] + trends[codes] * along
+        record["missing"] = int((~valid).sum())
+        leveled = df.copy()
+        leveled[f"{value_column}_unleveled"] = df[value_column]
+        leveled[value_column] = scatter_back(index, value + correction).astype(VALUE_DTYPE)
+        record["rows_out"] = len(leveled)
+        record["crossovers"] = int(len(crossings[0]))
+
+    corrections = pd.DataFrame({"heading": headings, "length_m": lengths, "tie_line": is_tie,
+                                "offset": offsets, "trend": trends, "crossovers": used},
+                               index=pd.Index(labels, name="line"))
+    print(f"Leveled {n_lines} lines ({int(is_tie.sum())} tie lines) from {len(crossings[0]):,} crossovers; "
+          f"crossover misfit RMS {np.sqrt(np.mean(residual ** 2)):.2f} after leveling")
+    return leveled, corrections
+
+# Function to return the traverse heading (degrees from north) from a corrections table
+def traverse_heading(corrections):
+    traverse = corrections[~corrections["tie_line"]]
+    return float(classify_tie_lines(traverse["heading"].to_numpy(), traverse["length_m"].to_numpy())[1])
+
+# Function to remove residual line-parallel striping from a gridded layer
+# line_heading_deg is the traverse heading (0 = north, 90 = east). Striping is
+# isolated by high-passing at a few line spacings and keeping only wavenumbers
+# across the lines, then clipped to +/- amplitude_limit so geology is not removed.
+def microlevel_grid(grid_z, dx_m, dy_m, line_spacing_m, line_heading_deg, amplitude_limit=5.0, cutoff_factor=4.0,
+                    power=4):
+    across = (line_heading_deg + 90) % 180
+    corrugation = apply_filters(grid_z, {"striping": [("bandpass", {"long_wavelength": cutoff_factor * line_spacing_m}),
+                                                      ("directional", {"azimuth": across, "power": power})]},
+                                dx_m, dy_m)["striping"]
+    corrugation = np.clip(corrugation, -amplitude_limit, amplitude_limit)
+    return (np.asarray(grid_z) - np.nan_to_num(corrugation)).astype(VALUE_DTYPE), corrugation
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Level a flight-line CSV (line, fid, lat, long, value) with tie-line crossovers.")
+    parser.add_argument("csv")
+    parser.add_argument("output")
+    parser.add_argument("--value-column", default="corrected_magnetic")
+    parser.add_argument("--no-trend", action="store_true", help="solve offsets only")
+    args = parser.parse_args()
+    survey = pd.read_csv(args.csv)
+    leveled_survey, line_corrections = level_survey(survey, args.value_column, trend=not args.no_trend)
+    leveled_survey.to_csv(args.output, index=False)
+    if line_corrections is not None:
+        line_corrections.to_csv(args.output.replace(".csv", "_corrections.csv"))
@@ -1,7 +1,9 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy import interpolate
+from gridding import perform_interpolation_with_extrapolation
+from grid_spec import grid_resolution, grid_shape, output_shape, resample_grid
+from stage_timing import stage, size_of
 import os
 import requests
 from io import StringIO
@@ -10,6 +12,9 @@ from io import StringIO
 file_name = "richfield_mag.xyz"
 Survey_name = "Richfield, Utah"
 
+# Shape (rows, cols) of the saved MAG grids; AIRBORNE_GRID_SHAPE overrides it
+OUTPUT_SHAPE = output_shape(1114)
+
 # Get user's desktop path
 desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
 output_folder = os.path.join(desktop_path, "magnetic_txt_files")
@@ -18,30 +23,21 @@ os.makedirs(output_folder, exist_ok=True)
 # Function to load CSV data from GitHub
 def load_csv_from_github():
     url = f'https://github.com/maxfollett/AirBorneInsight2/raw/main/CapDatabases/Raw/{file_name}'
-    response = requests.get(url)
+    with stage("download", source=url) as record:
+        response = requests.get(url)
+        record["bytes"] = len(response.content)
     
     if response.status_code == 200:
         csv_data = response.text
-        df = pd.read_csv(StringIO(csv_data), header=None, sep='\\s+', usecols=[5, 6, 12],
-                         names=["lat", "long", "corrected_magnetic"])
+        with stage("parse") as record:
+            df = pd.read_csv(StringIO(csv_data), header=None, sep='\\s+', usecols=[0, 5, 6, 12],
+                             names=["line", "lat", "long", "corrected_magnetic"])
+            record["rows_out"] = len(df)
         return df
     else:
         print(f"Failed to load data, status code: {response.status_code}")
         return None
 
-# Function to perform interpolation
-def perform_interpolation_with_extrapolation(df, grid_size=1114):
-    grid_x, grid_y = np.mgrid[df['long'].min():df['long'].max():grid_size*1j,
-                               df['lat'].min():df['lat'].max():grid_size*1j]
-    points = np.column_stack((df['long'], df['lat']))
-    values = df['corrected_magnetic'].values
-    
-    grid_z = interpolate.griddata(points, values, (grid_x, grid_y), method='linear')
-    nan_mask = np.isnan(grid_z)
-    grid_z[nan_mask] = interpolate.griddata(points, values, (grid_x[nan_mask], grid_y[nan_mask]), method='nearest')
-    
-    return grid_x, grid_y, grid_z
-
 # Function to save data to a .txt file
 def save_to_txt(grid_z, lat_input, long_input):
     filename = f"MAG_{lat_input}_{long_input}.txt"
@@ -51,7 +47,9 @@ def save_to_txt(grid_z, lat_input, long_input):
 
 # Main function
 def main():
-    df = load_csv_from_github()
+    with stage("load", source=file_name) as record:
+        df = load_csv_from_github()
+        record["rows_out"] = size_of(df)
     if df is None:
         return
     
@@ -69,8 +67,14 @@ def main():
         print("No data found for the given latitude and longitude range.")
         return
     
-    grid_x, grid_y, grid_z = perform_interpolation_with_extrapolation(df_filtered)
-    save_to_txt(grid_z, lat_input, long_input)
+    # Interpolate at a cell size set by the flight-line spacing, then resample to the saved shape
+    extent = (df_filtered['long'].min(), df_filtered['long'].max(), df_filtered['lat'].min(), df_filtered['lat'].max())
+    resolution = grid_resolution(*extent, df_filtered['lat'].to_numpy(), df_filtered['long'].to_numpy(),
+                                 df_filtered['line'].to_numpy())
+    grid_x, grid_y, grid_z = perform_interpolation_with_extrapolation(df_filtered, grid_size=grid_shape(*extent, resolution))
+    grid_x, grid_y, grid_z = resample_grid(grid_x, grid_y, grid_z, OUTPUT_SHAPE, *extent, long_first=True)
+    with stage("save", rows_in=grid_z.size):
+        save_to_txt(grid_z, lat_input, long_input)
 
 if __name__ == "__main__":
     main()
@@ -2,9 +2,15 @@ import pandas as pd  # For handling tabular data
 import numpy as np  # For numerical computations
 import matplotlib.pyplot as plt  # For data visualization
 from shapely.geometry import Point  # For working with geometric data
-from scipy import interpolate  # For interpolation and extrapolation
-import requests  # For making HTTP requests to fetch data
-from io import StringIO  # For handling in-memory text streams
+from tile_cache import grid_roi_cached, dataset_version  # For cached, tiled interpolation
+from stage_timing import stage, size_of  # For per-stage timing
+from precision import point_dtypes  # For float32 value columns
+from leveling import level_survey, microlevel_grid, traverse_heading  # For tie-line leveling and micro-leveling
+from potential_filters import grid_spacing_m  # For grid spacing in metres
+from despike import despike_survey, save_spike_stats  # For along-line despiking
+from downloader import fetch, is_gzip  # For mirrored, resumable downloads
+from grid_spec import data_spacing, grid_resolution, output_shape, resample_grid  # For data-driven grid sizing
+from idw_preview import preview_tree, choose_roi  # For fast ROI previews
 import os  # For file operations
 
 # Define the file name and survey name
@@ -13,18 +19,32 @@ Survey_name = "Marysvale, Utah"
 output_folder = os.path.expanduser("~/Desktop/magnetic_txt_files")
 os.makedirs(output_folder, exist_ok=True)
 
+# Shape (rows, cols) of the saved MAG grids; AIRBORNE_GRID_SHAPE overrides it
+OUTPUT_SHAPE = output_shape((2116, 1486))
+
+# Replace single-sample spikes with the along-line rolling median before leveling
+DESPIKE = True
+
+# Level flight lines against tie lines before gridding to remove corrugations
+LEVEL_LINES = True
+
+# Micro-level the gridded ROI to remove residual striping along the lines (needs LEVEL_LINES)
+MICROLEVEL = True
+
 # Function to load CSV data from a GitHub repository
 def load_csv_from_github():
     url = f'https://github.com/maxfollett/AirBorneInsight2/raw/main/CapDatabases/Raw/{file_name}'
-    response = requests.get(url)
+    with stage("download", source=url) as record:
+        path = fetch(url, record=record)
     
-    if response.status_code == 200:
-        csv_data = response.text
-        df = pd.read_csv(StringIO(csv_data), header=None, sep='\\s+', usecols=[5, 6, 9], 
-                         names=["lat", "long", "corrected_magnetic"])
+    if path is not None:
+        with stage("parse") as record:
+            df = pd.read_csv(path, compression="gzip" if is_gzip(path) else None, header=None, sep='\\s+', usecols=[0, 1, 5, 6, 9], 
+                             names=["line", "fid", "lat", "long", "corrected_magnetic"],
+                             dtype={"line": str, **point_dtypes("corrected_magnetic", ("lat", "long"))})
+            record["rows_out"] = len(df)
         return df
     else:
-        print(f"Failed to load data, status code: {response.status_code}")
         return None
 
 # Function to remove outliers
@@ -38,23 +58,6 @@ def remove_outliers(df):
                     (df['long'].between(Q1_long - 1.5 * IQR_long, Q3_long + 1.5 * IQR_long))]
     return df_cleaned
 
-# Function to interpolate and extrapolate missing magnetic data
-def perform_interpolation_with_extrapolation(df, grid_size=(2116,1486)):
-    rows, cols = grid_size
-    grid_x, grid_y = np.mgrid[
-        df['long'].min():df['long'].max():cols*1j,
-        df['lat'].min():df['lat'].max():rows*1j
-    ]
-    points = np.column_stack((df['long'], df['lat']))
-    values = df['corrected_magnetic'].values
-
-    grid_z = interpolate.griddata(points, values, (grid_x, grid_y), method='linear')
-
-    nan_mask = np.isnan(grid_z)
-    grid_z[nan_mask] = interpolate.griddata(points, values, (grid_x[nan_mask], grid_y[nan_mask]), method='nearest')
-
-    return grid_x, grid_y, grid_z
-
 # Function to save data as .txt file
 def save_to_txt(data, filename):
     filepath = os.path.join(output_folder, filename)
@@ -63,23 +66,60 @@ def save_to_txt(data, filename):
 
 # Main function to execute the processing pipeline
 def main():
-    df = load_csv_from_github()
+    with stage("load", source=file_name) as record:
+        df = load_csv_from_github()
+        record["rows_out"] = size_of(df)
     if df is None:
         return
     
-    df_cleaned = remove_outliers(df)
+    with stage("clean", rows_in=len(df)) as record:
+        df_cleaned = remove_outliers(df)
+        record["rows_out"] = len(df_cleaned)
+    
+    if DESPIKE:
+        df_cleaned, spike_stats = despike_survey(df_cleaned)
+        save_spike_stats(spike_stats, os.path.join(output_folder, f"{os.path.splitext(file_name)[0]}_spikes.csv"))
+    
+    line_corrections = None
+    if LEVEL_LINES:
+        df_cleaned, line_corrections = level_survey(df_cleaned)
     
-    # Get user input for latitude and longitude range
-    lat_min, lat_max = map(float, input("Enter latitude range (min, max): ").split(','))
-    long_min, long_max = map(float, input("Enter longitude range (min, max): ").split(','))
+    # Get user input for latitude and longitude range, previewing each one with fast IDW
+    # gridding until it is confirmed; the full gridding below only runs on the chosen ROI
+    preview = preview_tree(df_cleaned, file_name, x='long', y='lat', value='corrected_magnetic')
+    lat_min, lat_max, long_min, long_max = choose_roi({Survey_name: preview},
+                                                      label='Corrected Magnetic Value (nT)')
     
     # Filter data within inputted lat/lon range
     df_filtered = df_cleaned[(df_cleaned['lat'].between(lat_min, lat_max)) & 
                              (df_cleaned['long'].between(long_min, long_max))]
     
-    grid_x, grid_y, grid_z = perform_interpolation_with_extrapolation(df_filtered)
+    # Node spacing from the measured flight-line spacing of the whole survey, so every
+    # ROI of this survey shares the same cached tiles
+    extent = (df_filtered['long'].min(), df_filtered['long'].max(), df_filtered['lat'].min(), df_filtered['lat'].max())
+    resolution = grid_resolution(*extent, df_cleaned['lat'].to_numpy(), df_cleaned['long'].to_numpy(),
+                                 df_cleaned['line'].to_numpy())
+    
+    # Grid the filtered extent from cached tiles; tiles are built from all cleaned points
+    # so overlapping or panned ROIs reuse them
+    points = df_cleaned.rename(columns={"long": "x", "lat": "y", "corrected_magnetic": "value"})
+    grid_x, grid_y, grid_z = grid_roi_cached(points, *extent, resolution=resolution, method='linear',
+                                             version=dataset_version(points))
+    
+    # Subtract striping parallel to the traverse lines that tie-line leveling left behind
+    if MICROLEVEL and line_corrections is not None:
+        line_spacing, _ = data_spacing(df_cleaned['lat'].to_numpy(), df_cleaned['long'].to_numpy(),
+                                       df_cleaned['line'].to_numpy())
+        if line_spacing:
+            dx_m, dy_m = grid_spacing_m((grid_x[0, 0], grid_x[0, -1], grid_y[0, 0], grid_y[-1, 0]), grid_z.shape)
+            grid_z, _ = microlevel_grid(grid_z, dx_m, dy_m, line_spacing, traverse_heading(line_corrections))
+    
+    # Resample to the saved shape and transpose back to the [long, lat] layout
+    grid_x, grid_y, grid_z = resample_grid(grid_x, grid_y, grid_z, OUTPUT_SHAPE, *extent)
+    grid_x, grid_y, grid_z = grid_x.T, grid_y.T, grid_z.T
     
     filename = f"MAG_{lat_min}_{lat_max}_{long_min}_{long_max}.txt"
-    save_to_txt(grid_z, filename)
+    with stage("save", rows_in=grid_z.size):
+        save_to_txt(grid_z, filename)
 
 main()
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# Streaming standardizer for raw NURE flight-line files (e.g. cedar_city_mag.xyz).
+# The raw file is read in chunks, only the requested columns are parsed, and each
+# column is appended to its own little-endian binary file in the output folder:
+#
+#   CedarCity_mag/
+#       lat.bin  long.bin  totmag.bin  resmagCM4.bin
+#       meta.json          (row count, dtypes and per-column min/max)
+#
+# Memory stays bounded by chunk_size no matter how large the quadrangle file is.
+# Column positions follow the Entity_and_Attribute_Overview in the *_meta.txt files.
+#
+# Line labels are alphanumeric (L1010, L1010A, T20), so line.bin holds integer codes
+# in order of first appearance and meta.json holds the label of each code under
+# columns.line.labels; load_standardized turns them back into labels.
+
+MAG_LAYOUT = ["line", "fid", "time", "day", "year", "lat", "long", "radalt",
+              "totmag", "resmag", "diurnal", "geology", "resmagCM4"]
+RAD_LAYOUT = ["line", "fid", "time", "day", "year", "lat", "long", "radalt",
+              "resmag", "geology", "qual", "app_K", "app_U", "app_Th", "U_Th_ratio",
+              "U_K_ratio", "Th_K_ratio", "total_count", "atmos_BI214", "air_temp", "air_press"]
+LAYOUTS = {"mag": MAG_LAYOUT, "rad": RAD_LAYOUT}
+
+# Names used by StandardizingNov10.py and the standardized CSVs
+COLUMN_ALIASES = {
+    "Latitude(DD)": "lat",
+    "Longitude(DD)": "long",
+    "latitude": "lat",
+    "longitude": "long",
+    "TotMagField": "totmag",
+    "CorrectedMag": "resmagCM4",
+}
+
+INTEGER_COLUMNS = {"line", "fid", "day", "year"}
+TEXT_COLUMNS = {"geology", "qual"}
+DEFAULT_MAG_COLUMNS = ["lat", "long", "totmag", "resmagCM4"]
+
+# NURE files mark unusable values with dummies such as -99.9, -999.9 and -9999.9;
+# the time channel (HHMMSS, stored as float so it can hold NaN) uses 999999
+DUMMY_VALUES = (-99.9, -999.9, -9999.9, -99999.9)
+COLUMN_DUMMIES = {"time": (999999.0,)}
+
+# Function to resolve requested column names to (name, position) pairs for a layout
+def resolve_columns(columns, layout="mag"):
+    names = LAYOUTS[layout] if isinstance(layout, str) else list(layout)
+    resolved = []
+    for column in columns:
+        name = COLUMN_ALIASES.get(column, column)
+        if name not in names:
+            raise ValueError(f"Column '{column}' is not in the {layout} layout: {names}")
+        if name in TEXT_COLUMNS:
+            raise ValueError(f"Column '{column}' is text and cannot be stored in the binary output")
+        resolved.append((name, names.index(name)))
+    return resolved
+
+# Function to return the storage dtype for a column
+def column_dtype(name):
+    return np.dtype("<i4") if name in INTEGER_COLUMNS else np.dtype("<f4")
+
+# Function to return the dtype pandas should parse a column with
+def parse_dtype(name):
+    if name == "line":
+        # Line numbers are documented as alphanumeric, so parse them as text
+        return str
+    return np.float64 if name in INTEGER_COLUMNS else np.float32
+
+# Function to encode line labels as integer codes, extending the label table
+# labels maps label -> code and grows as new labels appear, so codes stay the same
+# across chunks; missing labels become -1.
+def encode_labels(values, labels):
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    table = np.array([labels.setdefault(str(label), len(labels)) for label in uniques], dtype=np.int64)
+    encoded = np.full(len(codes), -1, dtype="<i4")
+    encoded[codes >= 0] = table[codes[codes >= 0]]
+    return encoded
+
+# Function to convert one parsed chunk column to its storage dtype
+# labels is the running line label table (see encode_labels).
+def convert_column(values, name, dummy_to_nan=True, labels=None):
+    if name == "line":
+        return encode_labels(values, {} if labels is None else labels)
+    if name in INTEGER_COLUMNS:
+        return values.fillna(-1).to_numpy(dtype=np.int64).astype("<i4")
+    data = values.to_numpy(dtype=np.float32, copy=True)
+    if dummy_to_nan:
+        data[np.isin(data, np.asarray(COLUMN_DUMMIES.get(name, DUMMY_VALUES), dtype=np.float32))] = np.nan
+    return data.astype("<f4", copy=False)
+
+# Function to stream a raw NURE XYZ file into a binary columnar folder
+def standardize_nure_file(raw_path, output_dir, columns=DEFAULT_MAG_COLUMNS, layout="mag",
+                          chunk_size=1_000_000, dummy_to_nan=True):
+    resolved = resolve_columns(columns, layout)
+    positions = sorted({position for _, position in resolved})
+    os.makedirs(output_dir, exist_ok=True)
+
+    stats = {name: {"dtype": column_dtype(name).str, "min": None, "max": None, "nan_count": 0}
+             for name, _ in resolved}
+    handles = {name: open(os.path.join(output_dir, f"{name}.bin"), "wb") for name, _ in resolved}
+    line_labels = {}
+    rows = 0
+    start = time.perf_counter()
+    try:
+        # Only the requested positions are converted, straight to their parse dtype
+        dtypes = {position: parse_dtype(name) for name, position in resolved}
+        reader = pd.read_csv(raw_path, sep=r"\s+", header=None, usecols=positions, dtype=dtypes,
+                             chunksize=chunk_size, compression="infer", engine="c")
+        for chunk in reader:
+            for name, position in resolved:
+                data = convert_column(chunk[position], name, dummy_to_nan, line_labels)
+                data.tofile(handles[name])
+                update_stats(stats[name], data)
+            rows += len(chunk)
+            print(f"Standardized {rows:,} rows from {os.path.basename(raw_path)}", end="\r")
+    finally:
+        for handle in handles.values():
+            handle.close()
+    if "line" in stats:
+        stats["line"]["labels"] = list(line_labels)
+
+    meta = {
+        "source": os.path.abspath(raw_path),
+        "layout": layout if isinstance(layout, str) else "custom",
+        "rows": rows,
+        "columns": stats,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(output_dir, "meta.json"), "w") as handle:
+        json.dump(meta, handle, indent=2)
+    print(f"\nSaved {rows:,} rows x {len(resolved)} columns to {output_dir} in {time.perf_counter() - start:.1f} s")
+    return meta
+
+# Function to fold one chunk into a column's running min/max/NaN statistics
+def update_stats(entry, data):
+    if data.dtype.kind == "f":
+        finite = data[np.isfinite(data)]
+        entry["nan_count"] += int(len(data) - len(finite))
+    else:
+        finite = data
+    if len(finite) == 0:
+        return
+    low, high = finite.min().item(), finite.max().item()
+    entry["min"] = low if entry["min"] is None else min(entry["min"], low)
+    entry["max"] = high if entry["max"] is None else max(entry["max"], high)
+
+# Function to write in-memory arrays as a standardized binary columnar folder
+def write_columns(output_dir, arrays, source=None, layout="custom"):
+    os.makedirs(output_dir, exist_ok=True)
+    rows = len(next(iter(arrays.values()))) if arrays else 0
+    stats = {}
+    for name, values in arrays.items():
+        dtype = column_dtype(name)
+        labels = None
+        if name == "line" and np.asarray(values).dtype.kind in "OUS":
+            labels = {}
+            values = encode_labels(values, labels)
+        data = np.ascontiguousarray(values, dtype=dtype)
+        if len(data) != rows:
+            raise ValueError(f"Column '{name}' has {len(data)} rows, expected {rows}")
+        data.tofile(os.path.join(output_dir, f"{name}.bin"))
+        stats[name] = {"dtype": dtype.str, "min": None, "max": None, "nan_count": 0}
+        if labels is not None:
+            stats[name]["labels"] = list(labels)
+        update_stats(stats[name], data)
+    meta = {
+        "source": source,
+        "layout": layout,
+        "rows": rows,
+        "columns": stats,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(output_dir, "meta.json"), "w") as handle:
+        json.dump(meta, handle, indent=2)
+    return meta
+
+# Function to read the meta.json of a standardized folder
+def read_meta(output_dir):
+    with open(os.path.join(output_dir, "meta.json")) as handle:
+        return json.load(handle)
+
+# Function to load standardized columns as memory-mapped arrays (or a DataFrame)
+# In a DataFrame, line codes come back as a categorical of their labels; as arrays
+# they stay codes, with the labels in read_meta(output_dir)["columns"]["line"]["labels"].
+def load_standardized(output_dir, columns=None, as_dataframe=True):
+    meta = read_meta(output_dir)
+    names = [COLUMN_ALIASES.get(column, column) for column in (columns or meta["columns"])]
+    arrays = {}
+    for name in names:
+        if name not in meta["columns"]:
+            raise ValueError(f"Column '{name}' was not standardized in {output_dir}")
+        path = os.path.join(output_dir, f"{name}.bin")
+        arrays[name] = np.memmap(path, dtype=np.dtype(meta["columns"][name]["dtype"]), mode="r",
+                                 shape=(meta["rows"],)) if meta["rows"] else np.empty(0, meta["columns"][name]["dtype"])
+    if not as_dataframe:
+        return arrays
+    if "line" in arrays and "labels" in meta["columns"]["line"]:
+        arrays["line"] = pd.Categorical.from_codes(np.asarray(arrays["line"]), meta["columns"]["line"]["labels"])
+    return pd.DataFrame(arrays, copy=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream a raw NURE .xyz file into binary columns.")
+    parser.add_argument("raw_path")
+    parser.add_argument("output_dir")
+    parser.add_argument("--layout", choices=sorted(LAYOUTS), default="mag")
+    parser.add_argument("--columns", nargs="+", default=DEFAULT_MAG_COLUMNS)
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    parser.add_argument("--keep-dummies", action="store_true", help="keep -99.9/-999.9 dummy values")
+    args = parser.parse_args()
+    standardize_nure_file(args.raw_path, args.output_dir, args.columns, args.layout,
+                          args.chunk_size, dummy_to_nan=not args.keep_dummies)
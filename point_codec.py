@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from stage_timing import stage
+
+# Compact binary point format (.pts) for survey coordinates and values. The
+# standardized CSVs spend about 30 bytes of text per row on information that
+# fits in a few bytes, so columns are stored as scaled integers instead:
+#
+#   lat, long   round(value * scale) as int32 deltas along acquisition order
+#   others      round(value * scale) as int32
+#
+# Rows are cut into blocks; each column of a block is byte-shuffled (all first
+# bytes, then all second bytes, ...) so small deltas become long runs of zero
+# bytes, and compressed independently. File layout:
+#
+#   block 0 column 0 | block 0 column 1 | ... | block N column M | footer JSON | footer length (<u4) | MAGIC
+#
+# The footer holds the scales, and per block the byte ranges, row count, bbox and
+# NaN flags, so a reader can skip blocks outside an ROI and decode the rest straight
+# into NumPy arrays with one decompress, one cumsum and one multiply per column.
+# zlib is always available; zstandard is used when installed and requested.
+
+MAGIC = b"AIRPTS1\n"
+DEFAULT_BLOCK_ROWS = 65536
+# 4 decimals for coordinates and 0.1 nT for magnetics, as in the standardized CSVs
+DEFAULT_SCALES = {"lat": 1e4, "long": 1e4}
+DEFAULT_VALUE_SCALE = 10.0
+DELTA_COLUMNS = ("lat", "long")
+INT32_LIMIT = 2 ** 31 - 1
+
+# Function to return (compress, decompress) callables for a compressor name
+def compressor(name, level=6):
+    if name == "zlib":
+        return (lambda data: zlib.compress(data, level)), zlib.decompress
+    if name == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress, zstandard.ZstdDecompressor().decompress
+    raise ValueError(f"Unknown compressor '{name}'; expected 'zlib' or 'zstd'")
+
+# Function to quantize one column of a block to int32 (deltas for coordinate columns)
+# NaNs are replaced by the previous finite value and reported in a packed bitmap.
+def encode_column(values, scale, delta):
+    values = np.asarray(values, dtype=np.float64)
+    nan_mask = ~np.isfinite(values)
+    if nan_mask.any():
+        filled = pd.Series(values).ffill().bfill().fillna(0.0).to_numpy()
+    else:
+        filled = values
+    scaled = np.rint(filled * scale).astype(np.int64)
+    if delta:
+        scaled = np.diff(scaled, prepend=0)
+    if len(scaled) and np.abs(scaled).max() > INT32_LIMIT:
+        raise ValueError(f"Values overflow int32 at scale {scale}; use a smaller scale")
+    shuffled = scaled.astype("<i4").view(np.uint8).reshape(-1, 4).T.tobytes()
+    return shuffled, (np.packbits(nan_mask).tobytes() if nan_mask.any() else b"")
+
+# Function to decode one column of a block back to float values
+def decode_column(payload, nan_bytes, rows, scale, delta, dtype=np.float32):
+    planes = np.frombuffer(payload, dtype=np.uint8).reshape(4, rows)
+    scaled = np.ascontiguousarray(planes.T).view("<i4").ravel()
+    if delta:
+        scaled = np.cumsum(scaled, dtype=np.int64)
+    values = (scaled * (1.0 / scale)).astype(dtype)
+    if nan_bytes:
+        values[np.unpackbits(np.frombuffer(nan_bytes, dtype=np.uint8), count=rows).astype(bool)] = np.nan
+    return values
+
+# Function to write columns (dict of equal-length arrays, in acquisition order) to a .pts file
+# Returns the footer, which like nure_standardize meta.json carries rows and per-column min/max.
+def write_points(path, columns, scales=None, block_rows=DEFAULT_BLOCK_ROWS, compression="zlib", level=6):
+    names = list(columns)
+    rows = len(columns[names[0]]) if names else 0
+    scales = {name: float((scales or {}).get(name, DEFAULT_SCALES.get(name, DEFAULT_VALUE_SCALE))) for name in names}
+    compress, _ = compressor(compression, level)
+    footer = {"rows": rows, "block_rows": block_rows, "compression": compression,
+              "columns": {name: {"scale": scales[name], "delta": name in DELTA_COLUMNS, "min": None, "max": None}
+                          for name in names},
+              "blocks": [], "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with stage("encode_points", rows_in=rows) as record, open(path + ".tmp", "wb") as handle:
+        position = 0
+        for start in range(0, rows, block_rows):
+            stop = min(start + block_rows, rows)
+            block = {"rows": stop - start, "columns": {}}
+            for name in names:
+                values = np.asarray(columns[name][start:stop], dtype=np.float64)
+                payload, nan_bytes = encode_column(values, scales[name], name in DELTA_COLUMNS)
+                compressed = compress(payload)
+                handle.write(compressed)
+                handle.write(nan_bytes)
+                block["columns"][name] = [position, len(compressed), len(nan_bytes)]
+                position += len(compressed) + len(nan_bytes)
+                finite = values[np.isfinite(values)]
+                if len(finite):
+                    entry = footer["columns"][name]
+                    low, high = float(finite.min()), float(finite.max())
+                    entry["min"] = low if entry["min"] is None else min(entry["min"], low)
+                    entry["max"] = high if entry["max"] is None else max(entry["max"], high)
+                    if name in DELTA_COLUMNS:
+                        block[f"{name}_range"] = [low, high]
+            footer["blocks"].append(block)
+        encoded = json.dumps(footer).encode()
+        handle.write(encoded)
+        handle.write(struct.pack("<I", len(encoded)))
+        handle.write(MAGIC)
+        record["bytes"] = handle.tell()
+    os.replace(path + ".tmp", path)
+    return footer
+
+# Function to read the footer of a .pts file
+def read_footer(path):
+    with open(path, "rb") as handle:
+        handle.seek(-(len(MAGIC) + 4), os.SEEK_END)
+        length = struct.unpack("<I", handle.read(4))[0]
+        if handle.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a .pts point file")
+        handle.seek(-(len(MAGIC) + 4 + length), os.SEEK_END)
+        return json.loads(handle.read(length))
+
+# Function to check whether a block's coordinate ranges can intersect an ROI
+def block_in_roi(block, lat_min, lat_max, long_min, long_max):
+    lat_range, long_range = block.get("lat_range"), block.get("long_range")
+    if lat_range is None or long_range is None:
+        return True
+    return not (lat_range[1] < lat_min or lat_range[0] > lat_max or long_range[1] < long_min or long_range[0] > long_max)
+
+# Function to read a .pts file into arrays (or a DataFrame)
+# roi=(lat_min, lat_max, long_min, long_max) skips blocks outside it and filters the
+# remaining rows; values decode as float32 like the rest of the pipeline.
+def read_points(path, columns=None, roi=None, as_dataframe=True, dtype=np.float32):
+    footer = read_footer(path)
+    names = list(columns or footer["columns"])
+    for name in names:
+        if name not in footer["columns"]:
+            raise ValueError(f"Column '{name}' is not stored in {path}")
+    wanted = list(dict.fromkeys(names + (["lat", "long"] if roi is not None else [])))
+    _, decompress = compressor(footer["compression"])
+    blocks = [block for block in footer["blocks"] if roi is None or block_in_roi(block, *roi)]
+
+    with stage("decode_points", source=path, blocks=len(blocks)) as record, open(path, "rb") as handle:
+        raw = np.memmap(handle, dtype=np.uint8, mode="r") if footer["rows"] else b""
+        parts = {name: [] for name in wanted}
+        for block in blocks:
+            decoded = {}
+            for name in wanted:
+                position, length, nan_length = block["columns"][name]
+                spec = footer["columns"][name]
+                payload = decompress(bytes(raw[position:position + length]))
+                nan_bytes = bytes(raw[position + length:position + length + nan_length])
+                decoded[name] = decode_column(payload, nan_bytes, block["rows"], spec["scale"], spec["delta"], dtype)
+            if roi is not None:
+                lat_min, lat_max, long_min, long_max = roi
+                inside = ((decoded["lat"] >= lat_min) & (decoded["lat"] <= lat_max) &
+                          (decoded["long"] >= long_min) & (decoded["long"] <= long_max))
+                decoded = {name: values[inside] for name, values in decoded.items()}
+            for name in wanted:
+                parts[name].append(decoded[name])
+        arrays = {name: np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype) for name in names}
+        record["rows_out"] = len(arrays[names[0]]) if names else 0
+    return pd.DataFrame(arrays, copy=False) if as_dataframe else arrays
+
+# Function to convert a standardized CSV (lat, long, value columns) to a .pts file
+def convert_csv(csv_path, pts_path=None, scales=None, block_rows=DEFAULT_BLOCK_ROWS, compression="zlib"):
+    pts_path = pts_path or os.path.splitext(csv_path)[0] + ".pts"
+    df = pd.read_csv(csv_path)
+    footer = write_points(pts_path, {name: df[name].to_numpy() for name in df.columns
+                                     if pd.api.types.is_numeric_dtype(df[name])}, scales, block_rows, compression)
+    before, after = os.path.getsize(csv_path), os.path.getsize(pts_path)
+    print(f"{os.path.basename(csv_path)}: {before / 1e6:.2f} MB -> {after / 1e6:.2f} MB "
+          f"({before / max(after, 1):.1f}x, {after / max(footer['rows'], 1):.1f} bytes/row)")
+    return pts_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert standardized point CSVs to the compact .pts format.")
+    parser.add_argument("csv", nargs="+")
+    parser.add_argument("--scale", nargs=2, action="append", metavar=("COLUMN", "SCALE"), default=[],
+                        help="quantization scale for a column (default 1e4 for lat/long, 10 otherwise)")
+    parser.add_argument("--block-rows", type=int, default=DEFAULT_BLOCK_ROWS)
+    parser.add_argument("--compression", choices=["zlib", "zstd"], default="zlib")
+    args = parser.parse_args()
+    column_scales = {name: float(scale) for name, scale in args.scale}
+    for csv_file in args.csv:
+        convert_csv(csv_file, scales=column_scales, block_rows=args.block_rows, compression=args.compression)
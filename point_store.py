@@ -0,0 +1,146 @@
+import json
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from nure_standardize import load_standardized, write_columns
+from point_codec import read_points, write_points
+from stage_timing import stage
+
+# Partitioned point store for survey data. Each survey/channel pair is one
+# partition holding lat, long and value columns in the binary format written by
+# nure_standardize.py:
+#
+#   point_store/
+#       catalog.json                     (bbox, row count and value range per partition)
+#       cedar_city_utah/mag/lat.bin ...
+#       richfield_utah/mag/points.pts    (compact partitions, see point_codec.py)
+#
+# ROI queries read only catalog.json to decide which partitions intersect the ROI,
+# so adding more quadrangles does not slow down queries elsewhere.
+
+CATALOG_FILE = "catalog.json"
+POINTS_FILE = "points.pts"
+
+# Function to turn a survey or channel name into a folder name
+def partition_slug(name):
+    return re.sub(r"[^a-z0-9]+", "_", str(name).lower()).strip("_")
+
+# Function to read the store catalog (an empty catalog if the store is new)
+def read_catalog(store_dir):
+    path = os.path.join(store_dir, CATALOG_FILE)
+    if not os.path.exists(path):
+        return {"partitions": []}
+    with open(path) as handle:
+        return json.load(handle)
+
+# Function to write the catalog atomically so readers never see a half-written file
+def write_catalog(store_dir, catalog):
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, CATALOG_FILE)
+    with open(path + ".tmp", "w") as handle:
+        json.dump(catalog, handle, indent=2)
+    os.replace(path + ".tmp", path)
+
+# Function to add (or replace) one survey/channel partition
+# compact=True stores the partition as one delta-encoded .pts file instead of
+# float32 columns; scales sets its quantization (see point_codec.py).
+def add_partition(store_dir, survey, channel, lat, long, value, compact=False, scales=None):
+    relative_path = os.path.join(partition_slug(survey), partition_slug(channel))
+    lat, long, value = np.asarray(lat), np.asarray(long), np.asarray(value)
+    keep = np.isfinite(lat) & np.isfinite(long) & np.isfinite(value)
+    arrays = {"lat": lat[keep], "long": long[keep], "value": value[keep]}
+    if compact:
+        meta = write_points(os.path.join(store_dir, relative_path, POINTS_FILE), arrays, scales)
+    else:
+        meta = write_columns(os.path.join(store_dir, relative_path), arrays, source=f"{survey}/{channel}")
+    columns = meta["columns"]
+
+    entry = {
+        "survey": survey,
+        "channel": channel,
+        "path": relative_path,
+        "format": "pts" if compact else "columns",
+        "rows": meta["rows"],
+        "lat_min": columns["lat"]["min"], "lat_max": columns["lat"]["max"],
+        "long_min": columns["long"]["min"], "long_max": columns["long"]["max"],
+        "value_min": columns["value"]["min"], "value_max": columns["value"]["max"],
+        "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    catalog = read_catalog(store_dir)
+    catalog["partitions"] = [p for p in catalog["partitions"]
+                             if (p["survey"], p["channel"]) != (survey, channel)] + [entry]
+    write_catalog(store_dir, catalog)
+    print(f"Stored {entry['rows']:,} {channel} points for {survey}")
+    return entry
+
+# Function to add a standardized CSV (lat, long, <value_column>) as a partition
+def add_csv(store_dir, survey, channel, csv_path, value_column='corrected_magnetic', compact=False):
+    df = pd.read_csv(csv_path, usecols=['lat', 'long', value_column], dtype=np.float32)
+    return add_partition(store_dir, survey, channel, df['lat'], df['long'], df[value_column], compact)
+
+# Function to add a nure_standardize.py output folder as a partition
+def add_standardized(store_dir, survey, channel, standardized_dir, value_column, compact=False):
+    columns = load_standardized(standardized_dir, ['lat', 'long', value_column], as_dataframe=False)
+    return add_partition(store_dir, survey, channel, columns['lat'], columns['long'], columns[value_column], compact)
+
+# Function to list catalog partitions whose bounding box intersects the ROI
+def partitions_for_roi(catalog, lat_min, lat_max, long_min, long_max, surveys=None, channels=None):
+    selected = []
+    for partition in catalog["partitions"]:
+        if surveys is not None and partition["survey"] not in surveys:
+            continue
+        if channels is not None and partition["channel"] not in channels:
+            continue
+        if partition["rows"] == 0 or partition["lat_min"] is None:
+            continue
+        if (partition["lat_max"] < lat_min or partition["lat_min"] > lat_max or
+                partition["long_max"] < long_min or partition["long_min"] > long_max):
+            continue
+        selected.append(partition)
+    return selected
+
+# Function to return all points inside an ROI, merged across intersecting partitions
+def query_roi(store_dir, lat_min, lat_max, long_min, long_max, surveys=None, channels=None):
+    catalog = read_catalog(store_dir)
+    partitions = partitions_for_roi(catalog, lat_min, lat_max, long_min, long_max, surveys, channels)
+    frames = []
+    with stage("load", source=store_dir, partitions=len(partitions)) as record:
+        for partition in partitions:
+            if partition.get("format") == "pts":
+                # Blocks outside the ROI are skipped without being decompressed
+                columns = read_points(os.path.join(store_dir, partition["path"], POINTS_FILE),
+                                      roi=(lat_min, lat_max, long_min, long_max), as_dataframe=False)
+            else:
+                columns = load_standardized(os.path.join(store_dir, partition["path"]), as_dataframe=False)
+            lat, long = columns['lat'], columns['long']
+            inside = (lat >= lat_min) & (lat <= lat_max) & (long >= long_min) & (long <= long_max)
+            if not inside.any():
+                continue
+            frames.append(pd.DataFrame({
+                "lat": lat[inside],
+                "long": long[inside],
+                "value": columns['value'][inside],
+                "survey": partition["survey"],
+                "channel": partition["channel"],
+            }))
+        if not frames:
+            result = pd.DataFrame({"lat": np.empty(0, np.float32), "long": np.empty(0, np.float32),
+                                   "value": np.empty(0, np.float32), "survey": [], "channel": []})
+        else:
+            result = pd.concat(frames, ignore_index=True)
+        result["survey"] = result["survey"].astype("category")
+        result["channel"] = result["channel"].astype("category")
+        record["rows_out"] = len(result)
+    return result
+
+if __name__ == "__main__":
+    # Build a store from the standardized CSVs that ship with the repository
+    store = os.path.join("CapDatabases", "PointStore")
+    standardized = os.path.join("CapDatabases", "Standardized")
+    for name in sorted(os.listdir(standardized)):
+        if name.endswith(".csv") and "_HighDensity_" in name:
+            add_csv(store, name.split("_HighDensity_")[0], "mag", os.path.join(standardized, name), compact=True)
@@ -0,0 +1,247 @@
+import argparse
+import os
+from functools import lru_cache
+
+import numpy as np
+from scipy import fft
+
+from precision import VALUE_DTYPE
+from stage_timing import stage
+
+# Wavenumber-domain filters for gridded magnetic and gravity layers. A layer is
+# padded and tapered once, transformed with one forward rFFT, multiplied by every
+# requested operator, and all outputs come back through one batched inverse rFFT:
+#
+#   outputs = apply_filters(grid_z, {"up_500": [("upward", {"height": 500})],
+#                                    "rtp_dz": [("rtp", {"inclination": 64, "declination": 12}), ("dz", {})]},
+#                           dx_m, dy_m)
+#
+# Grids have rows following latitude (south first) like interpolate_to_grid, so x is
+# east and y is north. Spacings are in metres; grid_spacing_m() converts a lat/long
+# extent. Wavenumber grids and taper windows are cached per padded shape and spacing,
+# and scipy.fft keeps its own per-size twiddle caches, so filtering several layers of
+# the same shape only pays for the transforms.
+
+METERS_PER_DEGREE = 111320.0
+
+# Function to return (dx, dy) in metres for a grid covering a lat/long extent
+def grid_spacing_m(extent, shape):
+    lon_min, lon_max, lat_min, lat_max = extent
+    rows, cols = shape
+    mean_lat = np.radians((lat_min + lat_max) / 2)
+    dx_m = (lon_max - lon_min) / max(cols - 1, 1) * METERS_PER_DEGREE * np.cos(mean_lat)
+    dy_m = (lat_max - lat_min) / max(rows - 1, 1) * METERS_PER_DEGREE
+    return float(dx_m), float(dy_m)
+
+# Function to return the padded shape: pad_fraction of each side, rounded up to a fast FFT length
+def padded_shape(shape, pad_fraction=0.25):
+    return tuple(fft.next_fast_len(int(np.ceil(n * (1 + 2 * pad_fraction))), real=True) for n in shape)
+
+# Function to return cached angular wavenumbers (kx, ky, k) in rad/m for an rFFT of a padded shape
+@lru_cache(maxsize=16)
+def wavenumbers(shape, dx_m, dy_m):
+    rows, cols = shape
+    kx = 2 * np.pi * fft.rfftfreq(cols, d=dx_m)
+    ky = 2 * np.pi * fft.fftfreq(rows, d=dy_m)
+    kx, ky = kx[None, :], ky[:, None]
+    k = np.sqrt(kx ** 2 + ky ** 2)
+    for array in (kx, ky, k):
+        array.setflags(write=False)
+    return kx, ky, k
+
+# Function to return a cached cosine taper that is 1 over the data and falls to 0 across the padding
+@lru_cache(maxsize=16)
+def taper_window(shape, padded, offsets):
+    windows = []
+    for n, n_padded, offset in zip(shape, padded, offsets):
+        window = np.ones(n_padded)
+        left, right = offset, n_padded - n - offset
+        if left:
+            window[:left] = 0.5 * (1 - np.cos(np.pi * np.arange(left) / left))
+        if right:
+            window[n_padded - right:] = 0.5 * (1 + np.cos(np.pi * np.arange(1, right + 1) / right))
+        windows.append(window)
+    taper = windows[0][:, None] * windows[1][None, :]
+    taper.setflags(write=False)
+    return taper
+
+# Function to fit a plane z = a * col + b * row + c to the finite cells of a grid
+def fit_plane(grid_z):
+    rows, cols = np.nonzero(np.isfinite(grid_z))
+    design = np.column_stack((cols, rows, np.ones(len(rows))))
+    coefficients, *_ = np.linalg.lstsq(design, grid_z[rows, cols], rcond=None)
+    return coefficients
+
+# Function to evaluate a fitted plane over a grid shape
+def plane_values(coefficients, shape):
+    a, b, c = coefficients
+    return a * np.arange(shape[1])[None, :] + b * np.arange(shape[0])[:, None] + c
+
+# Function to remove the regional plane, pad by edge reflection and taper the padding to zero
+# NaNs are filled with the plane before padding; returns the padded grid, the
+# (row, col) offset of the original data, the NaN mask to restore afterwards and
+# the plane coefficients (per cell) so outputs can have the trend added back.
+def pad_and_taper(grid_z, pad_fraction=0.25):
+    grid_z = np.asarray(grid_z, dtype=np.float64)
+    nan_mask = np.isnan(grid_z)
+    plane = fit_plane(grid_z)
+    filled = np.where(nan_mask, 0.0, grid_z - plane_values(plane, grid_z.shape))
+    padded = padded_shape(grid_z.shape, pad_fraction)
+    offsets = tuple((p - n) // 2 for n, p in zip(grid_z.shape, padded))
+    widths = [(offset, p - n - offset) for n, p, offset in zip(grid_z.shape, padded, offsets)]
+    # Reflection cannot be wider than the grid itself; fall back to edge values beyond that
+    mode = "reflect" if all(max(w) < n for w, n in zip(widths, grid_z.shape)) else "edge"
+    extended = np.pad(filled, widths, mode=mode) * taper_window(grid_z.shape, padded, offsets)
+    return extended, offsets, nan_mask, plane
+
+# Operators: each returns the multiplier for an rFFT spectrum given kx, ky and k.
+
+# Function for upward continuation by height metres
+def upward(kx, ky, k, height):
+    return np.exp(-k * height)
+
+# Function for downward continuation by depth metres, with the gain capped for stability
+def downward(kx, ky, k, depth, max_gain=100.0):
+    return np.minimum(np.exp(k * depth), max_gain)
+
+# Function for the vertical derivative of the given order
+def z_derivative(kx, ky, k, order=1):
+    return k ** order
+
+# Function for the horizontal derivative along x (east) of the given order
+def x_derivative(kx, ky, k, order=1):
+    return (1j * kx) ** order
+
+# Function for the horizontal derivative along y (north) of the given order
+def y_derivative(kx, ky, k, order=1):
+    return (1j * ky) ** order
+
+# Function for reduction to the pole
+# inclination/declination in degrees describe the geomagnetic field; the
+# magnetization direction defaults to the same (induced magnetization).
+def rtp(kx, ky, k, inclination, declination, mag_inclination=None, mag_declination=None):
+    def direction(inc, dec):
+        inc, dec = np.radians(inc), np.radians(dec)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            theta = np.sin(inc) + 1j * np.cos(inc) * (kx * np.sin(dec) + ky * np.cos(dec)) / k
+        theta[k == 0] = 1
+        return theta
+    field = direction(inclination, declination)
+    magnetization = direction(inclination if mag_inclination is None else mag_inclination,
+                              declination if mag_declination is None else mag_declination)
+    return 1 / (field * magnetization)
+
+# Function for a Butterworth band-pass between two wavelengths in metres (either may be None)
+def bandpass(kx, ky, k, long_wavelength=None, short_wavelength=None, order=4):
+    response = np.ones_like(k)
+    with np.errstate(divide='ignore'):
+        if long_wavelength:
+            # High-pass: remove wavelengths longer than long_wavelength
+            response = response / np.sqrt(1 + ((2 * np.pi / long_wavelength) / k) ** (2 * order))
+        if short_wavelength:
+            # Low-pass: remove wavelengths shorter than short_wavelength
+            response = response / np.sqrt(1 + (k / (2 * np.pi / short_wavelength)) ** (2 * order))
+    return response
+
+# Function for a directional (cosine-power) filter passing wavenumbers along an azimuth
+# azimuth is in degrees from north; energy varying along that direction is kept,
+# which for azimuth perpendicular to flight lines isolates line-parallel striping.
+def directional(kx, ky, k, azimuth, power=2):
+    azimuth = np.radians(azimuth)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosine = (kx * np.sin(azimuth) + ky * np.cos(azimuth)) / k
+    cosine[k == 0] = 0
+    return np.abs(cosine) ** power
+
+OPERATORS = {"upward": upward, "downward": downward, "dz": z_derivative, "dx": x_derivative, "dy": y_derivative,
+             "rtp": rtp, "bandpass": bandpass, "directional": directional}
+
+# Function to combine a chain of (operator, params) into one spectral multiplier
+def operator_response(chain, kx, ky, k):
+    if isinstance(chain, tuple):
+        chain = [chain]
+    response = np.ones(k.shape, dtype=np.complex128)
+    for name, params in chain:
+        if name not in OPERATORS:
+            raise ValueError(f"Unknown filter '{name}'; expected one of {sorted(OPERATORS)}")
+        response = response * OPERATORS[name](kx, ky, k, **params)
+    return response
+
+# Function to apply a set of filters to one grid with one forward and one batched inverse FFT
+# filters maps output name -> (operator, params) or a list of them applied in order.
+# Returns {output name: filtered grid} in the working precision, NaNs restored.
+def apply_filters(grid_z, filters, dx_m, dy_m, pad_fraction=0.25, keep_trend=None):
+    with stage("fft_filter", rows_in=int(np.size(grid_z)), filters=len(filters)) as record:
+        extended, (row_offset, col_offset), nan_mask, plane = pad_and_taper(grid_z, pad_fraction)
+        kx, ky, k = wavenumbers(extended.shape, dx_m, dy_m)
+        spectrum = fft.rfft2(extended, workers=-1)
+
+        names = list(filters)
+        stacked = np.empty((len(names),) + spectrum.shape, dtype=np.complex128)
+        for index, name in enumerate(names):
+            stacked[index] = spectrum * operator_response(filters[name], kx, ky, k)
+        results = fft.irfft2(stacked, s=extended.shape, axes=(-2, -1), workers=-1)
+
+        rows, cols = nan_mask.shape
+        outputs = {}
+        for index, name in enumerate(names):
+            result = results[index, row_offset:row_offset + rows, col_offset:col_offset + cols]
+            result = (result + trend_response(filters[name], plane, nan_mask.shape, dx_m, dy_m, keep_trend)).astype(VALUE_DTYPE)
+            result[nan_mask] = np.nan
+            outputs[name] = result
+        record["rows_out"] = sum(result.size for result in outputs.values())
+    return outputs
+
+# Function to return what a filter chain does to the removed regional plane
+# Continuation, RTP and low-pass filters keep the plane, a first x/y derivative
+# turns it into its constant slope, and anything else (dz, high-pass, directional,
+# higher derivatives) maps it to zero. keep_trend=True/False forces the plane back or not.
+def trend_response(chain, plane, shape, dx_m, dy_m, keep_trend=None):
+    if isinstance(chain, tuple):
+        chain = [chain]
+    if keep_trend is not None:
+        return plane_values(plane, shape) if keep_trend else 0.0
+    if any(name == "directional" or (name == "bandpass" and params.get("long_wavelength")) for name, params in chain):
+        return 0.0
+    derivatives = [(name, params.get("order", 1)) for name, params in chain if name in ("dx", "dy", "dz")]
+    if not derivatives:
+        return plane_values(plane, shape)
+    if derivatives == [("dx", 1)]:
+        return plane[0] / dx_m
+    if derivatives == [("dy", 1)]:
+        return plane[1] / dy_m
+    return 0.0
+
+# Function to parse a command-line filter such as "upward:500", "rtp:64,12", "bandpass:20000,2000" or "dz"
+def parse_filter(text):
+    name, _, values = text.partition(":")
+    numbers = [float(value) for value in values.split(",") if value]
+    parameters = {
+        "upward": ["height"], "downward": ["depth", "max_gain"], "dz": ["order"], "dx": ["order"], "dy": ["order"],
+        "rtp": ["inclination", "declination", "mag_inclination", "mag_declination"],
+        "bandpass": ["long_wavelength", "short_wavelength", "order"],
+        "directional": ["azimuth", "power"],
+    }
+    if name not in parameters:
+        raise ValueError(f"Unknown filter '{name}'; expected one of {sorted(parameters)}")
+    params = dict(zip(parameters[name], numbers))
+    for key in ("order", "power"):
+        if key in params:
+            params[key] = int(params[key])
+    return text.replace(":", "_").replace(",", "_"), (name, params)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply FFT potential-field filters to a saved grid.")
+    parser.add_argument("grid", help=".txt or .npy grid with rows following latitude")
+    parser.add_argument("--extent", nargs=4, type=float, required=True, metavar=("LON_MIN", "LON_MAX", "LAT_MIN", "LAT_MAX"))
+    parser.add_argument("--filters", nargs="+", required=True, help="e.g. upward:500 rtp:64,12 dz bandpass:20000,2000")
+    parser.add_argument("--pad", type=float, default=0.25, help="padding as a fraction of each side")
+    args = parser.parse_args()
+
+    grid = np.load(args.grid) if args.grid.endswith(".npy") else np.loadtxt(args.grid)
+    dx_m, dy_m = grid_spacing_m(args.extent, grid.shape)
+    requested = dict(parse_filter(text) for text in args.filters)
+    stem = os.path.splitext(args.grid)[0]
+    for suffix, filtered in apply_filters(grid, requested, dx_m, dy_m, args.pad).items():
+        np.savetxt(f"{stem}_{suffix}.txt", filtered, fmt='%.6f')
+        print(f"Saved: {stem}_{suffix}.txt")
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+
+# Precision policy for gridded values. Source values carry about one decimal
+# (0.1 nT, 0.1 mGal, integer reflectance), so grids, fills, band ratios and saved
+# products are carried as float32 by default. Set AIRBORNE_PRECISION=float64 to run
+# everything in double precision.
+#
+# Coordinates stay float64: they are kept as 1-D axes (or zero-copy broadcast views
+# of them) instead of full meshgrids, so the extra precision costs nothing, and Qhull
+# and the KD-trees need it to separate stations a few metres apart.
+#
+# tests/test_precision.py checks that float32 grids agree with float64 to well
+# inside the 0.1 nT / 0.1 mGal precision of the source data.
+
+PRECISION = os.environ.get("AIRBORNE_PRECISION", "float32").lower()
+if PRECISION not in ("float32", "float64"):
+    print(f"Unknown AIRBORNE_PRECISION '{PRECISION}', using float32")
+    PRECISION = "float32"
+VALUE_DTYPE = np.dtype(PRECISION)
+COORD_DTYPE = np.dtype(np.float64)
+
+# Function to cast data values (not coordinates) to the working precision
+def as_values(values):
+    return np.asarray(values, dtype=VALUE_DTYPE)
+
+# Function to return 1-D float64 axes for a regular grid; grid_size is (rows, cols)
+def grid_axes(lon_min, lon_max, lat_min, lat_max, grid_size):
+    if np.isscalar(grid_size):
+        grid_size = (grid_size, grid_size)
+    rows, cols = grid_size
+    return (np.linspace(lon_min, lon_max, cols, dtype=COORD_DTYPE),
+            np.linspace(lat_min, lat_max, rows, dtype=COORD_DTYPE))
+
+# Function to turn 1-D axes into read-only 2-D coordinate grids without copying
+# Same shapes as np.meshgrid(axis_x, axis_y), or np.mgrid ([long, lat]) when
+# long_first is True, but each grid is a broadcast view of its axis.
+def broadcast_grid(axis_x, axis_y, long_first=False):
+    if long_first:
+        shape = (len(axis_x), len(axis_y))
+        return np.broadcast_to(axis_x[:, None], shape), np.broadcast_to(axis_y[None, :], shape)
+    shape = (len(axis_y), len(axis_x))
+    return np.broadcast_to(axis_x[None, :], shape), np.broadcast_to(axis_y[:, None], shape)
+
+# Function to divide two bands in the working precision
+# Returns a plain array with NaN where the denominator is zero (fill) or where the
+# optional boolean clear mask (see landsat_qa.py) is False; no masked arrays.
+def band_ratio(numerator, denominator, clear=None):
+    numerator = np.asarray(numerator, dtype=VALUE_DTYPE)
+    denominator = np.asarray(denominator, dtype=VALUE_DTYPE)
+    valid = denominator != 0
+    if clear is not None:
+        valid &= np.asarray(clear, dtype=bool)
+    ratio = np.full(np.broadcast_shapes(numerator.shape, denominator.shape), np.nan, dtype=VALUE_DTYPE)
+    np.divide(numerator, denominator, out=ratio, where=valid)
+    return ratio
+
+# Function to return the pandas dtype map for loading x/y/value point files
+def point_dtypes(value_column='value', coordinate_columns=('x', 'y')):
+    dtypes = {column: COORD_DTYPE for column in coordinate_columns}
+    dtypes[value_column] = VALUE_DTYPE
+    return dtypes
@@ -0,0 +1,136 @@
+import json
+import os
+import warnings
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib import colormaps
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
+
+# Fast raster rendering for gridded products. Grids are colour-mapped straight to
+# RGBA through a precomputed lookup table and shown with imshow, instead of
+# contourf(levels=100) which builds 100 polygon sets for every plot.
+#
+# Grids are expected with rows following latitude (south first), as produced by
+# np.meshgrid. Grids from np.mgrid ([long, lat]) should be passed as grid_z.T.
+
+_lut_cache = {}
+
+# Function to build (and cache) an RGBA lookup table for a matplotlib colormap
+def build_lut(cmap='viridis', n_colors=256):
+    key = (cmap, n_colors)
+    if key not in _lut_cache:
+        colors = colormaps[cmap].resampled(n_colors)(np.arange(n_colors))
+        _lut_cache[key] = (colors * 255).round().astype(np.uint8)
+    return _lut_cache[key]
+
+# Function to return the [x_min, x_max, y_min, y_max] extent of coordinate grids
+def grid_extent(grid_x, grid_y):
+    return [float(np.min(grid_x)), float(np.max(grid_x)), float(np.min(grid_y)), float(np.max(grid_y))]
+
+# Function to block-average a grid so neither side is larger than max_size
+# Leftover rows and columns are padded with NaN, so the last block of each side
+# averages the cells it has and no edge is dropped. Float grids keep their dtype.
+def downsample_grid(grid_z, max_size=1024):
+    rows, cols = grid_z.shape
+    factor = int(np.ceil(max(rows, cols) / max_size))
+    if factor <= 1:
+        return grid_z
+    out_rows, out_cols = -(-rows // factor), -(-cols // factor)
+    padded = np.full((out_rows * factor, out_cols * factor), np.nan, dtype=np.result_type(grid_z.dtype, np.float32))
+    padded[:rows, :cols] = grid_z
+    blocks = padded.reshape(out_rows, factor, out_cols, factor)
+    with warnings.catch_warnings():
+        # Blocks with no finite cells stay NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(blocks, axis=(1, 3))
+
+# Function to compute display limits, ignoring NaNs
+def value_range(grid_z, vmin=None, vmax=None):
+    if vmin is None:
+        vmin = float(np.nanmin(grid_z))
+    if vmax is None:
+        vmax = float(np.nanmax(grid_z))
+    if vmax <= vmin:
+        vmax = vmin + 1.0
+    return vmin, vmax
+
+# Function to colour-map a grid to RGBA uint8; NaNs become transparent
+def grid_to_rgba(grid_z, vmin=None, vmax=None, cmap='viridis', n_colors=256):
+    lut = build_lut(cmap, n_colors)
+    vmin, vmax = value_range(grid_z, vmin, vmax)
+    scaled = (np.asarray(grid_z, dtype=np.float32) - vmin) * ((n_colors - 1) / (vmax - vmin))
+    invalid = ~np.isfinite(scaled)
+    scaled[invalid] = 0
+    index = np.clip(scaled, 0, n_colors - 1).astype(np.uint16)
+    rgba = lut[index]
+    rgba[invalid, 3] = 0
+    return rgba
+
+# Function to draw a downsampled RGBA preview of a grid on a matplotlib axis
+def show_grid(ax, grid_z, extent, title=None, label=None, cmap='viridis', max_size=1024, vmin=None, vmax=None):
+    preview = downsample_grid(grid_z, max_size)
+    vmin, vmax = value_range(preview, vmin, vmax)
+    ax.imshow(grid_to_rgba(preview, vmin, vmax, cmap), extent=extent, origin='lower', aspect='auto',
+              interpolation='nearest')
+    colorbar = ax.figure.colorbar(ScalarMappable(norm=Normalize(vmin, vmax), cmap=cmap), ax=ax, label=label)
+    ax.set_xlabel('Longitude')
+    ax.set_ylabel('Latitude')
+    if title:
+        ax.set_title(title)
+    return colorbar
+
+# Function to export a grid as a multi-zoom PNG tile pyramid
+# Level 0 is the whole grid in a single tile; each level doubles the resolution
+# until the native grid is reached. Tiles are written as <level>/<col>/<row>.png
+# with row 0 at the north edge, plus a pyramid.json describing the layout. Every
+# tile is tile_size x tile_size: tiles on the east and south edges are padded with
+# transparent pixels, as XYZ/TMS viewers expect.
+def export_tile_pyramid(grid_z, output_dir, extent=None, tile_size=256, cmap='viridis', vmin=None, vmax=None):
+    vmin, vmax = value_range(grid_z, vmin, vmax)
+    rows, cols = grid_z.shape
+    max_level = max(int(np.ceil(np.log2(max(rows, cols) / tile_size))), 0)
+    os.makedirs(output_dir, exist_ok=True)
+
+    level_grid = np.asarray(grid_z)
+    levels = []
+    for level in range(max_level, -1, -1):
+        # Flip so the first tile row is north, as map viewers expect
+        rgba = grid_to_rgba(level_grid[::-1], vmin, vmax, cmap)
+        n_tile_rows = int(np.ceil(rgba.shape[0] / tile_size))
+        n_tile_cols = int(np.ceil(rgba.shape[1] / tile_size))
+        for tile_col in range(n_tile_cols):
+            os.makedirs(os.path.join(output_dir, str(level), str(tile_col)), exist_ok=True)
+            for tile_row in range(n_tile_rows):
+                tile = rgba[tile_row * tile_size:(tile_row + 1) * tile_size,
+                            tile_col * tile_size:(tile_col + 1) * tile_size]
+                if tile.shape[:2] != (tile_size, tile_size):
+                    padded = np.zeros((tile_size, tile_size, 4), dtype=np.uint8)
+                    padded[:tile.shape[0], :tile.shape[1]] = tile
+                    tile = padded
+                plt.imsave(os.path.join(output_dir, str(level), str(tile_col), f"{tile_row}.png"), tile)
+        levels.append({"level": level, "shape": list(level_grid.shape), "tiles": [n_tile_rows, n_tile_cols]})
+        level_grid = downsample_grid(level_grid, max(int(np.ceil(max(level_grid.shape) / 2)), 1))
+
+    with open(os.path.join(output_dir, "pyramid.json"), "w") as handle:
+        json.dump({
+            "shape": [rows, cols],
+            "extent": extent,
+            "tile_size": tile_size,
+            "cmap": cmap,
+            "vmin": vmin,
+            "vmax": vmax,
+            "levels": sorted(levels, key=lambda entry: entry["level"]),
+        }, handle, indent=2)
+    print(f"Saved {max_level + 1}-level tile pyramid to {output_dir}")
+    return output_dir
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        print("Usage: python raster_preview.py <grid.txt or grid.npy> <output_dir>")
+        sys.exit(1)
+    grid_path, pyramid_dir = sys.argv[1], sys.argv[2]
+    grid = np.load(grid_path, mmap_mode='r') if grid_path.endswith(".npy") else np.loadtxt(grid_path)
+    export_tile_pyramid(grid, pyramid_dir)
@@ -0,0 +1,209 @@
+import argparse
+import os
+from datetime import datetime
+
+import numpy as np
+import requests
+
+from despike import despike_survey
+from downloader import read_table
+from grav_pyramid import read_pyramid_roi
+from grav_triangulation import interpolate_with_triangulation
+from landsat_composite import composite_bands
+from landsat_qa import ee_mask_collection
+from leveling import level_survey, microlevel_grid, traverse_heading
+from grid_spec import data_spacing, grid_resolution, grid_shape, resample_grid
+from potential_filters import grid_spacing_m
+from precision import band_ratio, point_dtypes
+from stage_scheduler import add_stage, run_graph
+from tile_cache import dataset_version, grid_roi_cached
+
+# Full ROI build: Bouguer and isostatic gravity, magnetics and Landsat band ratios
+# in one run of the stage scheduler. Downloads and Earth Engine calls run on the
+# I/O thread pool, gridding runs on the process pool, and the four branches run
+# side by side instead of one script after another:
+#
+#   download_Bouguer    -> grid_Bouguer    -> save_Bouguer
+#   download_Isostatic  -> grid_Isostatic  -> save_Isostatic
+#   download_mag        -> grid_mag        -> save_mag
+#   fetch_landsat       -> landsat_ratios  -> save_landsat
+#
+# Outputs go to the same Desktop folders the individual scripts use, and the
+# magnetic branch despikes, levels and micro-levels like magsavingnew.py so both
+# write the same MAG grid for a survey and ROI. Downloads and
+# Landsat fetches are never memoized, so updated survey files and new scenes are
+# always picked up; gridding is memoized on a fingerprint of what they returned.
+
+GRAVITY_URLS = {
+    "Bouguer": "https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/USbougerGravData.xyz",
+    "Isostatic": "https://raw.githubusercontent.com/maxfollett/AirBorneInsight2/main/isograv.xyz"
+}
+MAG_URL = "https://github.com/maxfollett/AirBorneInsight2/raw/main/CapDatabases/Raw/marysvale_detail_mag.xyz"
+GRAVITY_GRID_SIZE = (1486, 2116)
+MAG_GRID_SIZE = (2116, 1486)
+LANDSAT_BANDS = {"B4": "SR_B4", "B5": "SR_B5", "B6": "SR_B6", "B7": "SR_B7"}
+
+# Function to download a national x/y/value gravity file (through the local mirror)
+def download_gravity(url):
+    data = read_table(url, sep=r'\s+', header=None, names=['x', 'y', 'value'], dtype=point_dtypes())
+    if data is None:
+        raise IOError(f"Could not download {url}")
+    return data
+
+# Function to grid one gravity dataset over the ROI (pyramid if built, else triangulation)
+# Gridded at a cell size from the station spacing, then resampled to grid_size.
+def grid_gravity(data, name, roi, grid_size=GRAVITY_GRID_SIZE):
+    lat_min, lat_max, lon_min, lon_max = roi
+    nearby = data[data['x'].between(lon_min, lon_max) & data['y'].between(lat_min, lat_max)]
+    resolution = grid_resolution(lon_min, lon_max, lat_min, lat_max, nearby['y'].to_numpy(), nearby['x'].to_numpy())
+    served = read_pyramid_roi(name, lon_min, lon_max, lat_min, lat_max, resolution=resolution, version=dataset_version(data))
+    if served is None:
+        served = interpolate_with_triangulation(data, name, lon_min, lon_max, lat_min, lat_max,
+                                                grid_size=grid_shape(lon_min, lon_max, lat_min, lat_max, resolution))
+    served = resample_grid(*served, grid_size, lon_min, lon_max, lat_min, lat_max)
+    # Only the values cross back to the parent process; coordinate grids are views
+    return np.ascontiguousarray(served[2])
+
+# Function to download a NURE-style magnetic flight-line file (through the local mirror)
+# usecols are the line, fid, lat, long and corrected magnetic columns.
+def download_magnetic(url, usecols=(0, 1, 5, 6, 9)):
+    data = read_table(url, header=None, sep=r'\s+', usecols=list(usecols),
+                      names=["line", "fid", "lat", "long", "corrected_magnetic"],
+                      dtype={"line": str, **point_dtypes("corrected_magnetic", ("lat", "long"))})
+    if data is None:
+        raise IOError(f"Could not download {url}")
+    return data
+
+# Function to clean, level, crop and grid magnetic data over the ROI ([long, lat] layout like magsavingnew.py)
+# despike, level and microlevel default to magsavingnew's DESPIKE, LEVEL_LINES and
+# MICROLEVEL; tiles come from the same cache at the survey-wide node spacing.
+def grid_magnetic(df, roi, grid_size=MAG_GRID_SIZE, despike=True, level=True, microlevel=True):
+    lat_min, lat_max, lon_min, lon_max = roi
+    bounds = {}
+    for column in ('lat', 'long'):
+        q1, q3 = df[column].quantile([0.25, 0.75])
+        bounds[column] = (q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1))
+    df = df[df['lat'].between(*bounds['lat']) & df['long'].between(*bounds['long'])]
+    if despike:
+        df, _ = despike_survey(df)
+    line_corrections = None
+    if level:
+        df, line_corrections = level_survey(df)
+    inside = df[df['lat'].between(lat_min, lat_max) & df['long'].between(lon_min, lon_max)]
+    if inside.empty:
+        raise ValueError("No magnetic points inside the ROI")
+    # Cell size from the flight-line spacing of the whole survey, then resampled to grid_size
+    extent = (inside['long'].min(), inside['long'].max(), inside['lat'].min(), inside['lat'].max())
+    lat, long, line = df['lat'].to_numpy(), df['long'].to_numpy(), df['line'].to_numpy()
+    resolution = grid_resolution(*extent, lat, long, line)
+    points = df.rename(columns={"long": "x", "lat": "y", "corrected_magnetic": "value"})
+    grid_x, grid_y, grid_z = grid_roi_cached(points, *extent, resolution=resolution, method='linear',
+                                             version=dataset_version(points))
+    if microlevel and line_corrections is not None:
+        line_spacing, _ = data_spacing(lat, long, line)
+        if line_spacing:
+            dx_m, dy_m = grid_spacing_m((grid_x[0, 0], grid_x[0, -1], grid_y[0, 0], grid_y[-1, 0]), grid_z.shape)
+            grid_z, _ = microlevel_grid(grid_z, dx_m, dy_m, line_spacing, traverse_heading(line_corrections))
+    grid_z = resample_grid(grid_x, grid_y, grid_z, grid_size, *extent)[2]
+    return np.ascontiguousarray(grid_z.T)
+
+# Function to fetch median Landsat 8 surface-reflectance bands for the ROI from Earth Engine
+# ee and rasterio are only imported here so gravity/magnetic builds work without them.
+def fetch_landsat(roi, scale=30):
+    import ee
+    import rasterio
+    lat_min, lat_max, lon_min, lon_max = roi
+    ee.Initialize()
+    geometry = ee.Geometry.Rectangle([lon_min, lat_min, lon_max, lat_max])
+    # Clouds, shadows and saturated pixels are masked server-side before the median
+    median_image = (ee_mask_collection(ee.ImageCollection("LANDSAT/LC08/C02/T1_L2").filterBounds(geometry))
+                    .map(lambda image: image.clip(geometry)).median())
+    bands = {}
+    for band_name, band in LANDSAT_BANDS.items():
+        url = median_image.select(band).getThumbURL({'region': geometry.bounds().getInfo(), 'scale': scale,
+                                                      'format': 'GEO_TIFF', 'crs': 'EPSG:4326'})
+        response = requests.get(url)
+        response.raise_for_status()
+        with rasterio.MemoryFile(response.content) as memfile:
+            with memfile.open() as dataset:
+                bands[band_name] = dataset.read(1)
+    return bands
+
+# Function to composite local Landsat C2 L2 scenes for the ROI instead of using Earth Engine
+# The compositor runs its own process pool, so this is scheduled as an I/O stage.
+def composite_landsat(roi, scene_dir, output_dir="~/Desktop/SpectralBandData/composites"):
+    bands = composite_bands(scene_dir, roi, output_dir=os.path.expanduser(output_dir))
+    if bands is None:
+        raise ValueError(f"No Landsat scenes to composite in {scene_dir}")
+    return bands
+
+# Function to compute the band 4/5 and 5/7 ratios
+def landsat_ratios(bands):
+    return {"Ratio_4_5": band_ratio(bands["B4"], bands["B5"]),
+            "Ratio_5_7": band_ratio(bands["B5"], bands["B7"])}
+
+# Function to save a grid as a .txt file
+def save_grid(grid_z, folder, filename, header=""):
+    folder = os.path.expanduser(folder)
+    os.makedirs(folder, exist_ok=True)
+    filepath = os.path.join(folder, f"{filename}.txt")
+    np.savetxt(filepath, grid_z, fmt='%.6f', delimiter=' ', header=header)
+    print(f"Saved: {filepath}")
+    return filepath
+
+# Function to save the Landsat bands and ratios
+def save_landsat(bands, ratios, survey_name):
+    current_date = datetime.now().strftime("%m%d")
+    layers = dict(bands)
+    layers.update(ratios)
+    return [save_grid(data, "~/Desktop/SpectralBandData", f"{current_date}_{survey_name}_{name}") for name, data in layers.items()]
+
+# Function to build the stage graph for one ROI
+# scene_dir composites local Landsat scenes instead of fetching from Earth Engine.
+def build_roi_graph(roi, survey_name, gravity=True, magnetic=True, landsat=True, mag_url=MAG_URL, scene_dir=None):
+    lat_min, lat_max, lon_min, lon_max = roi
+    suffix = f"{lat_min}_{lat_max}_{lon_min}_{lon_max}"
+    graph = {}
+    if gravity:
+        for name, url in GRAVITY_URLS.items():
+            add_stage(graph, f"download_{name}", download_gravity, kind="io", memoize=False, url=url)
+            add_stage(graph, f"grid_{name}", grid_gravity, inputs=[f"download_{name}"], kind="cpu", name=name, roi=roi)
+            add_stage(graph, f"save_{name}", save_grid, inputs=[f"grid_{name}"], kind="io", memoize=False,
+                      folder="~/Desktop/grav_txtfiles", filename=f"{survey_name}_{name}_cropped_{suffix}",
+                      header="Interpolated gravity values grid")
+    if magnetic:
+        add_stage(graph, "download_mag", download_magnetic, kind="io", memoize=False, url=mag_url)
+        add_stage(graph, "grid_mag", grid_magnetic, inputs=["download_mag"], kind="cpu", roi=roi)
+        add_stage(graph, "save_mag", save_grid, inputs=["grid_mag"], kind="io", memoize=False,
+                  folder="~/Desktop/magnetic_txt_files", filename=f"MAG_{suffix}")
+    if landsat:
+        if scene_dir:
+            add_stage(graph, "fetch_landsat", composite_landsat, kind="io", memoize=False, roi=roi, scene_dir=scene_dir)
+        else:
+            add_stage(graph, "fetch_landsat", fetch_landsat, kind="io", memoize=False, roi=roi)
+        add_stage(graph, "landsat_ratios", landsat_ratios, inputs=["fetch_landsat"], kind="cpu")
+        add_stage(graph, "save_landsat", save_landsat, inputs=["fetch_landsat", "landsat_ratios"], kind="io",
+                  memoize=False, survey_name=survey_name)
+    return graph
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build gravity, magnetic and Landsat products for one ROI concurrently.")
+    parser.add_argument("--lat", required=True, help="latitude range min,max (e.g. 37,38)")
+    parser.add_argument("--lon", required=True, help="longitude range min,max (e.g. -113,-112)")
+    parser.add_argument("--name", required=True, help="survey name used in output file names")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["gravity", "magnetic", "landsat"])
+    parser.add_argument("--mag-url", default=MAG_URL)
+    parser.add_argument("--landsat-scenes", help="folder of Landsat C2 L2 scenes to composite locally")
+    parser.add_argument("--memo-dir", default=os.path.expanduser("~/.airborne_stage_memo"),
+                        help="folder for memoized stage outputs ('' to disable)")
+    parser.add_argument("--cpu-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    lat_min, lat_max = map(float, args.lat.split(','))
+    lon_min, lon_max = map(float, args.lon.split(','))
+    graph = build_roi_graph((lat_min, lat_max, lon_min, lon_max), args.name, gravity="gravity" not in args.skip,
+                            magnetic="magnetic" not in args.skip, landsat="landsat" not in args.skip, mag_url=args.mag_url,
+                            scene_dir=args.landsat_scenes)
+    results = run_graph(graph, max_cpu_workers=args.cpu_workers, memo_dir=args.memo_dir or None)
+    if results["__failed__"]:
+        print(f"Stages not completed: {', '.join(results['__failed__'])}")
@@ -0,0 +1,202 @@
+import hashlib
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+# Small dependency-aware scheduler for the stages of one ROI build. A graph is a
+# dict of stages; each stage names the stages whose outputs it takes as inputs
+# and whether it is network-bound ("io", run on a thread pool) or CPU-bound
+# ("cpu", run on a process pool):
+#
+#   graph = {}
+#   add_stage(graph, "download_bouguer", load_xyz, kind="io", memoize=False, url=BOUGUER_URL)
+#   add_stage(graph, "grid_bouguer", grid_gravity, inputs=["download_bouguer"], kind="cpu", name="Bouguer")
+#   results = run_graph(graph)
+#
+# Stages start as soon as their inputs are ready, so independent branches run
+# concurrently and the build takes about as long as its slowest branch. A stage
+# function is called as func(*input_outputs, **kwargs); CPU stage functions must be
+# importable top-level functions so the process pool can pickle them.
+#
+# Outputs are memoized in memory for the run and, if memo_dir is given, on disk
+# under a key chained from the stage's arguments and its inputs' keys, so a re-run
+# only executes stages whose arguments or upstream stages changed.
+#
+# Source stages (downloads, Earth Engine fetches) are added with memoize=False:
+# their arguments, a URL or an ROI, say nothing about whether the data behind them
+# changed, and the downloader revalidates its mirror on every call anyway. Such a
+# stage runs on every build, and its key becomes a fingerprint of what it returned
+# (output_key), so the stages after it are reused only while the data is unchanged.
+
+STAGE_KINDS = ("io", "cpu")
+
+# Function to add a stage to a graph
+# kwargs are passed to func, so a stage function may itself take a "name" argument.
+def add_stage(graph, stage_name, func, inputs=(), kind="cpu", memoize=True, **kwargs):
+    if kind not in STAGE_KINDS:
+        raise ValueError(f"Stage '{stage_name}' has kind '{kind}'; expected one of {STAGE_KINDS}")
+    if stage_name in graph:
+        raise ValueError(f"Stage '{stage_name}' is already in the graph")
+    graph[stage_name] = {"func": func, "inputs": list(inputs), "kind": kind, "memoize": memoize, "kwargs": kwargs}
+    return graph
+
+# Function to list the stages needed for the targets, dependencies first
+def stage_order(graph, targets=None):
+    order, state = [], {}
+
+    def visit(name, path):
+        if name not in graph:
+            raise ValueError(f"Stage '{name}' is required by '{path[-1]}' but not defined" if path else f"Unknown stage '{name}'")
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Cycle in stage graph: {' -> '.join(path + [name])}")
+        state[name] = "visiting"
+        for dependency in graph[name]["inputs"]:
+            visit(dependency, path + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for name in (targets or list(graph)):
+        visit(name, [])
+    return order
+
+# Function to compute a stage's memo key from its function, arguments and upstream keys
+def memo_key(graph, name, keys):
+    spec = graph[name]
+    description = repr((name, getattr(spec["func"], "__module__", ""), getattr(spec["func"], "__qualname__", ""),
+                        sorted(spec["kwargs"].items()), [keys[dependency] for dependency in spec["inputs"]]))
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+# Function to fingerprint a stage output (DataFrames, arrays and dicts/lists of them)
+def output_key(output):
+    digest = hashlib.sha1()
+
+    def feed(value):
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            digest.update(repr((type(value).__name__, value.shape, list(getattr(value, "columns", [])))).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        elif isinstance(value, np.ndarray):
+            digest.update(repr((value.dtype.str, value.shape)).encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, dict):
+            for item_key in sorted(value, key=repr):
+                digest.update(repr(item_key).encode())
+                feed(value[item_key])
+        elif isinstance(value, (list, tuple)):
+            digest.update(repr((type(value).__name__, len(value))).encode())
+            for item in value:
+                feed(item)
+        else:
+            digest.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    feed(output)
+    return digest.hexdigest()[:16]
+
+# Function to load a memoized output from disk (returns (found, output))
+def load_memo(memo_dir, name, key):
+    path = os.path.join(memo_dir, f"{name}_{key}.pkl")
+    if not os.path.exists(path):
+        return False, None
+    try:
+        with open(path, "rb") as handle:
+            return True, pickle.load(handle)
+    except Exception as e:
+        print(f"Ignoring unreadable memo {path}: {e}")
+        return False, None
+
+# Function to save a stage output to the on-disk memo
+def save_memo(memo_dir, name, key, output):
+    os.makedirs(memo_dir, exist_ok=True)
+    path = os.path.join(memo_dir, f"{name}_{key}.pkl")
+    try:
+        with open(path + ".tmp", "wb") as handle:
+            pickle.dump(output, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+    except Exception as e:
+        print(f"Could not memoize stage '{name}': {e}")
+
+# Function to run a stage graph and return {stage name: output}
+# Stages that fail are reported and their dependents skipped; their names are
+# listed under results["__failed__"]. Pass results from a previous run_graph call
+# as cache to reuse those outputs in memory.
+def run_graph(graph, targets=None, max_io_workers=8, max_cpu_workers=None, memo_dir=None, cache=None):
+    order = stage_order(graph, targets)
+    results = {}
+    # Keys are computed once a stage's inputs are done, since the key of an
+    # unmemoized stage is only known from its output
+    keys = {}
+
+    timings, failed, skipped = {}, [], []
+    pending = list(order)
+    running = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_io_workers) as io_pool, ProcessPoolExecutor(max_workers=max_cpu_workers) as cpu_pool:
+        pools = {"io": io_pool, "cpu": cpu_pool}
+        while pending or running:
+            for name in list(pending):
+                spec = graph[name]
+                if any(dependency in failed or dependency in skipped for dependency in spec["inputs"]):
+                    pending.remove(name)
+                    skipped.append(name)
+                    print(f"Skipping stage '{name}': an input stage failed")
+                    continue
+                if not all(dependency in results for dependency in spec["inputs"]):
+                    continue
+                pending.remove(name)
+                keys[name] = memo_key(graph, name, keys)
+
+                # Memoized outputs, in memory first and then on disk
+                if spec["memoize"] and cache and cache.get("__keys__", {}).get(name) == keys[name]:
+                    results[name] = cache[name]
+                    timings[name] = ("memory", 0.0)
+                    continue
+                if spec["memoize"] and memo_dir:
+                    found, output = load_memo(memo_dir, name, keys[name])
+                    if found:
+                        results[name] = output
+                        timings[name] = ("disk", 0.0)
+                        continue
+
+                arguments = [results[dependency] for dependency in spec["inputs"]]
+                future = pools[spec["kind"]].submit(spec["func"], *arguments, **spec["kwargs"])
+                running[future] = (name, time.perf_counter())
+
+            if not running:
+                if pending:
+                    raise RuntimeError(f"Stages {pending} can never start; check their inputs")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, started = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f"Stage '{name}' failed: {type(e).__name__}: {e}")
+                    failed.append(name)
+                    continue
+                timings[name] = (graph[name]["kind"], time.perf_counter() - started)
+                if not graph[name]["memoize"]:
+                    keys[name] = output_key(results[name])
+                elif memo_dir:
+                    save_memo(memo_dir, name, keys[name], results[name])
+
+    print_timings(timings, failed, skipped, time.perf_counter() - start)
+    results["__keys__"] = keys
+    results["__failed__"] = failed + skipped
+    return results
+
+# Function to print how long each stage took and where memoized outputs came from
+def print_timings(timings, failed, skipped, total):
+    print(f"{'stage':<28} {'ran on':>8} {'wall (s)':>9}")
+    for name, (where, seconds) in timings.items():
+        print(f"{name:<28} {where:>8} {seconds:>9.2f}")
+    for name in failed:
+        print(f"{name:<28} {'FAILED':>8}")
+    for name in skipped:
+        print(f"{name:<28} {'skipped':>8}")
+    print(f"Graph finished in {total:.2f} s")
@@ -0,0 +1,179 @@
+import atexit
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+# Lightweight per-stage instrumentation for the pipelines.
+#
+#   with stage("load", source=url) as record:
+#       df = load_csv_from_github()
+#       record["rows_out"] = len(df)
+#
+# Timing is off unless AIRBORNE_TIMING is set (to a JSON lines path, or to 1 for
+# stage_timing.jsonl) or enable_timing() is called. When off, stage() hands back a
+# throwaway dict inside a nullcontext, so the cost is a dict and a function call.
+# Peak memory comes from tracemalloc, which sees Python and NumPy allocations but
+# not memory allocated privately by C libraries such as Qhull.
+
+MB = 1024 * 1024
+DEFAULT_TIMING_PATH = "stage_timing.jsonl"
+
+_state = {
+    "enabled": False,
+    "path": None,
+    "trace_memory": True,
+    "run_id": None,
+    "records": [],
+    "stack": [],
+    "summary_registered": False,
+}
+
+# Function to read this process's peak resident set size in MB (None if unavailable)
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS reports bytes
+        return peak / MB if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / MB
+    except (ImportError, AttributeError):
+        return None
+
+# Function to switch instrumentation on; records are appended to path as JSON lines
+def enable_timing(path=DEFAULT_TIMING_PATH, trace_memory=True, print_summary_at_exit=True):
+    _state["enabled"] = True
+    _state["path"] = path
+    _state["trace_memory"] = trace_memory
+    _state["run_id"] = f"{os.path.basename(sys.argv[0]) or 'python'}-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if print_summary_at_exit and not _state["summary_registered"]:
+        atexit.register(print_summary)
+        _state["summary_registered"] = True
+
+# Function to switch instrumentation off again
+def disable_timing():
+    _state["enabled"] = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+# Function to check whether stages are currently being recorded
+def timing_enabled():
+    return _state["enabled"]
+
+# Function to open a timed stage; extra keyword arguments are stored on the record
+def stage(name, **fields):
+    if not _state["enabled"]:
+        return nullcontext(fields)
+    return _timed_stage(name, fields)
+
+@contextmanager
+def _timed_stage(name, fields):
+    stack = _state["stack"]
+    trace = _state["trace_memory"] and tracemalloc.is_tracing()
+    record = dict(fields)
+    record["stage"] = "/".join([parent["stage"] for parent in stack[-1:]] + [name])
+
+    start_mem = 0
+    if trace:
+        start_mem, peak_so_far = tracemalloc.get_traced_memory()
+        # Hand the peak seen so far to the enclosing stage before resetting it for this one
+        if stack:
+            stack[-1]["_peak"] = max(stack[-1]["_peak"], peak_so_far)
+        tracemalloc.reset_peak()
+    record["_peak"] = start_mem
+
+    stack.append(record)
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    status = "ok"
+    try:
+        yield record
+    except BaseException as e:
+        status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+        stack.pop()
+        peak = record.pop("_peak")
+        if trace:
+            end_mem, traced_peak = tracemalloc.get_traced_memory()
+            peak = max(peak, traced_peak)
+            if stack:
+                stack[-1]["_peak"] = max(stack[-1]["_peak"], peak)
+            record["mem_delta_mb"] = round((end_mem - start_mem) / MB, 3)
+            record["peak_mem_delta_mb"] = round((peak - start_mem) / MB, 3)
+        record.update({
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            "status": status,
+            "run_id": _state["run_id"],
+            "timestamp": datetime.now().isoformat(timespec="milliseconds"),
+        })
+        _state["records"].append(record)
+        _write_record(record)
+
+# Function to append one record to the JSON lines file
+def _write_record(record):
+    if not _state["path"]:
+        return
+    try:
+        with open(_state["path"], "a") as handle:
+            handle.write(json.dumps(record, default=str) + "\n")
+    except OSError as e:
+        print(f"Could not write timing record to {_state['path']}: {e}")
+        _state["path"] = None
+
+# Function to return the number of rows (DataFrames) or cells (arrays) in obj
+def size_of(obj):
+    if obj is None:
+        return None
+    if hasattr(obj, "columns"):
+        return len(obj)
+    if isinstance(getattr(obj, "size", None), int):
+        return obj.size
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+# Function to print a per-stage summary table of this run
+def print_summary():
+    records = _state["records"]
+    if not records:
+        return
+    totals = {}
+    for record in records:
+        entry = totals.setdefault(record["stage"], {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_mb": 0.0,
+                                                    "rows_in": 0, "rows_out": 0, "cache_hits": 0, "errors": 0})
+        entry["calls"] += 1
+        entry["wall_s"] += record["wall_s"]
+        entry["cpu_s"] += record["cpu_s"]
+        entry["peak_mb"] = max(entry["peak_mb"], record.get("peak_mem_delta_mb") or 0.0)
+        entry["rows_in"] += record.get("rows_in") or 0
+        entry["rows_out"] += record.get("rows_out") or 0
+        entry["cache_hits"] += bool(record.get("cache_hit"))
+        entry["errors"] += record["status"] != "ok"
+
+    print(f"\nStage timing for {_state['run_id']}")
+    print(f"{'stage':<28} {'calls':>5} {'wall s':>9} {'cpu s':>9} {'peak MB':>9} {'rows in':>11} {'rows out':>11} {'hits':>5}")
+    for name, entry in totals.items():
+        flag = "  (errors)" if entry["errors"] else ""
+        print(f"{name:<28} {entry['calls']:>5} {entry['wall_s']:>9.3f} {entry['cpu_s']:>9.3f} {entry['peak_mb']:>9.1f} "
+              f"{entry['rows_in']:>11,} {entry['rows_out']:>11,} {entry['cache_hits']:>5}{flag}")
+    if _state["path"]:
+        print(f"Records written to {_state['path']}")
+
+# Turn timing on from the environment so scripts need no extra arguments
+if os.environ.get("AIRBORNE_TIMING"):
+    _env_path = os.environ["AIRBORNE_TIMING"]
+    enable_timing(DEFAULT_TIMING_PATH if _env_path == "1" else _env_path,
+                  trace_memory=os.environ.get("AIRBORNE_TIMING_MEMORY", "1") != "0")
@@ -0,0 +1,188 @@
+import glob
+import json
+import math
+import os
+import re
+import sys
+
+from nure_standardize import COLUMN_ALIASES, LAYOUTS
+
+# Survey registry built from the FGDC metadata that ships with each NURE quadrangle
+# (CapDatabases/Raw/<QUAD>/<quad>_meta.txt). The registry records each survey's
+# bounding box, dates, flight-line specification, download URLs and the column
+# layout of its magnetic and radiometric files, plus a 1-degree cell index. An ROI
+# can then be resolved to surveys, files and usecols without opening any data file.
+
+RAW_DIR = os.path.join("CapDatabases", "Raw")
+CATALOG_PATH = os.path.join(RAW_DIR, "survey_catalog.json")
+METERS_PER_UNIT = {"mile": 1609.344, "miles": 1609.344, "km": 1000.0, "kilometers": 1000.0,
+                   "meters": 1.0, "m": 1.0, "ft": 0.3048, "feet": 0.3048}
+
+# Function to read a metadata file; the files contain stray Latin-1 degree signs
+def read_metadata_text(path):
+    with open(path, encoding="latin-1") as handle:
+        return handle.read()
+
+# Function to return the first value of a "Key: value" FGDC element
+def metadata_value(text, key):
+    match = re.search(rf"^\s*{re.escape(key)}:\s*(.+?)\s*$", text, re.M)
+    return match.group(1) if match else None
+
+# Function to convert a distance such as "3 miles" or "400 ft" to metres
+def distance_to_meters(text):
+    if not text:
+        return None
+    match = re.match(r"\s*([\d.]+)\s*([A-Za-z]+)", text)
+    if not match or match.group(2).lower() not in METERS_PER_UNIT:
+        return None
+    return float(match.group(1)) * METERS_PER_UNIT[match.group(2).lower()]
+
+# Function to parse the numbered attribute tables in Entity_and_Attribute_Overview
+# Returns {"mag": [...], "rad": [...]} with column names in file order.
+def parse_column_layouts(text):
+    layouts = {}
+    for heading, channel in (("Aeromagnetics", "mag"), ("Radiometrics", "rad")):
+        match = re.search(rf"^\s*{heading}\s*\n\s*Each record contains the following (\d+) attributes:(.*?)"
+                          rf"(?=^\s*Entity_and_Attribute|\Z)", text, re.M | re.S)
+        if not match:
+            continue
+        n_columns = int(match.group(1))
+        rows = re.findall(r"^\s*(\d+)\s+(\S+)\s", match.group(2), re.M)
+        names = [COLUMN_ALIASES.get(name, name) for number, name in sorted(rows, key=lambda row: int(row[0]))]
+        if len(names) == n_columns:
+            layouts[channel] = [canonical_column(name, channel) for name in names]
+    return layouts
+
+# Function to map metadata column names onto the names used by nure_standardize.py
+def canonical_column(name, channel):
+    known = LAYOUTS[channel]
+    if name in known:
+        return name
+    for candidate in known:
+        # e.g. "radalt" vs "radaralt", "app_K" vs "app_K40"
+        if name.lower().startswith(candidate.lower()) or candidate.lower().startswith(name.lower()):
+            return candidate
+    return name
+
+# Function to parse one FGDC *_meta.txt into a survey registry entry
+def parse_fgdc_metadata(path):
+    text = read_metadata_text(path)
+    folder = os.path.dirname(path)
+    survey = os.path.basename(path).replace("_meta.txt", "")
+
+    entry = {
+        "survey": survey,
+        "title": metadata_value(text, "Title"),
+        "project_name": metadata_value(text, "Project name"),
+        "west": float(metadata_value(text, "West_Bounding_Coordinate")),
+        "east": float(metadata_value(text, "East_Bounding_Coordinate")),
+        "north": float(metadata_value(text, "North_Bounding_Coordinate")),
+        "south": float(metadata_value(text, "South_Bounding_Coordinate")),
+        "begin_date": metadata_value(text, "Beginning_Date"),
+        "end_date": metadata_value(text, "Ending_Date"),
+        "line_spacing": metadata_value(text, "Flight-line spacing"),
+        "line_spacing_m": distance_to_meters(metadata_value(text, "Flight-line spacing")),
+        "line_direction": metadata_value(text, "Flight-line direction"),
+        "survey_height_m": distance_to_meters(metadata_value(text, "Survey height")),
+        "metadata": os.path.relpath(path),
+        "layouts": parse_column_layouts(text),
+        "files": {},
+    }
+
+    # Download URLs end in _mag.xyz.gz / _rad.xyz.gz; note any local copy next to the metadata
+    for url in re.findall(r"Network_Resource_Name:\s*(\S+\.xyz(?:\.gz)?)", text):
+        channel = "mag" if "_mag." in url else "rad" if "_rad." in url else None
+        if channel is None:
+            continue
+        local_name = os.path.basename(url)
+        local = [os.path.join(folder, name) for name in (local_name, local_name[:-3] if local_name.endswith(".gz") else None)
+                 if name and os.path.exists(os.path.join(folder, name))]
+        entry["files"][channel] = {"url": url, "local_path": os.path.relpath(local[0]) if local else None}
+    return entry
+
+# Function to list the 1-degree cells ("lat,long" of the south-west corner) an extent touches
+def extent_cells(south, north, west, east):
+    cells = []
+    for lat in range(math.floor(south), max(math.ceil(north), math.floor(south) + 1)):
+        for long in range(math.floor(west), max(math.ceil(east), math.floor(west) + 1)):
+            cells.append(f"{lat},{long}")
+    return cells
+
+# Function to build the survey registry from every *_meta.txt under raw_dir
+def build_catalog(raw_dir=RAW_DIR, output_path=CATALOG_PATH):
+    surveys = {}
+    for path in sorted(glob.glob(os.path.join(raw_dir, "**", "*_meta.txt"), recursive=True)):
+        try:
+            entry = parse_fgdc_metadata(path)
+        except (TypeError, ValueError) as e:
+            print(f"Skipping {path}: could not parse bounding coordinates ({e})")
+            continue
+        surveys[entry["survey"]] = entry
+
+    index = {}
+    for name, entry in surveys.items():
+        for cell in extent_cells(entry["south"], entry["north"], entry["west"], entry["east"]):
+            index.setdefault(cell, []).append(name)
+
+    catalog = {"surveys": surveys, "cell_index": index}
+    if output_path:
+        with open(output_path, "w") as handle:
+            json.dump(catalog, handle, indent=2)
+        print(f"Catalogued {len(surveys)} surveys to {output_path}")
+    return catalog
+
+# Function to load a saved catalog, building it first if it does not exist yet
+def load_catalog(path=CATALOG_PATH, raw_dir=RAW_DIR):
+    if not os.path.exists(path):
+        return build_catalog(raw_dir, path)
+    with open(path) as handle:
+        return json.load(handle)
+
+# Function to resolve an ROI to the surveys, files and columns that need reading
+# fields are layout names (lat, long, totmag, resmag, resmagCM4, app_K, ...) or the
+# aliases nure_standardize.py accepts. Each plan item can be passed straight to
+# pd.read_csv(path, sep='\\s+', header=None, usecols=item['usecols'], names=item['names']).
+def resolve_roi(catalog, lat_min, lat_max, long_min, long_max, fields=("lat", "long", "resmag"), channel="mag"):
+    candidates = set()
+    for cell in extent_cells(lat_min, lat_max, long_min, long_max):
+        candidates.update(catalog["cell_index"].get(cell, []))
+
+    plan = []
+    for name in sorted(candidates):
+        entry = catalog["surveys"][name]
+        if (entry["north"] < lat_min or entry["south"] > lat_max or
+                entry["east"] < long_min or entry["west"] > long_max):
+            continue
+        layout = entry["layouts"].get(channel)
+        source = entry["files"].get(channel)
+        if not layout or not source:
+            continue
+        wanted = [COLUMN_ALIASES.get(field, field) for field in fields]
+        missing = [field for field in wanted if field not in layout]
+        if missing:
+            print(f"Survey {name} has no {channel} column(s) {missing}; skipping")
+            continue
+        # pandas returns usecols in file order, so keep names in the same order
+        columns = sorted((layout.index(field), field) for field in wanted)
+        plan.append({
+            "survey": name,
+            "channel": channel,
+            "path": source["local_path"] or source["url"],
+            "url": source["url"],
+            "usecols": [position for position, _ in columns],
+            "names": [field for _, field in columns],
+            "extent": [entry["south"], entry["north"], entry["west"], entry["east"]],
+        })
+    return plan
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "build":
+        build_catalog()
+    elif len(sys.argv) >= 4 and sys.argv[1] == "roi":
+        lat_range = [float(value) for value in sys.argv[2].split(",")]
+        long_range = [float(value) for value in sys.argv[3].split(",")]
+        requested = sys.argv[4:] or ["lat", "long", "resmag"]
+        for item in resolve_roi(load_catalog(), *lat_range, *long_range, fields=requested):
+            print(json.dumps(item))
+    else:
+        print("Usage: python survey_catalog.py build | roi <lat_min,lat_max> <long_min,long_max> [fields...]")
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+# Synthetic survey generators for benchmarking and checking the gridding code
+# without downloading real data. Extents are (lat_min, lat_max, long_min, long_max)
+# and default to the Cedar City 1x2 degree quadrangle.
+
+CEDAR_CITY_EXTENT = (37.0, 38.0, -114.0, -112.0)
+METERS_PER_DEGREE = 111320.0
+
+# Function to build a smooth synthetic field from a handful of Gaussian anomalies
+def synthetic_field(lat, long, extent=CEDAR_CITY_EXTENT, n_anomalies=20, amplitude=300.0, seed=0):
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, long_min, long_max = extent
+    centers_lat = rng.uniform(lat_min, lat_max, n_anomalies)
+    centers_long = rng.uniform(long_min, long_max, n_anomalies)
+    widths = rng.uniform(0.02, 0.15, n_anomalies) * max(lat_max - lat_min, long_max - long_min)
+    amplitudes = rng.uniform(-amplitude, amplitude, n_anomalies)
+
+    # Regional gradient plus anomalies, accumulated one anomaly at a time to keep memory flat
+    field = 0.2 * amplitude * (np.asarray(lat) - lat_min) / max(lat_max - lat_min, 1e-9)
+    for c_lat, c_long, w, a in zip(centers_lat, centers_long, widths, amplitudes):
+        field = field + a * np.exp(-((lat - c_lat) ** 2 + (long - c_long) ** 2) / (2 * w ** 2))
+    return field
+
+# Function to generate NURE-style flight-line aeromagnetic data
+# Lines are flown at heading_deg (0 = north, 90 = east) with line_spacing_m between
+# them; the along-line sample spacing is chosen so the survey has n_points samples.
+def generate_flight_line_survey(n_points, extent=CEDAR_CITY_EXTENT, line_spacing_m=4828.0, heading_deg=90.0,
+                                noise_nt=1.0, level_noise_nt=0.0, position_noise_m=15.0,
+                                round_coordinates=True, seed=0):
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, long_min, long_max = extent
+    lat0 = 0.5 * (lat_min + lat_max)
+    m_per_deg_lat = METERS_PER_DEGREE
+    m_per_deg_long = METERS_PER_DEGREE * np.cos(np.radians(lat0))
+    width_m = (long_max - long_min) * m_per_deg_long
+    height_m = (lat_max - lat_min) * m_per_deg_lat
+
+    # Along-line (u) and across-line (v) unit vectors in east/north metres
+    heading = np.radians(heading_deg)
+    u = np.array([np.sin(heading), np.cos(heading)])
+    v = np.array([np.cos(heading), -np.sin(heading)])
+
+    # Lines must cover the rotated extent, so size them from the box half-diagonal
+    half_diag = 0.5 * np.hypot(width_m, height_m)
+    line_offsets = np.arange(-half_diag, half_diag + line_spacing_m, line_spacing_m)
+    # Oversample by 10% so thinning below can hit n_points exactly
+    total_length = width_m * height_m / line_spacing_m
+    sample_spacing = max(total_length / (1.1 * max(n_points, 1)), 1e-3)
+    along = np.arange(-half_diag, half_diag, sample_spacing)
+
+    # Boustrophedon ordering: alternate lines are flown in opposite directions
+    n_lines = len(line_offsets)
+    line_ids = np.repeat(np.arange(n_lines), len(along))
+    along_all = np.tile(along, n_lines).reshape(n_lines, -1)
+    along_all[1::2] = along_all[1::2, ::-1]
+    along_all = along_all.ravel()
+    across_all = np.repeat(line_offsets, len(along))
+
+    east = along_all * u[0] + across_all * v[0] + rng.normal(0.0, position_noise_m, len(along_all))
+    north = along_all * u[1] + across_all * v[1] + rng.normal(0.0, position_noise_m, len(along_all))
+    inside = (np.abs(east) <= 0.5 * width_m) & (np.abs(north) <= 0.5 * height_m)
+    east, north, line_ids = east[inside], north[inside], line_ids[inside]
+
+    # Thin evenly back to exactly n_points while keeping acquisition order
+    if len(east) > n_points:
+        keep = np.linspace(0, len(east) - 1, n_points).astype(np.int64)
+        east, north, line_ids = east[keep], north[keep], line_ids[keep]
+
+    lat = lat0 + north / m_per_deg_lat
+    long = 0.5 * (long_min + long_max) + east / m_per_deg_long
+    values = synthetic_field(lat, long, extent=extent, seed=seed)
+    values = values + rng.normal(0.0, noise_nt, len(values))
+    if level_noise_nt > 0:
+        values = values + rng.normal(0.0, level_noise_nt, n_lines)[line_ids]
+
+    # Fiducials count up along each line in acquisition order
+    line_starts = np.r_[0, np.flatnonzero(np.diff(line_ids)) + 1]
+    fid = np.arange(len(line_ids)) - np.repeat(line_starts, np.diff(np.r_[line_starts, len(line_ids)]))
+
+    if round_coordinates:
+        lat, long, values = np.round(lat, 4), np.round(long, 4), np.round(values, 1)
+
+    return pd.DataFrame({
+        "line": (line_ids + 1) * 10,
+        "fid": fid,
+        "lat": lat,
+        "long": long,
+        "corrected_magnetic": values,
+    })
+
+# Function to generate an irregular, clustered set of gravity stations
+# A fraction of stations is scattered uniformly; the rest cluster around
+# random centres the way road traverses and towns do in the national dataset.
+def generate_gravity_stations(n_points, extent=CEDAR_CITY_EXTENT, cluster_fraction=0.6, n_clusters=40,
+                              cluster_radius_deg=0.05, noise_mgal=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, long_min, long_max = extent
+    n_clustered = int(n_points * cluster_fraction)
+    n_uniform = n_points - n_clustered
+
+    uniform_x = rng.uniform(long_min, long_max, n_uniform)
+    uniform_y = rng.uniform(lat_min, lat_max, n_uniform)
+
+    centers = rng.integers(0, n_clusters, n_clustered)
+    centers_x = rng.uniform(long_min, long_max, n_clusters)
+    centers_y = rng.uniform(lat_min, lat_max, n_clusters)
+    clustered_x = np.clip(centers_x[centers] + rng.normal(0.0, cluster_radius_deg, n_clustered), long_min, long_max)
+    clustered_y = np.clip(centers_y[centers] + rng.normal(0.0, cluster_radius_deg, n_clustered), lat_min, lat_max)
+
+    x = np.concatenate([uniform_x, clustered_x])
+    y = np.concatenate([uniform_y, clustered_y])
+    value = synthetic_field(y, x, extent=extent, amplitude=40.0, seed=seed + 1) - 180.0
+    value = value + rng.normal(0.0, noise_mgal, n_points)
+
+    return pd.DataFrame({"x": x, "y": y, "value": value})
@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+# Stand-in for the Earth Engine client, with the batch/data interface that
+# ee_export_manager.py uses. Each export is given a script of task states per
+# attempt, e.g. {"B4": [["READY", "RUNNING", "FAILED"], ["READY", "COMPLETED"]]}:
+# every getTaskStatus call advances the task one state, and the last state repeats.
+# Every export also writes its objects into a FakeStorageClient bucket when it completes.
+
+TERMINAL_STATES = ("COMPLETED", "FAILED", "CANCELLED")
+
+class FakeTask:
+    def __init__(self, ee, description, bucket, prefix):
+        self.ee = ee
+        self.description = description
+        self.bucket = bucket
+        self.prefix = prefix
+        self.id = None
+
+    def start(self):
+        self.ee.start(self)
+
+class FakeEE:
+    def __init__(self, scripts, storage=None, shards=None):
+        self.scripts = scripts
+        self.storage = storage
+        self.shards = shards or {}
+        self.attempts = {}
+        self.tasks = {}
+        self.polls = {}
+        self.active = set()
+        self.max_active = 0
+        export = SimpleNamespace(toDrive=self.export, toCloudStorage=self.export)
+        self.batch = SimpleNamespace(Export=SimpleNamespace(image=export))
+        self.data = SimpleNamespace(getTaskStatus=self.get_task_status)
+
+    def export(self, image, description, fileNamePrefix, bucket=None, **params):
+        return FakeTask(self, description, bucket, fileNamePrefix)
+
+    def start(self, task):
+        attempt = self.attempts.get(task.description, 0)
+        self.attempts[task.description] = attempt + 1
+        task.id = f"{task.description}-{attempt}"
+        self.tasks[task.id] = {"task": task, "states": list(self.scripts[task.description][attempt])}
+        self.polls[task.id] = 0
+        self.active.add(task.id)
+        self.max_active = max(self.max_active, len(self.active))
+
+    def get_task_status(self, task_ids):
+        statuses = []
+        for task_id in task_ids:
+            record = self.tasks[task_id]
+            states = record["states"]
+            state = states.pop(0) if len(states) > 1 else states[0]
+            self.polls[task_id] += 1
+            if state in TERMINAL_STATES:
+                self.active.discard(task_id)
+            if state == "COMPLETED" and self.storage is not None and not record.get("written"):
+                task = record["task"]
+                for suffix in self.shards.get(task.description, [""]):
+                    self.storage.put(task.bucket, f"{task.prefix}{suffix}.tif", f"{task.id}{suffix}".encode())
+                record["written"] = True
+            status = {"id": task_id, "state": state}
+            if state == "FAILED":
+                status["error_message"] = "Export failed (scripted)"
+            statuses.append(status)
+        return statuses
+
+class FakeBlob:
+    def __init__(self, client, name, data):
+        self.client = client
+        self.name = name
+        self.data = data
+        self.size = len(data)
+
+    def download_to_filename(self, path):
+        self.client.downloads += 1
+        with open(path, "wb") as handle:
+            handle.write(self.data)
+
+class FakeStorageClient:
+    def __init__(self):
+        self.buckets = {}
+        self.downloads = 0
+
+    def put(self, bucket, name, data):
+        self.buckets.setdefault(bucket, {})[name] = FakeBlob(self, name, data)
+
+    def list_blobs(self, bucket, prefix=""):
+        return [blob for name, blob in self.buckets.get(bucket, {}).items() if name.startswith(prefix)]
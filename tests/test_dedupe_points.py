@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from dedupe_points import aggregate_frame, snap_keys
+
+def test_snap_keys_do_not_overflow_for_tiny_tolerance():
+    # 1e-12 degree cells over a continent would overflow a combined int64 key
+    x = np.array([-125.0, 67.0, -125.0, 67.0, 0.0])
+    y = np.array([25.0, 49.0, 49.0, 25.0, 25.0])
+    keys = snap_keys(x, y, tolerance=1e-12)
+    assert len(np.unique(keys)) == len(x)
+    repeated = snap_keys(np.r_[x, x], np.r_[y, y], tolerance=1e-12)
+    assert np.array_equal(repeated[:len(x)], repeated[len(x):])
+
+def test_aggregate_frame_keeps_other_columns():
+    df = pd.DataFrame({"x": [1.0, 1.00001, 2.0], "y": [5.0, 5.0, 6.0], "value": [10.0, 20.0, 30.0],
+                       "line": ["L10", "L20", "L30"], "fid": [1, 2, 3]})
+    merged = aggregate_frame(df, tolerance=1e-4, count_column="count")
+    assert list(merged.columns) == ["x", "y", "value", "line", "fid", "count"]
+    assert merged["value"].tolist() == [15.0, 30.0]
+    assert merged["line"].tolist() == ["L10", "L30"]
+    assert merged["count"].tolist() == [2, 1]
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from despike import despike_survey
+
+NOISE_SIGMA = 0.5
+
+# Clean lines of Gaussian noise, with min_amplitude off so only the robust sigma decides
+def noisy_lines(lines=200, samples=1000, seed=1):
+    rng = np.random.default_rng(seed)
+    line = np.repeat(np.arange(lines), samples)
+    fid = np.tile(np.arange(samples), lines)
+    return pd.DataFrame({"line": line, "fid": fid, "lat": 37.0 + line * 0.01, "long": -112.0 + fid * 1e-4,
+                         "corrected_magnetic": rng.normal(0.0, NOISE_SIGMA, len(line))})
+
+@pytest.mark.parametrize("window", [9, 15, 21])
+def test_clean_lines_give_true_sigma_and_no_flags(window):
+    despiked, stats = despike_survey(noisy_lines(), window=window, min_amplitude=0.0, replace=False)
+    assert stats["median_sigma"].median() == pytest.approx(NOISE_SIGMA, rel=0.05)
+    assert despiked["spike"].mean() < 1e-4
+
+def test_spikes_are_found():
+    survey = noisy_lines()
+    rng = np.random.default_rng(2)
+    spikes = rng.choice(len(survey) // 20, 300, replace=False) * 20 + 10
+    survey.loc[spikes, "corrected_magnetic"] += rng.choice([-1.0, 1.0], len(spikes)) * 20 * NOISE_SIGMA
+    despiked, _ = despike_survey(survey, min_amplitude=0.0)
+    flagged = despiked["spike"].to_numpy()
+    assert flagged[spikes].mean() >= 0.98
+    assert flagged.sum() - flagged[spikes].sum() <= 5
+    assert np.abs(despiked.loc[spikes, "corrected_magnetic"]).max() < 5 * NOISE_SIGMA
@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import pytest
+
+import ee_export_manager
+from ee_export_manager import add_export, load_ledger, run_exports_async
+from fake_ee import FakeEE, FakeStorageClient, FakeTask
+
+FAST = {"poll_interval": 0.001, "max_poll_interval": 0.004}
+
+def drive_jobs(names):
+    jobs = []
+    for name in names:
+        add_export(jobs, name, image=None, scale=30)
+    return jobs
+
+def run(jobs, ee, ledger_path, **options):
+    return asyncio.run(run_exports_async(jobs, ee, ledger_path=str(ledger_path), **{**FAST, **options}))
+
+def test_concurrency_cap(tmp_path):
+    names = [f"job{i}" for i in range(6)]
+    ee = FakeEE({name: [["READY", "RUNNING", "RUNNING", "COMPLETED"]] for name in names})
+    results = run(drive_jobs(names), ee, tmp_path / "ledger.json", max_concurrent=2)
+    assert ee.max_active == 2
+    assert all(entry["state"] == "COMPLETED" for entry in results.values())
+
+def test_polling_backs_off(tmp_path, monkeypatch):
+    waits = []
+    sleep = asyncio.sleep
+    async def recording_sleep(delay):
+        waits.append(delay)
+        await sleep(0)
+    monkeypatch.setattr(ee_export_manager.asyncio, "sleep", recording_sleep)
+    ee = FakeEE({"B4": [["READY"] + ["RUNNING"] * 5 + ["COMPLETED"]]})
+    results = run(drive_jobs(["B4"]), ee, tmp_path / "ledger.json", poll_interval=1.0, max_poll_interval=4.0)
+    assert results["B4"]["state"] == "COMPLETED"
+    assert waits == [1.0, 2.0, 4.0, 4.0, 4.0, 4.0, 4.0]
+    assert ee.polls["B4-0"] == 7
+
+def test_failed_task_is_resubmitted(tmp_path):
+    ee = FakeEE({"B4": [["READY", "RUNNING", "FAILED"], ["READY", "RUNNING", "COMPLETED"]],
+                 "B5": [["FAILED"]] * 3})
+    results = run(drive_jobs(["B4", "B5"]), ee, tmp_path / "ledger.json", max_attempts=3)
+    assert results["B4"]["state"] == "COMPLETED"
+    assert results["B4"]["attempts"] == 2 and results["B4"]["task_id"] == "B4-1"
+    assert results["B5"]["state"] == "GAVE_UP"
+    assert ee.attempts == {"B4": 2, "B5": 3}
+
+def test_interrupted_run_resumes_from_ledger(tmp_path):
+    ledger_path = tmp_path / "ledger.json"
+    ee = FakeEE({"done": [["COMPLETED"]], "running": [["RUNNING", "RUNNING", "COMPLETED"]],
+                 "pending": [["READY", "COMPLETED"]]})
+    # State left by a run that was killed: one job finished, one task still running, one never submitted
+    ee.start(FakeTask(ee, "done", None, "done"))
+    ee.start(FakeTask(ee, "running", None, "running"))
+    ledger_path.write_text(json.dumps({"jobs": {
+        "done": {"state": "COMPLETED", "attempts": 1, "task_id": "done-0"},
+        "running": {"state": "RUNNING", "attempts": 1, "task_id": "running-0"}}}))
+
+    results = run(drive_jobs(["done", "running", "pending"]), ee, ledger_path)
+    assert {name: entry["state"] for name, entry in results.items()} == \
+        {"done": "COMPLETED", "running": "COMPLETED", "pending": "COMPLETED"}
+    # The running task was polled by id rather than submitted again
+    assert ee.attempts == {"done": 1, "running": 1, "pending": 1}
+    assert ee.polls["done-0"] == 0 and ee.polls["running-0"] == 3
+    assert load_ledger(str(ledger_path))["jobs"]["pending"]["state"] == "COMPLETED"
+
+    # A second run finds everything finished and touches nothing
+    run(drive_jobs(["done", "running", "pending"]), ee, ledger_path)
+    assert ee.attempts == {"done": 1, "running": 1, "pending": 1}
+
+def test_given_up_jobs_are_retried_on_the_next_run(tmp_path):
+    ledger_path = tmp_path / "ledger.json"
+    ee = FakeEE({"B4": [["FAILED"], ["FAILED"], ["READY", "COMPLETED"]]})
+    results = run(drive_jobs(["B4"]), ee, ledger_path, max_attempts=2)
+    assert results["B4"]["state"] == "GAVE_UP" and ee.attempts == {"B4": 2}
+
+    # Asked not to, a later run leaves the job given up without submitting it
+    results = run(drive_jobs(["B4"]), ee, ledger_path, max_attempts=2, retry_gave_up=False)
+    assert results["B4"]["state"] == "GAVE_UP" and ee.attempts == {"B4": 2}
+
+    # By default the job gets a fresh set of attempts
+    results = run(drive_jobs(["B4"]), ee, ledger_path, max_attempts=2)
+    assert results["B4"]["state"] == "COMPLETED"
+    assert results["B4"]["attempts"] == 1 and results["B4"]["task_id"] == "B4-2"
+    assert load_ledger(str(ledger_path))["jobs"]["B4"]["state"] == "COMPLETED"
+
+def test_completed_exports_download_every_shard(tmp_path, monkeypatch):
+    monkeypatch.setattr(ee_export_manager, "mirror_path",
+                        lambda url, mirror_dir=None: str(tmp_path / "mirror" / url.replace("gs://", "")))
+    storage = FakeStorageClient()
+    # A stale object from another export sharing the prefix stem must not be picked up
+    storage.put("exports", "0412_B4_old.tif", b"stale")
+    ee = FakeEE({"B4": [["READY", "COMPLETED"]], "B5": [["READY", "COMPLETED"]]}, storage=storage,
+                shards={"B4": ["-0000000000-0000000000", "-0000000000-0000032768"]})
+    jobs = []
+    add_export(jobs, "B4", None, destination="gcs", bucket="exports", prefix="0412_B4")
+    add_export(jobs, "B5", None, destination="gcs", bucket="exports", prefix="0412_B5")
+    ledger_path = tmp_path / "ledger.json"
+
+    results = run(jobs, ee, ledger_path, storage_client=storage)
+    assert results["B4"]["state"] == "DOWNLOADED"
+    assert [path.rsplit("/", 1)[1] for path in results["B4"]["local_paths"]] == \
+        ["0412_B4-0000000000-0000000000.tif", "0412_B4-0000000000-0000032768.tif"]
+    assert [path.rsplit("/", 1)[1] for path in results["B5"]["local_paths"]] == ["0412_B5.tif"]
+    with open(results["B5"]["local_paths"][0], "rb") as handle:
+        assert handle.read() == b"B5-0"
+    assert storage.downloads == 3
+
+def test_missing_artifacts_leave_job_completed(tmp_path):
+    ee = FakeEE({"B4": [["COMPLETED"]]})
+    jobs = []
+    add_export(jobs, "B4", None, destination="gcs", bucket="exports", prefix="0412_B4")
+    results = run(jobs, ee, tmp_path / "ledger.json", storage_client=FakeStorageClient())
+    assert results["B4"]["state"] == "COMPLETED"
+    assert "local_paths" not in results["B4"]
+
+def test_gcs_export_needs_bucket():
+    with pytest.raises(ValueError):
+        add_export([], "B4", None, destination="gcs")
@@ -0,0 +1,49 @@
+import importlib
+
+import numpy as np
+import pytest
+
+from synthetic_surveys import generate_flight_line_survey, generate_gravity_stations
+
+RELOADED = ("precision", "gridding", "tile_cache")
+
+@pytest.fixture
+def use_precision(monkeypatch):
+    # Re-import the modules that read AIRBORNE_PRECISION at import time
+    def load(precision):
+        monkeypatch.setenv("AIRBORNE_PRECISION", precision)
+        return {name: importlib.reload(importlib.import_module(name)) for name in RELOADED}
+    yield load
+    monkeypatch.undo()
+    for name in RELOADED:
+        importlib.reload(importlib.import_module(name))
+
+def test_float32_grids_match_float64(use_precision):
+    stations = generate_gravity_stations(5000, seed=1)
+    survey = generate_flight_line_survey(20000, seed=1)
+    extent = (stations['x'].min(), stations['x'].max(), stations['y'].min(), stations['y'].max())
+    results = {}
+    for precision in ("float64", "float32"):
+        gridding = use_precision(precision)["gridding"]
+        results[precision] = {
+            "cubic": gridding.interpolate_to_grid(stations, *extent, grid_size=(200, 200))[2],
+            "linear": gridding.perform_interpolation_with_extrapolation(survey, grid_size=(200, 150))[2],
+        }
+    for method in ("cubic", "linear"):
+        single, double = results["float32"][method], results["float64"][method]
+        assert single.dtype == np.float32 and double.dtype == np.float64
+        # Well inside the 0.1 nT / 0.1 mGal precision of the source data
+        assert np.nanmax(np.abs(single.astype(np.float64) - double)) < 0.01
+
+def test_tile_cache_follows_precision(use_precision, tmp_path):
+    stations = generate_gravity_stations(2000, seed=1)
+    roi = (-113.2, -112.9, 37.6, 37.9)
+    grids = {}
+    for precision in ("float64", "float32"):
+        tile_cache = use_precision(precision)["tile_cache"]
+        grids[precision] = tile_cache.grid_roi_cached(stations, *roi, resolution=0.005, method='linear',
+                                                      tile_size=32, cache_dir=str(tmp_path))[2]
+        tiles = list(tmp_path.glob("*/*.npy"))
+        assert tiles and all(np.load(path).dtype == np.dtype(precision) for path in tiles)
+    assert grids["float64"].dtype == np.float64 and grids["float32"].dtype == np.float32
+    np.testing.assert_allclose(grids["float32"], grids["float64"], atol=0.01)
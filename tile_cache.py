@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+from scipy import interpolate
+from scipy.spatial import cKDTree
+
+from dedupe_points import SNAP_TOLERANCE, aggregate_frame
+from grid_spec import data_spacing
+from potential_filters import METERS_PER_DEGREE
+from precision import VALUE_DTYPE, broadcast_grid, grid_axes
+from stage_timing import stage
+
+# Incremental tile cache for gridded ROIs. Grid nodes sit on a global lattice
+# (node i is at i * resolution degrees), and the lattice is cut into fixed
+# tile_size x tile_size tiles. Each tile is gridded from the points inside it plus
+# a halo around it, so its values depend only on the dataset and the tile, never on
+# the ROI that first asked for it:
+#
+#   ~/.airborne_tile_cache/
+#       <dataset_version>_<method>_<resolution>/
+#           tiles.json                  (tile size, halo and dataset description)
+#           <tile_row>_<tile_col>.npy   (rows follow latitude, south first)
+#
+# A new ROI is assembled from cached tiles and only the missing tiles are gridded,
+# so panning or growing an ROI costs in proportion to the new area. Duplicate points
+# are merged before gridding (dedupe_points.py). Tiles are stored in the working
+# precision (precision.py); the snap tolerance and value dtype are recorded in
+# tiles.json and tiles made with a different tolerance or dtype are discarded.
+#
+# Points are binned by tile once (one sort), so each tile only looks at the points
+# of the bins its halo reaches instead of scanning the whole dataset. The halo
+# defaults to HALO_SPACINGS times the measured data spacing (the flight-line spacing
+# when the data has line labels, grid_spec.data_spacing), and never less than
+# DEFAULT_HALO_CELLS. Tiles are still gridded independently: where the data is much
+# sparser than the survey's median spacing, a tile's halo can miss points its
+# neighbour used and a seam can remain there.
+
+TILE_CACHE_DIR = os.environ.get("AIRBORNE_TILE_CACHE", os.path.expanduser("~/.airborne_tile_cache"))
+DEFAULT_TILE_SIZE = 256
+DEFAULT_HALO_CELLS = 32
+HALO_SPACINGS = 2.0
+MAX_HALO_CELLS = 1024
+
+# Function to fingerprint a point dataset so cached tiles are tied to its exact contents
+def dataset_version(data, columns=('x', 'y', 'value')):
+    hashed = pd.util.hash_pandas_object(pd.DataFrame(data)[list(columns)], index=False)
+    return hashlib.sha1(hashed.to_numpy().tobytes()).hexdigest()[:16]
+
+# Function to return the cache folder for a (dataset version, method, resolution) key
+def cache_key_dir(version, method, resolution, cache_dir=TILE_CACHE_DIR):
+    key = f"{version}_{method}_{resolution:.8g}"
+    return os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", key))
+
+# Function to return the inclusive global node index range covering [low, high]
+def node_range(low, high, resolution):
+    return int(np.floor(low / resolution + 1e-9)), int(np.ceil(high / resolution - 1e-9))
+
+# Function to return the inclusive tile index range covering a node range
+def tile_range(first_node, last_node, tile_size):
+    return first_node // tile_size, last_node // tile_size
+
+# Function to choose the halo in cells from the measured data spacing
+# line (flight-line labels) may be None for scattered stations.
+def auto_halo_cells(x, y, resolution, line=None, tile_size=DEFAULT_TILE_SIZE):
+    spacing, _ = data_spacing(y, x, line)
+    if not spacing:
+        return DEFAULT_HALO_CELLS
+    cells = int(np.ceil(HALO_SPACINGS * spacing / METERS_PER_DEGREE / resolution))
+    return int(np.clip(cells, DEFAULT_HALO_CELLS, max(MAX_HALO_CELLS, DEFAULT_HALO_CELLS)))
+
+# Function to sort points by the tile they fall in; returns the binning used by tile_points
+def bin_points(x, y, resolution, tile_size):
+    tile_rows = np.floor(y / (resolution * tile_size)).astype(np.int64)
+    tile_cols = np.floor(x / (resolution * tile_size)).astype(np.int64)
+    row_first, col_first = int(tile_rows.min()), int(tile_cols.min())
+    cols = int(tile_cols.max()) - col_first + 1
+    keys = (tile_rows - row_first) * cols + (tile_cols - col_first)
+    order = np.argsort(keys, kind='stable')
+    return {"order": order, "keys": keys[order], "row_first": row_first, "rows": int(tile_rows.max()) - row_first + 1,
+            "col_first": col_first, "cols": cols}
+
+# Function to return the indices of the points in the tiles within reach of a tile
+def tile_points(bins, tile_row, tile_col, reach):
+    col_low = max(tile_col - reach - bins["col_first"], 0)
+    col_high = min(tile_col + reach - bins["col_first"], bins["cols"] - 1)
+    row_low = max(tile_row - reach - bins["row_first"], 0)
+    row_high = min(tile_row + reach - bins["row_first"], bins["rows"] - 1)
+    if col_low > col_high or row_low > row_high:
+        return np.empty(0, dtype=np.int64)
+    # Within one row of tiles the reachable columns are one contiguous run of sorted keys
+    rows = np.arange(row_low, row_high + 1)
+    starts = np.searchsorted(bins["keys"], rows * bins["cols"] + col_low, side='left')
+    stops = np.searchsorted(bins["keys"], rows * bins["cols"] + col_high, side='right')
+    return np.concatenate([bins["order"][start:stop] for start, stop in zip(starts, stops)])
+
+# Function to grid one tile from the points in and around it
+# candidates (indices from tile_points) limits the search for halo points; nodes
+# the interpolator leaves empty are filled from the nearest point in the whole
+# dataset, so tiles with no nearby data still match a full-extent run.
+def grid_tile(x, y, value, tree, tile_row, tile_col, resolution, tile_size, halo_cells, method, candidates=None):
+    lat_nodes = (tile_row * tile_size + np.arange(tile_size)) * resolution
+    long_nodes = (tile_col * tile_size + np.arange(tile_size)) * resolution
+    halo = halo_cells * resolution
+    near = np.arange(len(value)) if candidates is None else candidates
+    near_x, near_y = x[near], y[near]
+    # Keep the input order so the triangulation is the same as with a full scan
+    inside = np.sort(near[(near_y >= lat_nodes[0] - halo) & (near_y <= lat_nodes[-1] + halo) &
+                          (near_x >= long_nodes[0] - halo) & (near_x <= long_nodes[-1] + halo)])
+    grid_x, grid_y = np.meshgrid(long_nodes, lat_nodes)
+
+    tile = np.full(grid_x.shape, np.nan)
+    if len(inside) >= 4:
+        try:
+            tile = interpolate.griddata((x[inside], y[inside]), value[inside], (grid_x, grid_y), method=method)
+        except Exception as e:
+            # Collinear or duplicate-only halos cannot be triangulated
+            print(f"Tile {tile_row},{tile_col}: {method} interpolation failed ({e}), using nearest")
+
+    nan_mask = np.isnan(tile)
+    if np.any(nan_mask):
+        _, nearest = tree.query(np.column_stack((grid_x[nan_mask], grid_y[nan_mask])))
+        tile[nan_mask] = value[nearest]
+    return tile.astype(VALUE_DTYPE)
+
+# Function to grid an ROI from cached tiles, computing only the tiles that are missing
+# data has x (longitude), y (latitude) and value columns like interpolate_to_grid.
+# Returns lattice-aligned grid_x, grid_y, grid_z with rows following latitude; pass
+# grid_size=(rows, cols) to resample onto an exact linspace grid over the ROI instead.
+# halo_cells=None measures the halo from the data spacing (auto_halo_cells); an
+# existing cache keeps the halo it was built with.
+def grid_roi_cached(data, lon_min, lon_max, lat_min, lat_max, resolution, method='cubic', grid_size=None,
+                    version=None, tile_size=DEFAULT_TILE_SIZE, halo_cells=None, cache_dir=TILE_CACHE_DIR):
+    version = version or dataset_version(data)
+    data = aggregate_frame(data)
+    x = data['x'].to_numpy(dtype=np.float64)
+    y = data['y'].to_numpy(dtype=np.float64)
+    value = data['value'].to_numpy(dtype=np.float64)
+    key_dir = cache_key_dir(version, method, resolution, cache_dir)
+    manifest = os.path.join(key_dir, "tiles.json")
+    if os.path.exists(manifest):
+        with open(manifest) as handle:
+            described = json.load(handle)
+        if (described.get("snap_tolerance") != SNAP_TOLERANCE or described.get("value_dtype", "float32") != VALUE_DTYPE.name
+                or described.get("tile_size") != tile_size
+                or halo_cells not in (None, described.get("halo_cells"))):
+            print(f"Tiles in {key_dir} were gridded with other settings; discarding them")
+            shutil.rmtree(key_dir)
+        else:
+            halo_cells = described.get("halo_cells", DEFAULT_HALO_CELLS)
+    if halo_cells is None:
+        with stage("halo", rows_in=len(value)) as record:
+            halo_cells = auto_halo_cells(x, y, resolution, data['line'].to_numpy() if 'line' in data else None,
+                                         tile_size)
+            record["halo_cells"] = halo_cells
+    os.makedirs(key_dir, exist_ok=True)
+    if not os.path.exists(manifest):
+        with open(manifest, "w") as handle:
+            json.dump({"dataset_version": version, "method": method, "resolution": resolution,
+                       "tile_size": tile_size, "halo_cells": halo_cells, "points": len(value),
+                       "snap_tolerance": SNAP_TOLERANCE, "value_dtype": VALUE_DTYPE.name}, handle, indent=2)
+
+    row_first, row_last = node_range(lat_min, lat_max, resolution)
+    col_first, col_last = node_range(lon_min, lon_max, resolution)
+    tile_row_first, tile_row_last = tile_range(row_first, row_last, tile_size)
+    tile_col_first, tile_col_last = tile_range(col_first, col_last, tile_size)
+
+    mosaic = np.empty(((tile_row_last - tile_row_first + 1) * tile_size,
+                       (tile_col_last - tile_col_first + 1) * tile_size), dtype=VALUE_DTYPE)
+    tree = bins = None
+    # One extra ring of tiles covers points that round onto a bin edge
+    reach = halo_cells // tile_size + 1
+    hits = misses = 0
+    for tile_row in range(tile_row_first, tile_row_last + 1):
+        for tile_col in range(tile_col_first, tile_col_last + 1):
+            path = os.path.join(key_dir, f"{tile_row}_{tile_col}.npy")
+            cached = os.path.exists(path)
+            with stage("tile", method=method, cache_hit=cached, rows_out=tile_size * tile_size):
+                if cached:
+                    tile = np.load(path)
+                    hits += 1
+                else:
+                    if tree is None:
+                        tree = cKDTree(np.column_stack((x, y)))
+                        bins = bin_points(x, y, resolution, tile_size)
+                    tile = grid_tile(x, y, value, tree, tile_row, tile_col, resolution, tile_size, halo_cells, method,
+                                     tile_points(bins, tile_row, tile_col, reach))
+                    # Write through a temporary name so a crashed run never leaves a partial tile
+                    np.save(path + ".tmp.npy", tile)
+                    os.replace(path + ".tmp.npy", path)
+                    misses += 1
+            top = (tile_row - tile_row_first) * tile_size
+            left = (tile_col - tile_col_first) * tile_size
+            mosaic[top:top + tile_size, left:left + tile_size] = tile
+    print(f"Tile cache: {hits} tiles reused, {misses} tiles computed")
+
+    # Crop the mosaic to the ROI nodes
+    row_offset = row_first - tile_row_first * tile_size
+    col_offset = col_first - tile_col_first * tile_size
+    grid_z = np.ascontiguousarray(mosaic[row_offset:row_offset + row_last - row_first + 1,
+                                         col_offset:col_offset + col_last - col_first + 1])
+    lat_nodes = np.arange(row_first, row_last + 1) * resolution
+    long_nodes = np.arange(col_first, col_last + 1) * resolution
+
+    if grid_size is not None:
+        grid_x, grid_y = broadcast_grid(*grid_axes(lon_min, lon_max, lat_min, lat_max, grid_size))
+        with stage("resample", method='linear', rows_in=grid_z.size, rows_out=grid_x.size):
+            sampler = interpolate.RegularGridInterpolator((lat_nodes, long_nodes), grid_z, method='linear',
+                                                          bounds_error=False, fill_value=None)
+            grid_z = sampler((grid_y, grid_x)).astype(VALUE_DTYPE, copy=False)
+        return grid_x, grid_y, grid_z
+
+    grid_x, grid_y = broadcast_grid(long_nodes, lat_nodes)
+    return grid_x, grid_y, grid_z
+
+# Function to delete every cached tile set except the given dataset versions
+def prune_cache(keep_versions=(), cache_dir=TILE_CACHE_DIR):
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if not any(name.startswith(f"{version}_") for version in keep_versions):
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+            removed += 1
+    print(f"Removed {removed} cached tile sets from {cache_dir}")
+    return removed